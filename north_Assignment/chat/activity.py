@@ -0,0 +1,130 @@
+from bisect import bisect_right
+from collections import defaultdict
+
+from django.db import transaction
+from django.db.models import Case, F, Q, Value, When
+
+from .models import ChatRoom, Membership, Message
+
+PREVIEW_LENGTH = 100
+
+
+def preview(content):
+    return ' '.join(content.split())[:PREVIEW_LENGTH]
+
+
+def _sent_after(times, read_at):
+    """How many of the sorted ``times`` are after ``read_at``."""
+    if read_at is None:
+        return len(times)
+    return len(times) - bisect_right(times, read_at)
+
+
+def record_messages(messages):
+    """Fold newly saved ``messages`` into their rooms' summaries.
+
+    Updates each room's last message and activity time, and adds to each
+    participant's unread count the messages of others after their read
+    cursor. Must run in the transaction that saved the messages, and only
+    once per message: every path that saves messages goes through here.
+    """
+    by_room = defaultdict(list)
+    for message in messages:
+        by_room[message.room_id].append(message)
+
+    # In a fixed order, so concurrent batches lock rows alike
+    for room_id in sorted(by_room):
+        room_messages = by_room[room_id]
+        room_messages.sort(key=lambda m: m.created_at)
+        last = room_messages[-1]
+        # A batch can be saved after a later message was saved directly
+        ChatRoom.objects.filter(pk=room_id).filter(
+            Q(last_message_at__isnull=True) | Q(last_message_at__lte=last.created_at)
+        ).update(
+            last_message_at=last.created_at,
+            last_message_preview=preview(last.content),
+            last_message_user_id=last.user_id,
+            last_activity_at=last.created_at,
+        )
+
+        # Buffered messages can be older than a cursor set since they were
+        # sent; locked so no cursor moves while they are counted
+        times = [m.created_at for m in room_messages]
+        sent = defaultdict(list)
+        for message in room_messages:
+            sent[message.user_id].append(message.created_at)
+        increments = defaultdict(list)
+        members = Membership.objects.select_for_update().filter(room_id=room_id).order_by('pk')
+        for pk, user_id, read_at in members.values_list('id', 'user_id', 'last_read_at'):
+            count = _sent_after(times, read_at) - _sent_after(sent.get(user_id, []), read_at)
+            if count:
+                increments[count].append(pk)
+        if increments:
+            Membership.objects.filter(pk__in=[pk for pks in increments.values() for pk in pks]).update(
+                unread_count=F('unread_count') + Case(
+                    *[When(pk__in=pks, then=Value(count)) for count, pks in increments.items()],
+                    default=Value(0)
+                )
+            )
+
+
+def save_message(message):
+    """Save one message directly, with its room's summary."""
+    with transaction.atomic():
+        message.save()
+        record_messages([message])
+    return message
+
+
+def count_unread(room_id, user_id, read_at):
+    messages = Message.objects.filter(room_id=room_id).exclude(user_id=user_id)
+    if read_at is not None:
+        messages = messages.filter(created_at__gt=read_at)
+    return messages.count()
+
+
+def mark_read(room_id, user_id, message=None):
+    """Move a participant's read cursor forward to ``message`` and recount their unread messages.
+
+    ``message`` only needs its uuid and created_at, so it may still be
+    buffered. Without it the cursor moves to the room's latest saved
+    message. Cursors never move back. Returns the membership, or None if
+    the user is not a participant.
+    """
+    with transaction.atomic():
+        membership = Membership.objects.select_for_update().filter(room_id=room_id, user_id=user_id).first()
+        if membership is None:
+            return None
+        if message is None:
+            message = Message.objects.filter(room_id=room_id).order_by('-created_at', '-id').only('uuid', 'created_at').first()
+            if message is None:
+                return membership
+        if membership.last_read_at is not None and message.created_at <= membership.last_read_at:
+            return membership
+
+        membership.last_read_uuid = message.uuid
+        membership.last_read_at = message.created_at
+        # Recounted rather than adjusted, which also repairs any drift
+        membership.unread_count = count_unread(room_id, user_id, message.created_at)
+        membership.save(update_fields=['last_read_uuid', 'last_read_at', 'unread_count'])
+    return membership
+
+
+def reconcile_unread_counts(room_ids=None):
+    """Recount unread counts from the read cursors; returns how many were off.
+
+    Each room's memberships are locked as record_messages() locks them, so
+    messages saved meanwhile are counted exactly once.
+    """
+    rooms = ChatRoom.objects.order_by('pk').values_list('pk', flat=True)
+    if room_ids:
+        rooms = rooms.filter(pk__in=room_ids)
+    fixed = 0
+    for room_id in rooms.iterator():
+        with transaction.atomic():
+            for membership in Membership.objects.select_for_update().filter(room_id=room_id).order_by('pk'):
+                unread_count = count_unread(room_id, membership.user_id, membership.last_read_at)
+                if unread_count != membership.unread_count:
+                    Membership.objects.filter(pk=membership.pk).update(unread_count=unread_count)
+                    fixed += 1
+    return fixed
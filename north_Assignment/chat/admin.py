@@ -1,16 +1,21 @@
 from django.contrib import admin
-from .models import ChatRoom, Message
+from .models import ChatRoom, Membership, Message
+
+class MembershipInline(admin.TabularInline):
+    model = Membership
+    extra = 1
+    raw_id_fields = ('user',)
+    readonly_fields = ('unread_count',)
 
 @admin.register(ChatRoom)
 class ChatRoomAdmin(admin.ModelAdmin):
-    list_display = ('name', 'created_at', 'get_participants_count')
+    list_display = ('name', 'created_at', 'participant_count', 'last_message_at')
     search_fields = ('name', 'participants__username', 'participants__email')
-    filter_horizontal = ('participants',)
-    readonly_fields = ('created_at',)
-    
-    def get_participants_count(self, obj):
-        return obj.participants.count()
-    get_participants_count.short_description = 'Participants'
+    inlines = (MembershipInline,)
+    readonly_fields = (
+        'created_at', 'participant_count', 'last_message_at', 'last_message_preview',
+        'last_message_user', 'last_activity_at'
+    )
 
 @admin.register(Message)
 class MessageAdmin(admin.ModelAdmin):
@@ -1,80 +1,140 @@
+import datetime
 import json
+import uuid
 from channels.generic.websocket import AsyncWebsocketConsumer
 from channels.db import database_sync_to_async
-from django.contrib.auth.models import User
 from .models import ChatRoom, Message
+from .activity import mark_read, save_message
+from .history import MessageNotFound, find_message
+from .persistence import message_buffer
 
 class ChatConsumer(AsyncWebsocketConsumer):
+    """Chat in one room as the connection's authenticated user.
+
+    Who is talking and whether they may is settled once, in connect(), from
+    ``scope['user']``. After that a message is handed to the write-behind
+    buffer and broadcast, without waiting for the database; it is saved
+    directly only when the buffer is unavailable.
+
+    A ``{"type": "read"}`` frame moves the user's read cursor, to the message
+    with the given ``id`` or else to the last one delivered.
+    """
+
     async def connect(self):
         self.room_id = self.scope['url_route']['kwargs']['room_id']
         self.room_group_name = f'chat_{self.room_id}'
-        
+        self.user = self.scope.get('user')
+        self.room = None
+        # The last message sent to this client, the default for marking read
+        self.last_delivered = None
+
+        if self.user is None or not self.user.is_authenticated:
+            await self.close()
+            return
+
+        # Loads the room and checks membership in one query
+        self.room = await self.get_room()
+        if self.room is None:
+            await self.close()
+            return
+
         # Join room group
         await self.channel_layer.group_add(
             self.room_group_name,
             self.channel_name
         )
-        
+
         # Accept the connection
         await self.accept()
-    
+
     async def disconnect(self, close_code):
+        if self.room is None:
+            return
         # Leave room group
         await self.channel_layer.group_discard(
             self.room_group_name,
             self.channel_name
         )
-    
+
     # Receive message from WebSocket
     async def receive(self, text_data):
-        data = json.loads(text_data)
-        message = data['message']
-        user_id = data['user_id']
-        
-        # Save message to database
-        await self.save_message(user_id, message)
-        
+        try:
+            data = json.loads(text_data)
+            message = data.get('message')
+        except (ValueError, AttributeError):
+            data = message = None
+        if data is not None and data.get('type') == 'read':
+            await self.mark_read(data.get('id'))
+            return
+        if not isinstance(message, str) or not message.strip():
+            await self.send(text_data=json.dumps({'error': 'Message content is required'}))
+            return
+        # PostgreSQL text cannot hold them; such a message could never be saved
+        if '\x00' in message:
+            await self.send(text_data=json.dumps({'error': 'Message content cannot contain NUL characters'}))
+            return
+
+        # Made durable before anyone sees it: buffered, or saved if it cannot be
+        saved = Message(room_id=self.room.id, user_id=self.user.id, content=message)
+        if not await message_buffer.append(saved):
+            await self.save_message(saved)
+
         # Send message to room group
         await self.channel_layer.group_send(
             self.room_group_name,
             {
                 'type': 'chat_message',
+                'id': str(saved.uuid),
                 'message': message,
-                'user_id': user_id,
-                'username': await self.get_username(user_id)
+                'user_id': self.user.id,
+                'username': self.user.username,
+                'created_at': saved.created_at.isoformat(),
             }
         )
-    
+
+    async def mark_read(self, message_id):
+        """Move the user's read cursor to a message, by default the last one delivered here."""
+        message = self.last_delivered
+        # The last delivered message may still be buffered; any other is looked up
+        if message_id is not None and (message is None or str(message_id) != str(message.uuid)):
+            try:
+                message = await self.find_message(message_id)
+            except MessageNotFound as e:
+                await self.send(text_data=json.dumps({'error': str(e)}))
+                return
+        membership = await database_sync_to_async(mark_read)(self.room.id, self.user.id, message)
+        if membership is None:
+            await self.send(text_data=json.dumps({'error': 'You are not a participant in this chat room'}))
+            return
+        await self.send(text_data=json.dumps({
+            'type': 'read',
+            'last_read_id': membership.last_read_uuid and str(membership.last_read_uuid),
+            'unread_count': membership.unread_count,
+        }))
+
     # Receive message from room group
     async def chat_message(self, event):
-        message = event['message']
-        user_id = event['user_id']
-        username = event['username']
-        
+        self.last_delivered = Message(
+            uuid=uuid.UUID(event['id']),
+            created_at=datetime.datetime.fromisoformat(event['created_at'])
+        )
         # Send message to WebSocket
         await self.send(text_data=json.dumps({
-            'message': message,
-            'user_id': user_id,
-            'username': username
+            'id': event['id'],
+            'message': event['message'],
+            'user_id': event['user_id'],
+            'username': event['username'],
+            'created_at': event['created_at'],
         }))
-    
+
     @database_sync_to_async
-    def save_message(self, user_id, message):
-        try:
-            user = User.objects.get(id=user_id)
-            room = ChatRoom.objects.get(id=self.room_id)
-            Message.objects.create(
-                room=room,
-                user=user,
-                content=message
-            )
-        except (User.DoesNotExist, ChatRoom.DoesNotExist):
-            pass
-    
+    def get_room(self):
+        return ChatRoom.objects.filter(id=self.room_id, participants=self.user).only('id', 'name').first()
+
     @database_sync_to_async
-    def get_username(self, user_id):
-        try:
-            user = User.objects.get(id=user_id)
-            return user.username
-        except User.DoesNotExist:
-            return "Unknown User" 
\ No newline at end of file
+    def find_message(self, message_id):
+        return find_message(self.room.id, message_id)
+
+    @database_sync_to_async
+    def save_message(self, message):
+        save_message(message)
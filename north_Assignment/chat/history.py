@@ -0,0 +1,67 @@
+import uuid
+
+from django.db.models import Q
+
+from .models import Message
+
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 200
+
+
+class MessageNotFound(ValueError):
+    pass
+
+
+def find_message(room, message_id):
+    """A message of ``room`` (only id, uuid and created_at), given its id or uuid."""
+    message_id = str(message_id)
+    if message_id.isdigit():
+        lookup = {'id': int(message_id)}
+    else:
+        try:
+            lookup = {'uuid': uuid.UUID(message_id)}
+        except ValueError:
+            raise MessageNotFound(f'Invalid message id: {message_id}')
+    message = Message.objects.filter(room=room, **lookup).only('id', 'uuid', 'created_at').first()
+    if message is None:
+        raise MessageNotFound(f'Message not found: {message_id}')
+    return message
+
+
+def find_anchor(room, message_id):
+    """``(created_at, id)`` of a message of ``room``, given its id or uuid."""
+    message = find_message(room, message_id)
+    return message.created_at, message.id
+
+
+def message_page(room, before=None, after=None, limit=DEFAULT_PAGE_SIZE):
+    """Return ``(messages, has_more)``: up to ``limit`` messages, oldest first.
+
+    Without an anchor this is the latest page; ``before`` / ``after`` (a
+    message id or uuid) page back or forward from that message, and
+    ``has_more`` says whether there is more in that direction. Each page is
+    one range scan of the (room, created_at, id) index, so its cost does not
+    depend on the size of the room.
+    """
+    messages = Message.objects.filter(room=room).select_related('user')
+    if after is not None:
+        created_at, pk = find_anchor(room, after)
+        # The plain bound lets the index seek; the OR only settles ties
+        messages = messages.filter(created_at__gte=created_at).filter(
+            Q(created_at__gt=created_at) | Q(created_at=created_at, id__gt=pk)
+        ).order_by('created_at', 'id')
+    else:
+        if before is not None:
+            created_at, pk = find_anchor(room, before)
+            messages = messages.filter(created_at__lte=created_at).filter(
+                Q(created_at__lt=created_at) | Q(created_at=created_at, id__lt=pk)
+            )
+        messages = messages.order_by('-created_at', '-id')
+
+    # One extra row tells whether there is more
+    page = list(messages[:limit + 1])
+    has_more = len(page) > limit
+    page = page[:limit]
+    if after is None:
+        page.reverse()
+    return page, has_more
@@ -0,0 +1,143 @@
+import asyncio
+import math
+import time
+import uuid
+
+from asgiref.sync import async_to_sync
+from channels.routing import URLRouter
+from channels.testing import WebsocketCommunicator
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import override_settings
+
+from chat.models import ChatRoom, Message
+from chat.routing import websocket_urlpatterns
+
+
+def percentile(values, p):
+    """Nearest-rank percentile of already sorted ``values``."""
+    if not values:
+        return 0.0
+    rank = math.ceil(p / 100 * len(values))
+    return values[max(0, min(len(values), rank) - 1)]
+
+
+class Command(BaseCommand):
+    help = (
+        'Measure chat throughput: connections in one room each send messages over a WebSocket, '
+        'waiting for their own broadcast before sending the next. Reports messages per second '
+        'per connection, round-trip latency and database queries per message.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--connections', type=int, default=10, help='WebSocket connections in the room')
+        parser.add_argument('--messages', type=int, default=200, help='Messages sent per connection')
+        parser.add_argument(
+            '--redis', action='store_true',
+            help='Use the configured channel layer instead of an in-memory one'
+        )
+
+    def handle(self, *args, **options):
+        if options['connections'] < 1 or options['messages'] < 1:
+            raise CommandError('--connections and --messages must be positive')
+
+        overrides = {}
+        if not options['redis']:
+            # Every connection receives every broadcast, so queues must hold them all
+            capacity = options['connections'] * options['messages'] + 100
+            overrides['CHANNEL_LAYERS'] = {
+                'default': {'BACKEND': 'channels.layers.InMemoryChannelLayer', 'CONFIG': {'capacity': capacity}},
+            }
+
+        run_id = uuid.uuid4().hex[:12]
+        users = [
+            User.objects.create(username=f'bench-chat-{run_id}-{i}', email='bench-chat@example.com')
+            for i in range(options['connections'])
+        ]
+        room = ChatRoom.objects.create(name=f'bench-chat-{run_id}')
+        room.participants.add(*users)
+
+        queries = [0]
+
+        def count_queries(execute, sql, params, many, context):
+            queries[0] += 1
+            return execute(sql, params, many, context)
+
+        total = options['connections'] * options['messages']
+        try:
+            with override_settings(**overrides):
+                # Consumers' database calls run on this thread's connection
+                with connection.execute_wrapper(count_queries):
+                    rates, latencies, elapsed, sending_queries = async_to_sync(self._run)(users, room, options, queries)
+            saved, saved_after = self._wait_for_saved(room, total)
+        finally:
+            room.delete()
+            User.objects.filter(pk__in=[user.pk for user in users]).delete()
+
+        latencies.sort()
+        self.stdout.write(
+            f"{options['connections']} connections x {options['messages']} messages "
+            f"({'configured' if options['redis'] else 'in-memory'} channel layer, {settings.DATABASES['default']['ENGINE']})"
+        )
+        self.stdout.write(
+            f"{total / elapsed:.1f} msg/s total, "
+            f"{sum(rates) / len(rates):.1f} msg/s per connection (min {min(rates):.1f}), "
+            f"round trip p50 {percentile(latencies, 50) * 1000:.1f}ms p95 {percentile(latencies, 95) * 1000:.1f}ms "
+            f"p99 {percentile(latencies, 99) * 1000:.1f}ms, "
+            f"{sending_queries / total:.2f} queries per message"
+        )
+        self.stdout.write(f"{saved} of {total} messages saved {saved_after:.2f}s after the last send")
+
+    def _wait_for_saved(self, room, total):
+        """Give write-behind persistence up to its maximum lag to catch up."""
+        started = time.monotonic()
+        deadline = started + settings.CHAT_PERSIST_MAX_LAG + 1
+        while True:
+            saved = Message.objects.filter(room=room).count()
+            if saved >= total or time.monotonic() >= deadline:
+                return saved, time.monotonic() - started
+            time.sleep(0.05)
+
+    async def _run(self, users, room, options, queries):
+        app = URLRouter(websocket_urlpatterns)
+        communicators = []
+        try:
+            for user in users:
+                communicator = WebsocketCommunicator(app, f'/ws/chat/{room.id}/')
+                communicator.scope['user'] = user
+                connected, _ = await communicator.connect()
+                if not connected:
+                    raise CommandError(f'{user.username} could not join room {room.id}')
+                communicators.append(communicator)
+
+            before = queries[0]
+            started = time.perf_counter()
+            results = await asyncio.gather(*(
+                self._send(communicator, user, options['messages'])
+                for communicator, user in zip(communicators, users)
+            ))
+            elapsed = time.perf_counter() - started
+            sending_queries = queries[0] - before
+        finally:
+            for communicator in communicators:
+                await communicator.disconnect()
+
+        rates = [options['messages'] / client_elapsed for client_elapsed, _ in results]
+        latencies = [latency for _, client_latencies in results for latency in client_latencies]
+        return rates, latencies, elapsed, sending_queries
+
+    async def _send(self, communicator, user, count):
+        """Closed loop: send the next message once the previous one came back."""
+        latencies = []
+        started = time.perf_counter()
+        for i in range(count):
+            marker = f'{user.username}:{i}'
+            sent = time.perf_counter()
+            # user_id is only read by consumers that trust the client with it
+            await communicator.send_json_to({'message': marker, 'user_id': user.id})
+            while (await communicator.receive_json_from(timeout=30)).get('message') != marker:
+                pass
+            latencies.append(time.perf_counter() - sent)
+        return time.perf_counter() - started, latencies
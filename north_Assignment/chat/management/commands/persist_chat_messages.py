@@ -0,0 +1,42 @@
+import signal
+import threading
+
+from django.core.management.base import BaseCommand
+
+from chat.persistence import PersistenceWorker
+
+
+class Command(BaseCommand):
+    help = (
+        'Save buffered chat messages from the Redis stream into the database in batches. '
+        'Several workers may run at once; messages left unsaved by a crashed one are recovered.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--name', default=None, help='Consumer name in the stream group (default: host and pid)')
+        parser.add_argument('--batch-size', type=int, default=None, help='Most messages per INSERT (default: CHAT_PERSIST_BATCH_SIZE)')
+        parser.add_argument('--interval', type=float, default=None, help='Seconds a batch may wait to fill (default: CHAT_PERSIST_INTERVAL)')
+        parser.add_argument('--max-lag', type=float, default=None, help='Seconds a message may stay unsaved (default: CHAT_PERSIST_MAX_LAG)')
+
+    def handle(self, *args, **options):
+        worker = PersistenceWorker(
+            name=options['name'],
+            batch_size=options['batch_size'],
+            interval=options['interval'],
+            max_lag=options['max_lag'],
+        )
+        stop = threading.Event()
+        # Finish the batch in hand before exiting
+        for signum in (signal.SIGINT, signal.SIGTERM):
+            signal.signal(signum, lambda *args: stop.set())
+
+        self.stdout.write(
+            f"Persisting chat messages as {worker.name}: batches of up to {worker.batch_size}, "
+            f"every {worker.interval}s, max lag {worker.max_lag}s"
+        )
+        worker.run(stop)
+        stats = worker.stats
+        self.stdout.write(self.style.SUCCESS(
+            f"Saved {stats['saved']} messages in {stats['batches']} batches "
+            f"({stats['recovered']} recovered, {stats['dead_lettered']} dead-lettered), max lag {stats['max_lag']:.2f}s"
+        ))
@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+
+from chat.activity import reconcile_unread_counts
+
+
+class Command(BaseCommand):
+    help = (
+        'Recount the unread counts of chat participants from their read cursors. '
+        'The counts are kept up to date on write; this repairs any that drifted.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--room', type=int, action='append', help='Only this room (repeatable)')
+
+    def handle(self, *args, **options):
+        fixed = reconcile_unread_counts(options['room'])
+        self.stdout.write(f"Fixed {fixed} unread counts")
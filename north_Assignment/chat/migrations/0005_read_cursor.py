@@ -0,0 +1,41 @@
+# Generated by Django 5.2.18 on 2026-10-17 03:47
+
+from django.db import migrations, models
+
+# Each cursor goes to the newest message of others that its unread count
+# leaves read, so the counts stay as they are
+BACKFILL_SQL = """
+UPDATE chat_chatroom_participants p
+SET last_read_at = m.created_at, last_read_uuid = m.uuid
+FROM chat_chatroom_participants p2
+CROSS JOIN LATERAL (
+    SELECT created_at, uuid
+    FROM chat_message
+    WHERE room_id = p2.chatroom_id AND user_id <> p2.user_id
+    ORDER BY created_at DESC, id DESC
+    OFFSET p2.unread_count
+    LIMIT 1
+) m
+WHERE p.id = p2.id;
+"""
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0004_room_summary'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='membership',
+            name='last_read_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='membership',
+            name='last_read_uuid',
+            field=models.UUIDField(blank=True, null=True),
+        ),
+        migrations.RunSQL(BACKFILL_SQL, reverse_sql=migrations.RunSQL.noop),
+    ]
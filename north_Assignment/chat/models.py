@@ -1,25 +1,94 @@
+import uuid
+
 from django.db import models
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
 from django.contrib.auth.models import User
+from django.db.models.signals import m2m_changed, post_delete, post_save
+from django.dispatch import receiver
+from django.utils import timezone
 
 class ChatRoom(models.Model):
     name = models.CharField(max_length=255)
-    participants = models.ManyToManyField(User, related_name='chat_rooms')
+    participants = models.ManyToManyField(User, related_name='chat_rooms', through='Membership')
     created_at = models.DateTimeField(auto_now_add=True)
+    # Kept up to date on write (see activity.py) so the room list needs no
+    # joins to participants or messages
+    participant_count = models.PositiveIntegerField(default=0)
+    last_message_at = models.DateTimeField(null=True, blank=True)
+    last_message_preview = models.CharField(max_length=100, blank=True, default='')
+    last_message_user = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True, related_name='+')
+    # Time of the last message, or of creation for a room without any
+    last_activity_at = models.DateTimeField(default=timezone.now)
     
     def __str__(self):
         return self.name
     
     class Meta:
-        ordering = ['-created_at']
+        ordering = ['-last_activity_at', '-id']
+        indexes = [
+            models.Index(fields=['-last_activity_at', '-id'], name='chat_room_activity'),
+        ]
+
+class Membership(models.Model):
+    """A participant of a room, with their own view of it."""
+    # The table Django made for ChatRoom.participants before this model
+    room = models.ForeignKey(ChatRoom, on_delete=models.CASCADE, related_name='memberships', db_column='chatroom_id')
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='chat_memberships')
+    # Read cursor: the last message read, by uuid since it may not be saved
+    # yet, and when it was sent. Later messages of others are unread.
+    last_read_uuid = models.UUIDField(null=True, blank=True)
+    last_read_at = models.DateTimeField(null=True, blank=True)
+    # Messages of others after the cursor, kept up to date on write
+    unread_count = models.PositiveIntegerField(default=0)
+    
+    def __str__(self):
+        return f"{self.user.username} in {self.room.name}"
+    
+    class Meta:
+        db_table = 'chat_chatroom_participants'
+        unique_together = [('room', 'user')]
 
 class Message(models.Model):
-    room = models.ForeignKey(ChatRoom, on_delete=models.CASCADE, related_name='messages')
+    # Assigned when the message is sent, so a batch replayed after a crash
+    # of the persistence worker cannot insert it twice (see persistence.py)
+    uuid = models.UUIDField(default=uuid.uuid4, unique=True, editable=False)
+    # Indexed by the (room, created_at, id) index below
+    room = models.ForeignKey(ChatRoom, on_delete=models.CASCADE, related_name='messages', db_index=False)
     user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='chat_messages')
     content = models.TextField()
-    created_at = models.DateTimeField(auto_now_add=True)
+    # Time sent, not time saved: messages may be persisted in later batches
+    created_at = models.DateTimeField(default=timezone.now)
     
     def __str__(self):
         return f"{self.user.username}: {self.content[:20]}..."
     
     class Meta:
         ordering = ['created_at']
+        indexes = [
+            # Keyset pagination of a room's history (see history.py)
+            models.Index(fields=['room', 'created_at', 'id'], name='chat_message_room_created'),
+        ]
+
+
+
+def update_participant_counts(room_ids):
+    """Recount ChatRoom.participant_count of ``room_ids``."""
+    counts = Membership.objects.filter(room=OuterRef('pk')).order_by().values('room').annotate(n=Count('id')).values('n')
+    ChatRoom.objects.filter(pk__in=room_ids).update(participant_count=Coalesce(Subquery(counts), 0))
+
+@receiver(m2m_changed, sender=Membership)
+def participants_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    if action == 'pre_clear' and reverse:
+        # user.chat_rooms.clear(): which rooms is only known beforehand
+        instance._cleared_room_ids = list(instance.chat_memberships.values_list('room_id', flat=True))
+    elif action == 'post_clear':
+        update_participant_counts(getattr(instance, '_cleared_room_ids', []) if reverse else [instance.pk])
+    elif action in ('post_add', 'post_remove'):
+        update_participant_counts(pk_set if reverse else [instance.pk])
+
+@receiver([post_save, post_delete], sender=Membership)
+def membership_changed(sender, instance, created=True, **kwargs):
+    # Changes of a membership itself, such as its unread count, do not matter
+    if created:
+        update_participant_counts([instance.room_id])
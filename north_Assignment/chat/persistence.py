@@ -0,0 +1,318 @@
+import asyncio
+import datetime
+import logging
+import os
+import socket
+import time
+import uuid
+import weakref
+
+import redis
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.db import (
+    DataError,
+    IntegrityError,
+    InterfaceError,
+    OperationalError,
+    close_old_connections,
+    connection,
+    transaction,
+)
+from redis import asyncio as aioredis
+
+from .activity import record_messages
+from .models import ChatRoom, Message
+
+logger = logging.getLogger(__name__)
+
+STREAM = 'chat:messages'
+GROUP = 'chat-persist'
+# Entries that can never be saved, with the reason, for inspection
+DEAD_LETTER_STREAM = 'chat:messages:dead'
+# Set by a running worker and expiring after CHAT_PERSIST_MAX_LAG; without it
+# consumers save messages themselves
+HEARTBEAT_KEY = 'chat:persist:heartbeat'
+
+
+def encode_message(message):
+    return {
+        'uuid': str(message.uuid),
+        'room_id': message.room_id,
+        'user_id': message.user_id,
+        'content': message.content,
+        'created_at': message.created_at.isoformat(),
+    }
+
+
+def decode_message(fields):
+    fields = {key.decode(): value.decode() for key, value in fields.items()}
+    return Message(
+        uuid=uuid.UUID(fields['uuid']),
+        room_id=int(fields['room_id']),
+        user_id=int(fields['user_id']),
+        content=fields['content'],
+        created_at=datetime.datetime.fromisoformat(fields['created_at']),
+    )
+
+
+class MessageBuffer:
+    """Write-behind buffer between chat consumers and the Message table.
+
+    Messages are appended to a Redis stream that PersistenceWorker drains
+    into the database in batches. append() returns False when the message
+    has to be saved directly instead: write-behind is disabled, Redis is
+    unreachable or no worker has been alive for CHAT_PERSIST_MAX_LAG.
+    """
+
+    def __init__(self):
+        # redis.asyncio clients belong to the event loop they were made in
+        self._clients = weakref.WeakKeyDictionary()
+        self._worker_alive = False
+        self._checked_at = None
+
+    def _client(self):
+        loop = asyncio.get_running_loop()
+        client = self._clients.get(loop)
+        if client is None:
+            client = self._clients[loop] = aioredis.Redis.from_url(settings.CHAT_REDIS_URL)
+        return client
+
+    async def _worker_running(self, client):
+        # Checked a few times per lag window rather than on every message
+        now = time.monotonic()
+        if self._checked_at is None or now - self._checked_at >= settings.CHAT_PERSIST_MAX_LAG / 4:
+            self._worker_alive = bool(await client.exists(HEARTBEAT_KEY))
+            self._checked_at = now
+        return self._worker_alive
+
+    async def append(self, message):
+        if not settings.CHAT_WRITE_BEHIND:
+            return False
+        try:
+            client = self._client()
+            if not await self._worker_running(client):
+                return False
+            await client.xadd(STREAM, encode_message(message))
+            return True
+        except redis.RedisError as e:
+            logger.warning(f"Chat write-behind unavailable, saving directly: {str(e)}")
+            return False
+
+
+message_buffer = MessageBuffer()
+
+
+def insert_messages(messages):
+    """INSERT ``messages`` in one statement, skipping uuids already saved.
+
+    Returns the messages actually inserted, by ``RETURNING``: unlike a
+    check made beforehand, this stays right when another transaction is
+    inserting the same messages at the same time.
+    """
+    # A row may not be inserted twice by one statement
+    messages = list({message.uuid: message for message in messages}.values())
+    if not messages:
+        return []
+    meta = Message._meta
+    fields = [meta.get_field(name) for name in ('uuid', 'room', 'user', 'content', 'created_at')]
+    qn = connection.ops.quote_name
+    row = f"({', '.join(['%s'] * len(fields))})"
+    sql = (
+        f"INSERT INTO {qn(meta.db_table)} ({', '.join(qn(field.column) for field in fields)}) "
+        f"VALUES {', '.join([row] * len(messages))} "
+        f"ON CONFLICT ({qn('uuid')}) DO NOTHING RETURNING {qn('uuid')}"
+    )
+    params = [
+        field.get_db_prep_save(getattr(message, field.attname), connection)
+        for message in messages
+        for field in fields
+    ]
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+        inserted = {uuid.UUID(str(value)) for value, in cursor.fetchall()}
+    return [message for message in messages if message.uuid in inserted]
+
+
+class PersistenceWorker:
+    """Drains the message stream into Message with bulk inserts.
+
+    A batch is written once ``batch_size`` messages are waiting or
+    ``interval`` seconds after its first one, whichever comes first.
+    Entries are acknowledged and deleted only after their batch is saved,
+    so a worker that dies mid-batch leaves them pending; any worker claims
+    entries pending for longer than ``max_lag`` and saves them again, and
+    the unique Message.uuid turns the second insert into a no-op.
+
+    An entry the database rejects outright is isolated by splitting its
+    batch and moved to DEAD_LETTER_STREAM, so it cannot hold up the rest.
+    While the database is unreachable batches stay pending and are retried.
+    """
+
+    def __init__(self, client=None, name=None, batch_size=None, interval=None, max_lag=None):
+        self.client = client or redis.Redis.from_url(settings.CHAT_REDIS_URL)
+        self.name = name or f'{socket.gethostname()}-{os.getpid()}'
+        self.batch_size = batch_size or settings.CHAT_PERSIST_BATCH_SIZE
+        self.max_lag = max_lag or settings.CHAT_PERSIST_MAX_LAG
+        # A batch must be written, and the heartbeat renewed, well within max_lag
+        self.interval = min(interval or settings.CHAT_PERSIST_INTERVAL, self.max_lag / 2)
+        self.stats = {'saved': 0, 'batches': 0, 'recovered': 0, 'dead_lettered': 0, 'max_lag': 0.0}
+
+    def setup(self):
+        try:
+            self.client.xgroup_create(STREAM, GROUP, id='0', mkstream=True)
+        except redis.ResponseError as e:
+            if 'BUSYGROUP' not in str(e):
+                raise
+
+    def heartbeat(self):
+        self.client.set(HEARTBEAT_KEY, self.name, px=int(self.max_lag * 1000))
+
+    def run(self, stop):
+        """Persist messages until the ``stop`` event is set."""
+        ready = False
+        next_recovery = 0
+        while not stop.is_set():
+            try:
+                if not ready:
+                    self.setup()
+                    ready = True
+                self.heartbeat()
+                # Between batches, never inside flush(): that may run in a
+                # caller's transaction, whose connection must stay open
+                close_old_connections()
+                if time.monotonic() >= next_recovery:
+                    self.recover()
+                    next_recovery = time.monotonic() + self.max_lag
+                entries = self.read()
+                if entries:
+                    self.flush(entries)
+            except redis.ConnectionError as e:
+                # Unacknowledged entries stay pending and are recovered later
+                logger.error(f"Lost connection to Redis, retrying: {str(e)}")
+                stop.wait(1)
+            except (OperationalError, InterfaceError) as e:
+                # As above; the connection is replaced before the next batch
+                logger.error(f"Lost connection to the database, retrying: {str(e)}")
+                stop.wait(1)
+
+    def read(self):
+        """Wait up to ``interval`` for a first entry, then as long again to fill the batch."""
+        entries = []
+        deadline = None
+        block = int(self.interval * 1000)
+        while len(entries) < self.batch_size:
+            response = self.client.xreadgroup(
+                GROUP, self.name, {STREAM: '>'}, count=self.batch_size - len(entries), block=block
+            )
+            if response:
+                entries += response[0][1]
+            if not entries:
+                break
+            now = time.monotonic()
+            if deadline is None:
+                deadline = now + self.interval
+            if now >= deadline:
+                break
+            block = max(1, int((deadline - now) * 1000))
+        return entries
+
+    def recover(self):
+        """Save entries a dead (or restarted) worker read but never acknowledged."""
+        recovered = 0
+        start_id = '0-0'
+        while True:
+            response = self.client.xautoclaim(
+                STREAM, GROUP, self.name,
+                min_idle_time=int(self.max_lag * 1000), start_id=start_id, count=self.batch_size
+            )
+            start_id, entries = response[0], response[1]
+            # Entries deleted from the stream come back without fields
+            entries = [(entry_id, fields) for entry_id, fields in entries if fields]
+            if entries:
+                recovered += self.flush(entries)
+            if start_id in (b'0-0', '0-0'):
+                break
+        if recovered:
+            logger.warning(f"Recovered {recovered} unsaved chat messages")
+            self.stats['recovered'] += recovered
+        return recovered
+
+    def save(self, messages):
+        """Insert the messages not saved yet and fold them into their rooms; returns those."""
+        with transaction.atomic():
+            # Only what this call inserted is counted: the batch may be a
+            # replay after a crash, or claimed by a second worker while the
+            # first was still saving it
+            inserted = insert_messages(messages)
+            record_messages(inserted)
+        return inserted
+
+    def flush(self, entries):
+        decoded = []
+        dead = []
+        for entry_id, fields in entries:
+            try:
+                decoded.append((entry_id, fields, decode_message(fields)))
+            except (KeyError, ValueError, UnicodeDecodeError) as e:
+                dead.append((entry_id, fields, f'Undecodable: {str(e)}'))
+        messages = self._save_isolating(decoded, dead)
+        if dead:
+            self.dead_letter(dead)
+
+        entry_ids = [entry_id for entry_id, _ in entries]
+        pipe = self.client.pipeline()
+        pipe.xack(STREAM, GROUP, *entry_ids)
+        pipe.xdel(STREAM, *entry_ids)
+        pipe.execute()
+
+        self.stats['saved'] += len(messages)
+        self.stats['batches'] += 1
+        if messages:
+            lag = (datetime.datetime.now(datetime.timezone.utc) - min(m.created_at for m in messages)).total_seconds()
+            self.stats['max_lag'] = max(self.stats['max_lag'], lag)
+            logger.debug(f"Saved {len(messages)} chat messages, oldest {lag:.2f}s old")
+        return len(messages)
+
+    def _save_isolating(self, decoded, dead):
+        """Save ``(entry_id, fields, message)`` triples; returns the messages inserted.
+
+        Entries the database rejects (bad data rather than a lost connection)
+        are found by saving each half of the batch separately, and added to
+        ``dead``.
+        """
+        if not decoded:
+            return []
+        messages = [message for _, _, message in decoded]
+        try:
+            return self._save_existing(messages)
+        except (DataError, ValueError) as e:
+            # ValueError: psycopg2 refuses strings with NUL characters
+            if len(decoded) == 1:
+                entry_id, fields, _ = decoded[0]
+                dead.append((entry_id, fields, str(e)))
+                return []
+            middle = len(decoded) // 2
+            return (
+                self._save_isolating(decoded[:middle], dead)
+                + self._save_isolating(decoded[middle:], dead)
+            )
+
+    def _save_existing(self, messages):
+        try:
+            return self.save(messages)
+        except IntegrityError:
+            # A room or user was deleted after the message was sent
+            room_ids = set(ChatRoom.objects.filter(id__in={m.room_id for m in messages}).values_list('id', flat=True))
+            user_ids = set(User.objects.filter(id__in={m.user_id for m in messages}).values_list('id', flat=True))
+            kept = [m for m in messages if m.room_id in room_ids and m.user_id in user_ids]
+            logger.warning(f"Dropping {len(messages) - len(kept)} chat messages of deleted rooms or users")
+            return self.save(kept)
+
+    def dead_letter(self, dead):
+        pipe = self.client.pipeline()
+        for entry_id, fields, error in dead:
+            pipe.xadd(DEAD_LETTER_STREAM, dict(fields, error=error, entry_id=entry_id))
+        pipe.execute()
+        self.stats['dead_lettered'] += len(dead)
+        logger.error(f"Moved {len(dead)} unsavable chat messages to {DEAD_LETTER_STREAM}: {dead[0][2]}")
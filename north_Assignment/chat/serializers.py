@@ -12,8 +12,23 @@ class MessageSerializer(serializers.ModelSerializer):
     
     class Meta:
         model = Message
-        fields = ['id', 'user', 'content', 'created_at']
-        read_only_fields = ['id', 'created_at']
+        fields = ['id', 'uuid', 'user', 'content', 'created_at']
+        read_only_fields = ['id', 'uuid', 'created_at']
+
+class ChatRoomListSerializer(serializers.ModelSerializer):
+    """A room in the room list: its stored summary, nothing nested."""
+    last_message_user = serializers.CharField(source='last_message_user.username', default=None, read_only=True)
+    # Annotated by ChatRoomViewSet.get_queryset()
+    unread_count = serializers.IntegerField(read_only=True)
+    last_read_id = serializers.UUIDField(read_only=True)
+    
+    class Meta:
+        model = ChatRoom
+        fields = [
+            'id', 'name', 'participant_count', 'last_message_preview', 'last_message_user',
+            'last_message_at', 'unread_count', 'last_read_id', 'created_at'
+        ]
+        read_only_fields = fields
 
 class ChatRoomSerializer(serializers.ModelSerializer):
     participants = UserSerializer(many=True, read_only=True)
@@ -1,3 +1,153 @@
+import datetime
+from unittest import mock
+
+from django.contrib.auth.models import User
 from django.test import TestCase
+from django.utils import timezone
+
+from .activity import mark_read, record_messages, save_message
+from .models import ChatRoom, Membership, Message
+from .persistence import PersistenceWorker, encode_message, insert_messages
+
+
+class FakeRedis:
+    """The stream commands PersistenceWorker uses outside run(), over in-memory pending entries."""
+
+    def __init__(self, pending=()):
+        self.pending = dict(pending)
+        self.dead = []
+
+    def pipeline(self):
+        return self
+
+    def execute(self):
+        return []
+
+    def xack(self, stream, group, *entry_ids):
+        for entry_id in entry_ids:
+            self.pending.pop(entry_id, None)
+
+    def xdel(self, stream, *entry_ids):
+        pass
+
+    def xadd(self, stream, fields):
+        self.dead.append(fields)
+
+    def xautoclaim(self, stream, group, consumer, min_idle_time, start_id, count):
+        return [b'0-0', list(self.pending.items())[:count], []]
+
+
+def stream_entry(message):
+    return {key.encode(): str(value).encode() for key, value in encode_message(message).items()}
+
+
+class ChatTestCase(TestCase):
+    def setUp(self):
+        self.alice = User.objects.create(username='alice')
+        self.bob = User.objects.create(username='bob')
+        self.room = ChatRoom.objects.create(name='room')
+        self.room.participants.add(self.alice, self.bob)
+        self.start = timezone.now() - datetime.timedelta(minutes=10)
+
+    def message(self, user, minutes, content='hi'):
+        return Message(
+            room_id=self.room.id, user_id=user.id, content=content,
+            created_at=self.start + datetime.timedelta(minutes=minutes)
+        )
+
+    def unread(self, user):
+        return Membership.objects.get(room=self.room, user=user).unread_count
+
+
+class InsertMessagesTests(ChatTestCase):
+    def test_returns_only_messages_not_saved_before(self):
+        first, second = self.message(self.alice, 1), self.message(self.alice, 2)
+        self.assertEqual(insert_messages([first]), [first])
+        self.assertEqual(insert_messages([first, second, second]), [second])
+        self.assertEqual(Message.objects.count(), 2)
+
+    def test_a_batch_saved_twice_is_counted_once(self):
+        # The same batch flushed by a worker and by one that claimed it meanwhile
+        batch = [self.message(self.alice, 1), self.message(self.alice, 2)]
+        self.assertEqual(len(PersistenceWorker(client=FakeRedis()).save(batch)), 2)
+        self.assertEqual(PersistenceWorker(client=FakeRedis()).save(batch), [])
+        self.assertEqual(self.unread(self.bob), 2)
+        self.assertEqual(self.unread(self.alice), 0)
+
+
+class PersistenceWorkerTests(ChatTestCase):
+    def test_recovery_saves_what_a_crashed_worker_left_pending(self):
+        batch = [self.message(self.alice, 1), self.message(self.alice, 2), self.message(self.bob, 3)]
+        # The crashed worker got as far as saving the first one
+        PersistenceWorker(client=FakeRedis()).save(batch[:1])
+        client = FakeRedis({f'1-{i}'.encode(): stream_entry(m) for i, m in enumerate(batch)})
+        worker = PersistenceWorker(client=client)
+
+        self.assertEqual(worker.recover(), 2)
+        self.assertEqual(client.pending, {})
+        self.assertEqual(Message.objects.count(), 3)
+        self.assertEqual(self.unread(self.bob), 2)
+        self.assertEqual(self.unread(self.alice), 1)
+        # Recovering again finds nothing
+        self.assertEqual(worker.recover(), 0)
+        self.assertEqual(worker.stats['recovered'], 2)
+
+    def test_unsavable_entries_are_dead_lettered_and_the_rest_saved(self):
+        poison = self.message(self.alice, 2, content='x\x00')
+        batch = [self.message(self.alice, 1), poison, self.message(self.alice, 3)]
+        entries = [(f'1-{i}'.encode(), stream_entry(m)) for i, m in enumerate(batch)]
+        entries.append((b'1-3', {b'uuid': b'not-a-uuid'}))
+        client = FakeRedis(entries)
+        worker = PersistenceWorker(client=client)
+
+        def insert_like_psycopg2(messages):
+            if any('\x00' in m.content for m in messages):
+                raise ValueError('A string literal cannot contain NUL (0x00) characters.')
+            return insert_messages(messages)
+
+        with mock.patch('chat.persistence.insert_messages', insert_like_psycopg2):
+            self.assertEqual(worker.flush(entries), 2)
+        self.assertEqual(client.pending, {})
+        self.assertEqual({fields['entry_id'] for fields in client.dead}, {b'1-1', b'1-3'})
+        self.assertEqual(worker.stats['dead_lettered'], 2)
+        self.assertFalse(Message.objects.filter(uuid=poison.uuid).exists())
+        self.assertEqual(self.unread(self.bob), 2)
+
+
+class UnreadCountTests(ChatTestCase):
+    def test_messages_of_others_after_the_cursor_are_unread(self):
+        save_message(self.message(self.alice, 1))
+        save_message(self.message(self.bob, 2))
+        record_messages(insert_messages([self.message(self.alice, 3), self.message(self.alice, 4)]))
+        self.assertEqual(self.unread(self.bob), 3)
+        self.assertEqual(self.unread(self.alice), 1)
+
+    def test_mark_read_moves_forward_and_recounts(self):
+        messages = [save_message(self.message(self.alice, minutes)) for minutes in (1, 2, 3)]
+        membership = mark_read(self.room.id, self.bob.id, messages[1])
+        self.assertEqual((membership.last_read_uuid, membership.unread_count), (messages[1].uuid, 1))
+        # Cursors never move back
+        membership = mark_read(self.room.id, self.bob.id, messages[0])
+        self.assertEqual((membership.last_read_uuid, membership.unread_count), (messages[1].uuid, 1))
+        # Without a message: the latest one
+        membership = mark_read(self.room.id, self.bob.id)
+        self.assertEqual((membership.last_read_uuid, membership.unread_count), (messages[2].uuid, 0))
+        self.assertIsNone(mark_read(self.room.id, User.objects.create(username='carol').id))
+
+    def test_buffered_messages_older_than_the_cursor_stay_read(self):
+        # Bob reads up to a message still in the write-behind buffer...
+        latest = self.message(self.alice, 5)
+        mark_read(self.room.id, self.bob.id, latest)
+        # ...then a batch with it and an older message is saved
+        PersistenceWorker(client=FakeRedis()).save([self.message(self.alice, 4), latest, self.message(self.alice, 6)])
+        self.assertEqual(self.unread(self.bob), 1)
+
 
-# Create your tests here.
+class RoomSummaryTests(ChatTestCase):
+    def test_an_older_batch_keeps_the_latest_message(self):
+        save_message(self.message(self.bob, 5, content='latest'))
+        # A batch buffered before it is saved afterwards
+        PersistenceWorker(client=FakeRedis()).save([self.message(self.alice, 4, content='older')])
+        self.room.refresh_from_db()
+        self.assertEqual(self.room.last_message_preview, 'latest')
+        self.assertEqual(self.room.last_message_user_id, self.bob.id)
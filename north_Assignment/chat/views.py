@@ -4,10 +4,14 @@ from rest_framework.decorators import action
 from rest_framework.response import Response
 from rest_framework.permissions import IsAuthenticated
 from django.contrib.auth.models import User
-from django.db.models import Q
+from django.db.models import F, Q
+from django.http import Http404
 from django.contrib.auth.decorators import login_required
 from .models import ChatRoom, Message
+from .activity import mark_read, save_message
+from .history import DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE, MessageNotFound, find_message, message_page
 from .serializers import (
+    ChatRoomListSerializer,
     ChatRoomSerializer, 
     ChatRoomCreateSerializer, 
     MessageSerializer,
@@ -51,10 +55,21 @@ class ChatRoomViewSet(viewsets.ModelViewSet):
     def get_serializer_class(self):
         if self.action == 'create':
             return ChatRoomCreateSerializer
+        if self.action == 'list':
+            return ChatRoomListSerializer
         return ChatRoomSerializer
     
     def get_queryset(self):
-        return ChatRoom.objects.filter(participants=self.request.user)
+        rooms = ChatRoom.objects.filter(memberships__user=self.request.user)
+        if self.action == 'list':
+            # Most recently active first, by the chat_room_activity index
+            return rooms.select_related('last_message_user').annotate(
+                unread_count=F('memberships__unread_count'),
+                last_read_id=F('memberships__last_read_uuid')
+            )
+        if self.action == 'retrieve':
+            return rooms.prefetch_related('participants', 'messages__user')
+        return rooms
     
     def perform_create(self, serializer):
         chat_room = serializer.save()
@@ -77,12 +92,17 @@ class ChatRoomViewSet(viewsets.ModelViewSet):
                     {'error': 'Message content is required'},
                     status=status.HTTP_400_BAD_REQUEST
                 )
+            if isinstance(content, str) and '\x00' in content:
+                return Response(
+                    {'error': 'Message content cannot contain NUL characters'},
+                    status=status.HTTP_400_BAD_REQUEST
+                )
             
-            message = Message.objects.create(
+            message = save_message(Message(
                 room=room,
                 user=request.user,
                 content=content
-            )
+            ))
             
             serializer = MessageSerializer(message)
             return Response(serializer.data, status=status.HTTP_201_CREATED)
@@ -95,19 +115,64 @@ class ChatRoomViewSet(viewsets.ModelViewSet):
     
     @action(detail=True, methods=['get'])
     def messages(self, request, pk=None):
+        """A page of the room's history, oldest first.
+        
+        Returns the latest ``limit`` messages, or those just ``before`` or
+        ``after`` a given message (by id or uuid). ``has_more`` says whether
+        there are more in that direction.
+        """
         try:
+            # get_queryset() only has rooms the user participates in
             room = self.get_object()
             
-            if request.user not in room.participants.all():
-                return Response(
-                    {'error': 'You are not a participant in this chat room'},
-                    status=status.HTTP_403_FORBIDDEN
-                )
+            try:
+                limit = int(request.query_params.get('limit', DEFAULT_PAGE_SIZE))
+            except ValueError:
+                limit = DEFAULT_PAGE_SIZE
+            limit = max(1, min(limit, MAX_PAGE_SIZE))
             
-            messages = room.messages.all()
+            before = request.query_params.get('before')
+            after = request.query_params.get('after')
+            messages, has_more = message_page(room, before=before, after=after, limit=limit)
             serializer = MessageSerializer(messages, many=True)
-            return Response(serializer.data)
+            return Response({'results': serializer.data, 'has_more': has_more})
             
+        except MessageNotFound as e:
+            return Response(
+                {'error': str(e)},
+                status=status.HTTP_404_NOT_FOUND
+            )
+        except Http404:
+            raise
+        except Exception as e:
+            return Response(
+                {'error': str(e)},
+                status=status.HTTP_500_INTERNAL_SERVER_ERROR
+            )
+    
+    @action(detail=True, methods=['post'])
+    def read(self, request, pk=None):
+        """Move the user's read cursor to ``message`` (id or uuid), by default the latest one."""
+        try:
+            room = self.get_object()
+            
+            message = request.data.get('message')
+            if message is not None:
+                message = find_message(room, message)
+            membership = mark_read(room.id, request.user.id, message)
+            
+            return Response({
+                'last_read_id': membership.last_read_uuid,
+                'unread_count': membership.unread_count
+            })
+            
+        except MessageNotFound as e:
+            return Response(
+                {'error': str(e)},
+                status=status.HTTP_404_NOT_FOUND
+            )
+        except Http404:
+            raise
         except Exception as e:
             return Response(
                 {'error': str(e)},
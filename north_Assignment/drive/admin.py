@@ -1,5 +1,5 @@
 from django.contrib import admin
-from .models import DriveFile
+from .models import DriveFile, DriveSyncState, DriveWatchChannel
 
 @admin.register(DriveFile)
 class DriveFileAdmin(admin.ModelAdmin):
@@ -18,3 +18,15 @@ class DriveFileAdmin(admin.ModelAdmin):
             obj.size /= 1024
         return f"{obj.size:.2f} TB"
     size_formatted.short_description = 'Size'
+
+@admin.register(DriveSyncState)
+class DriveSyncStateAdmin(admin.ModelAdmin):
+    list_display = ('user', 'last_synced_at', 'last_full_sync_at')
+    search_fields = ('user__email',)
+    readonly_fields = ('last_synced_at', 'last_full_sync_at')
+
+@admin.register(DriveWatchChannel)
+class DriveWatchChannelAdmin(admin.ModelAdmin):
+    list_display = ('user', 'channel_id', 'expiration', 'last_message_number')
+    search_fields = ('user__email', 'channel_id')
+    readonly_fields = ('created_at',)
@@ -0,0 +1,185 @@
+import io
+import logging
+import posixpath
+import queue
+import threading
+import time
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+
+from .metrics import get_metrics
+
+logger = logging.getLogger(__name__)
+
+metrics = get_metrics('archives')
+
+FOLDER_MIME_TYPE = 'application/vnd.google-apps.folder'
+
+# Chunks buffered per in-flight entry; with the worker count this bounds memory
+ENTRY_QUEUE_SIZE = 4
+
+_END = object()
+
+
+class ArchiveTooLarge(ValueError):
+    pass
+
+
+class _Failure:
+    def __init__(self, error):
+        self.error = error
+
+
+class _ZipOutput(io.RawIOBase):
+    """Write-only sink for ZipFile that hands written bytes back to the caller."""
+
+    def __init__(self):
+        super().__init__()
+        self._parts = []
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self._parts.append(bytes(data))
+        return len(data)
+
+    def drain(self):
+        data = b''.join(self._parts)
+        self._parts.clear()
+        return data
+
+
+def safe_name(name):
+    """A Drive name usable as one path segment of a ZIP entry.
+
+    Drive allows any characters in names, so separators are replaced and
+    ``.``/``..`` are not kept as they are; otherwise entries could land
+    outside the archive's root when extracted.
+    """
+    name = name.replace('/', '_').replace('\\', '_')
+    if name in ('', '.', '..'):
+        return '_'
+    return name
+
+
+def list_folder_tree(drive_service, folder_id, max_files=None):
+    """Return ``(directory, file)`` pairs for every file below a Drive folder."""
+    max_files = max_files or settings.GOOGLE_DRIVE_ARCHIVE_MAX_FILES
+    results = []
+    pending = [(folder_id, '')]
+    while pending:
+        parent_id, directory = pending.pop(0)
+        page_token = None
+        while True:
+            response = drive_service.files().list(
+                q=f"'{parent_id}' in parents and trashed=false",
+                fields='nextPageToken, files(id, name, mimeType, size)',
+                pageSize=1000,
+                pageToken=page_token
+            ).execute()
+            for file in response.get('files', []):
+                if file['mimeType'] == FOLDER_MIME_TYPE:
+                    pending.append((file['id'], posixpath.join(directory, safe_name(file['name']))))
+                else:
+                    results.append((directory, file))
+            if len(results) > max_files:
+                raise ArchiveTooLarge(f'Folder holds more than {max_files} files')
+            page_token = response.get('nextPageToken')
+            if not page_token:
+                break
+    return results
+
+
+def _unique_name(name, used):
+    candidate = name
+    stem, ext = posixpath.splitext(name)
+    counter = 1
+    while candidate in used:
+        candidate = f'{stem} ({counter}){ext}'
+        counter += 1
+    used.add(candidate)
+    return candidate
+
+
+def _put(entry_queue, item, cancelled):
+    while not cancelled.is_set():
+        try:
+            entry_queue.put(item, timeout=0.5)
+            return
+        except queue.Full:
+            continue
+
+
+def _fetch(open_entry, entry, entry_queue, cancelled):
+    try:
+        for chunk in open_entry(entry):
+            if cancelled.is_set():
+                return
+            _put(entry_queue, chunk, cancelled)
+        _put(entry_queue, _END, cancelled)
+    except Exception as e:
+        _put(entry_queue, _Failure(e), cancelled)
+
+
+def iter_zip(entries, open_entry, workers=None):
+    """Yield a ZIP archive of ``entries`` as it is built.
+
+    ``entries`` is a list of ``(arcname, entry)`` pairs and ``open_entry(entry)``
+    returns an iterator over that entry's bytes. Up to ``workers`` entries are
+    downloaded in parallel while the archive is written strictly in order; each
+    one buffers at most ENTRY_QUEUE_SIZE chunks, so nothing is spooled to disk
+    and memory stays bounded. An entry that fails is cut short and followed by
+    an ``<arcname>.error.txt`` explaining why.
+    """
+    workers = workers or settings.GOOGLE_DRIVE_ARCHIVE_WORKERS
+    started = time.monotonic()
+    cancelled = threading.Event()
+    executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='drive-archive')
+    queues = []
+    for _, entry in entries:
+        entry_queue = queue.Queue(maxsize=ENTRY_QUEUE_SIZE)
+        queues.append(entry_queue)
+        executor.submit(_fetch, open_entry, entry, entry_queue, cancelled)
+
+    output = _ZipOutput()
+    used_names = set()
+    transferred = 0
+    try:
+        with zipfile.ZipFile(output, mode='w', compression=zipfile.ZIP_DEFLATED, compresslevel=1) as archive:
+            for (arcname, _), entry_queue in zip(entries, queues):
+                arcname = _unique_name(arcname, used_names)
+                info = zipfile.ZipInfo(arcname, date_time=time.localtime()[:6])
+                info.compress_type = zipfile.ZIP_DEFLATED
+                failure = None
+                with archive.open(info, mode='w', force_zip64=True) as dest:
+                    while True:
+                        item = entry_queue.get()
+                        if item is _END:
+                            break
+                        if isinstance(item, _Failure):
+                            failure = item.error
+                            break
+                        dest.write(item)
+                        transferred += len(item)
+                        data = output.drain()
+                        if data:
+                            yield data
+                if failure is not None:
+                    logger.error(f"Error adding {arcname} to archive: {str(failure)}")
+                    metrics.incr('failed_entries')
+                    archive.writestr(_unique_name(f'{arcname}.error.txt', used_names), f'{failure}\n')
+                else:
+                    metrics.incr('entries')
+                data = output.drain()
+                if data:
+                    yield data
+        # Closing the archive wrote the central directory
+        yield output.drain()
+    finally:
+        cancelled.set()
+        executor.shutdown(wait=False, cancel_futures=True)
+        metrics.incr('bytes', transferred)
+        metrics.observe('duration', time.monotonic() - started)
@@ -0,0 +1,193 @@
+import asyncio
+import datetime
+import logging
+import weakref
+
+import httpx
+from django.conf import settings
+
+from . import throttle
+from .metrics import get_metrics
+from .services import drive_api_root
+
+logger = logging.getLogger(__name__)
+
+metrics = get_metrics('async_drive')
+
+# Refresh tokens a little before Google would reject them
+REFRESH_MARGIN = datetime.timedelta(seconds=60)
+
+
+class AsyncDriveError(Exception):
+    def __init__(self, status_code, reason):
+        super().__init__(reason)
+        self.status_code = status_code
+        self.reason = reason
+
+
+class _LoopState:
+    """HTTP client, refresh locks and in-flight GETs shared by everything on one event loop."""
+
+    def __init__(self):
+        max_connections = settings.GOOGLE_DRIVE_ASYNC_MAX_CONNECTIONS
+        self.client = httpx.AsyncClient(
+            limits=httpx.Limits(
+                max_connections=max_connections,
+                max_keepalive_connections=max_connections,
+            ),
+            timeout=httpx.Timeout(settings.GOOGLE_DRIVE_ASYNC_TIMEOUT, connect=10.0),
+        )
+        self.refresh_locks = weakref.WeakValueDictionary()
+        self.in_flight = {}
+
+
+# httpx clients and asyncio locks belong to the loop that created them
+_loop_states = weakref.WeakKeyDictionary()
+
+
+def _loop_state():
+    loop = asyncio.get_running_loop()
+    state = _loop_states.get(loop)
+    if state is None:
+        state = _loop_states[loop] = _LoopState()
+    return state
+
+
+def get_http_client():
+    """Return the AsyncClient shared by all requests on the running loop.
+
+    Connections to Google are pooled and kept alive across requests and users;
+    GOOGLE_DRIVE_ASYNC_MAX_CONNECTIONS bounds how many are open at once.
+    """
+    return _loop_state().client
+
+
+def _needs_refresh(credentials):
+    if not credentials.token:
+        return True
+    if credentials.expiry is None:
+        return False
+    return credentials.expiry - REFRESH_MARGIN <= datetime.datetime.utcnow()
+
+
+async def refresh_credentials(credentials, force=False):
+    """Refresh google-auth ``credentials`` in place without blocking the loop.
+
+    Concurrent requests for the same credentials wait for a single refresh.
+    The credentials are the ones held by the service pool, so the synchronous
+    endpoints pick up the new access token too.
+    """
+    state = _loop_state()
+    lock = state.refresh_locks.get(id(credentials))
+    if lock is None:
+        lock = asyncio.Lock()
+        state.refresh_locks[id(credentials)] = lock
+    stale_token = credentials.token
+    async with lock:
+        if not (_needs_refresh(credentials) or (force and credentials.token == stale_token)):
+            return
+        if not credentials.refresh_token:
+            raise AsyncDriveError(401, 'Google Drive token expired. Please re-authenticate.')
+        response = await state.client.post(credentials.token_uri, data={
+            'grant_type': 'refresh_token',
+            'refresh_token': credentials.refresh_token,
+            'client_id': credentials.client_id,
+            'client_secret': credentials.client_secret,
+        })
+        metrics.incr('refreshes')
+        if response.status_code != 200:
+            logger.error(f"Token refresh failed: {response.text}")
+            raise AsyncDriveError(401, 'Google Drive token expired. Please re-authenticate.')
+        data = response.json()
+        credentials.token = data['access_token']
+        credentials.expiry = datetime.datetime.utcnow() + datetime.timedelta(seconds=data.get('expires_in', 3600))
+
+
+def _error_reason(response):
+    try:
+        return response.json()['error']['message']
+    except (ValueError, KeyError, TypeError):
+        return response.text or response.reason_phrase
+
+
+class AsyncDriveClient:
+    """Minimal Drive v3 REST client on httpx for the async endpoints."""
+
+    def __init__(self, credentials, http_client=None):
+        self.credentials = credentials
+        self.http_client = http_client or get_http_client()
+
+    async def _send(self, method, path, params=None, stream=False):
+        """Send a Drive request, throttled and retried like the sync client's.
+
+        See services.DriveHttpRequest: 429s, quota 403s and 5xx responses are
+        retried with jittered backoff, and one 401 triggers a token refresh.
+        """
+        await refresh_credentials(self.credentials)
+        refreshed = False
+        retries = 0
+        while True:
+            await throttle.aacquire(self.credentials)
+            request = self.http_client.build_request(
+                method,
+                f'{drive_api_root()}drive/v3/{path}',
+                params=params,
+                headers={'Authorization': f'Bearer {self.credentials.token}'},
+            )
+            response = await self.http_client.send(request, stream=stream)
+            metrics.incr('requests')
+            if response.status_code < 400:
+                return response
+            if response.status_code == 401 and not refreshed:
+                # Revoked or expired early: refresh once and retry
+                await response.aclose()
+                await refresh_credentials(self.credentials, force=True)
+                refreshed = True
+                continue
+            if stream:
+                await response.aread()
+            reasons = throttle.error_reasons(response.content)
+            if retries >= settings.GOOGLE_DRIVE_MAX_RETRIES or not throttle.should_retry(method, response.status_code, reasons):
+                metrics.incr('errors')
+                raise AsyncDriveError(response.status_code, _error_reason(response))
+            delay = throttle.retry_delay(retries, response.headers.get('Retry-After'))
+            throttle.slow_down(self.credentials, response.status_code, reasons, delay)
+            metrics.incr('retries')
+            logger.warning(f"Drive {method} {path} returned {response.status_code}, retrying in {delay:.2f}s")
+            await asyncio.sleep(delay)
+            retries += 1
+
+    async def _get_json(self, path, params):
+        """GET a JSON resource, sharing the call with identical ones in flight.
+
+        The call runs as its own task, so a caller going away does not cancel
+        it for the others waiting on it.
+        """
+        state = _loop_state()
+        key = (id(self.credentials), path, tuple(sorted(params.items())))
+        task = state.in_flight.get(key)
+        if task is None:
+            task = asyncio.ensure_future(self._send('GET', path, params=params))
+            state.in_flight[key] = task
+            task.add_done_callback(lambda _: state.in_flight.pop(key, None))
+        else:
+            metrics.incr('coalesced')
+        response = await asyncio.shield(task)
+        # Each caller parses its own copy of the body
+        return response.json()
+
+    async def get_file(self, file_id, fields):
+        return await self._get_json(f'files/{file_id}', {'fields': fields})
+
+    async def list_files(self, **params):
+        return await self._get_json('files', params)
+
+    async def open_media(self, file_id, export_mime_type=None):
+        """Start downloading a file's content (or its export); returns a streamed httpx response.
+
+        The caller must close it, normally with ``aiter_bytes()`` running to
+        completion or ``aclose()``.
+        """
+        if export_mime_type:
+            return await self._send('GET', f'files/{file_id}/export', params={'mimeType': export_mime_type}, stream=True)
+        return await self._send('GET', f'files/{file_id}', params={'alt': 'media'}, stream=True)
@@ -0,0 +1,255 @@
+import asyncio
+import functools
+import json
+import logging
+import os
+import time
+
+from asgiref.sync import sync_to_async
+from authentication.models import UserProfile
+from django.http import JsonResponse
+from django.utils.http import content_disposition_header
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_GET, require_POST
+from rest_framework import exceptions, status
+from rest_framework.request import Request
+from rest_framework.settings import api_settings
+
+from .async_client import AsyncDriveClient, AsyncDriveError
+from .downloads import IncrementalStreamingHttpResponse, async_streaming_response, iter_file
+from .exports import UnsupportedExportFormat, download_cache, export_filename, resolve_export_format
+from .models import DriveFile
+from .pagination import InvalidCursor, KeysetPaginator
+from .serializers import DriveFileSerializer, FileImportSerializer
+from .services import service_pool
+from .sync import FILE_FIELDS, aupsert_drive_files
+from .views import DOWNLOAD_METADATA_FIELDS
+
+logger = logging.getLogger(__name__)
+
+paginator = KeysetPaginator(field='created_at')
+
+# Metadata requests in flight at once per import
+IMPORT_CONCURRENCY = 20
+
+
+def _authenticate(request):
+    """Run the project's DRF authentication classes against a plain Django request."""
+    drf_request = Request(
+        request,
+        authenticators=[auth() for auth in api_settings.DEFAULT_AUTHENTICATION_CLASSES]
+    )
+    return drf_request.user
+
+
+def drive_view(view):
+    """Authenticate an async Drive view and hand it an AsyncDriveClient.
+
+    Authentication and the profile lookup are the only work done outside the
+    event loop; Drive calls themselves never hold a thread. Drive and
+    validation errors are turned into JSON error responses like the
+    synchronous endpoints return.
+    """
+    @csrf_exempt
+    @functools.wraps(view)
+    async def wrapper(request, *args, **kwargs):
+        try:
+            user = await sync_to_async(_authenticate)(request)
+        except exceptions.APIException as e:
+            return JsonResponse({'error': str(e.detail)}, status=e.status_code)
+        if not user.is_authenticated:
+            return JsonResponse(
+                {'error': 'Authentication credentials were not provided.'},
+                status=status.HTTP_401_UNAUTHORIZED
+            )
+
+        credentials = None
+        try:
+            # Cached on the user so the service pool does not query it again
+            user.profile = await UserProfile.objects.aget(user=user)
+            credentials = service_pool.get_credentials(user)
+        except UserProfile.DoesNotExist:
+            pass
+        if credentials is None:
+            return JsonResponse(
+                {'error': 'Google Drive not connected'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        try:
+            return await view(request, user, AsyncDriveClient(credentials), *args, **kwargs)
+        except (InvalidCursor, UnsupportedExportFormat) as e:
+            return JsonResponse({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        except AsyncDriveError as e:
+            logger.error(f"Drive error in {view.__name__}: {e.reason}")
+            if e.status_code in (401, 403, 404, 429):
+                return JsonResponse({'error': e.reason}, status=e.status_code)
+            return JsonResponse(
+                {'error': f'Google Drive error: {e.reason}'},
+                status=status.HTTP_502_BAD_GATEWAY
+            )
+        except Exception as e:
+            logger.error(f"Error in {view.__name__}: {str(e)}")
+            return JsonResponse(
+                {'error': f'Error: {str(e)}'},
+                status=status.HTTP_500_INTERNAL_SERVER_ERROR
+            )
+    return wrapper
+
+
+@require_GET
+@drive_view
+async def list_files(request, user, drive):
+    """Async counterpart of GoogleDriveViewSet.list (same parameters and response)."""
+    results = await drive.list_files(
+        pageSize=int(request.GET.get('page_size', 20)),
+        fields='nextPageToken, files(id, name, mimeType, size, md5Checksum, parents, createdTime, modifiedTime)',
+        q='trashed=false',
+        pageToken=request.GET.get('page_token') or None
+    )
+    await aupsert_drive_files(user, results.get('files', []))
+
+    files = DriveFile.objects.filter(user=user)
+    mime_type = request.GET.get('mime_type')
+    if mime_type:
+        files = files.filter(mime_type=mime_type)
+
+    files, next_cursor = await paginator.apaginate(
+        files,
+        cursor=request.GET.get('cursor'),
+        page_size=paginator.get_page_size(request)
+    )
+    return JsonResponse({
+        'results': DriveFileSerializer(files, many=True).data,
+        'next_cursor': next_cursor,
+        'next_page_token': results.get('nextPageToken')
+    })
+
+
+@require_GET
+@drive_view
+async def file_metadata(request, user, drive):
+    """Fetch Drive metadata for ``file_id``."""
+    file_id = request.GET.get('file_id')
+    if not file_id:
+        return JsonResponse(
+            {'error': 'No file ID provided in query parameters'},
+            status=status.HTTP_400_BAD_REQUEST
+        )
+    return JsonResponse(await drive.get_file(file_id, DOWNLOAD_METADATA_FIELDS))
+
+
+@require_POST
+@drive_view
+async def import_files(request, user, drive):
+    """Async counterpart of GoogleDriveViewSet.import_files.
+
+    Takes a JSON body; metadata requests run concurrently over the shared
+    connection pool instead of as Drive batch requests.
+    """
+    try:
+        data = json.loads(request.body or b'{}')
+    except ValueError:
+        return JsonResponse({'error': 'Invalid JSON body'}, status=status.HTTP_400_BAD_REQUEST)
+    serializer = FileImportSerializer(data=data)
+    if not serializer.is_valid():
+        return JsonResponse(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
+    file_ids = list(dict.fromkeys(serializer.validated_data['file_ids']))
+    semaphore = asyncio.Semaphore(IMPORT_CONCURRENCY)
+
+    async def fetch(file_id):
+        async with semaphore:
+            return await drive.get_file(file_id, FILE_FIELDS)
+
+    responses = await asyncio.gather(*(fetch(file_id) for file_id in file_ids), return_exceptions=True)
+    files = {}
+    errors = {}
+    for file_id, response in zip(file_ids, responses):
+        if isinstance(response, AsyncDriveError):
+            errors[file_id] = response.reason
+        elif isinstance(response, Exception):
+            raise response
+        else:
+            files[file_id] = response
+
+    await aupsert_drive_files(user, files.values())
+    drive_files = {
+        drive_file.file_id: drive_file
+        async for drive_file in DriveFile.objects.filter(user=user, file_id__in=[f['id'] for f in files.values()])
+    }
+
+    results = []
+    for file_id in file_ids:
+        file = files.get(file_id)
+        if file is not None and file['id'] in drive_files:
+            results.append({
+                'file_id': file_id,
+                'status': 'imported',
+                'file': DriveFileSerializer(drive_files[file['id']]).data
+            })
+        else:
+            results.append({
+                'file_id': file_id,
+                'status': 'error',
+                'error': errors.get(file_id, 'File not returned by Google Drive')
+            })
+
+    return JsonResponse({
+        'imported': len(files),
+        'failed': len(results) - len(files),
+        'results': results
+    })
+
+
+async def _download_response(request, drive, file_id, started):
+    file_metadata = await drive.get_file(file_id, DOWNLOAD_METADATA_FIELDS)
+    mime_type = file_metadata.get('mimeType', '')
+    name = file_metadata.get('name', 'downloaded_file')
+    export_mime_type = resolve_export_format(mime_type, request.GET.get('export_format'))
+    if export_mime_type:
+        filename, content_type = export_filename(name, export_mime_type), export_mime_type
+    else:
+        filename, content_type = name, mime_type or None
+
+    cache, key, size = download_cache(file_id, file_metadata, export_mime_type)
+    cached = cache.open(*key) if key else None
+    if cached is not None:
+        size = os.fstat(cached.fileno()).st_size
+        response = IncrementalStreamingHttpResponse(
+            iter_file(cached),
+            content_type=content_type or 'application/octet-stream'
+        )
+        response['Content-Disposition'] = content_disposition_header(True, filename)
+        response['Content-Length'] = str(size)
+        return response
+
+    drive_response = await drive.open_media(file_id, export_mime_type)
+    sink = cache.writer(*key, size=size) if key else None
+    return async_streaming_response(drive_response, filename, content_type, size=size, started=started, sink=sink)
+
+
+@require_GET
+@drive_view
+async def download(request, user, drive, pk):
+    """Async counterpart of GoogleDriveViewSet.download."""
+    started = time.monotonic()
+    try:
+        drive_file = await DriveFile.objects.aget(id=pk, user=user)
+    except DriveFile.DoesNotExist:
+        return JsonResponse({'error': 'File not found'}, status=status.HTTP_404_NOT_FOUND)
+    return await _download_response(request, drive, drive_file.file_id, started)
+
+
+@require_GET
+@drive_view
+async def direct_download(request, user, drive):
+    """Async counterpart of GoogleDriveViewSet.direct_download."""
+    started = time.monotonic()
+    file_id = request.GET.get('file_id')
+    if not file_id:
+        return JsonResponse(
+            {'error': 'No file ID provided in query parameters'},
+            status=status.HTTP_400_BAD_REQUEST
+        )
+    return await _download_response(request, drive, file_id, started)
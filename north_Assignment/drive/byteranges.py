@@ -0,0 +1,167 @@
+import hashlib
+import re
+
+from django.conf import settings
+from django.utils.dateparse import parse_datetime
+from django.utils.http import http_date, parse_http_date_safe
+
+from .exports import rendition_version
+from .ranged import RangedDownload, authorized_session, iter_range, use_ranged_download
+
+# More ranges than this in one request are ignored and the whole file is sent
+MAX_RANGES = 16
+
+_range_spec_re = re.compile(r'^\s*(\d*)\s*-\s*(\d*)\s*$')
+
+
+class RangeNotSatisfiable(Exception):
+    pass
+
+
+def parse_range_header(header, size):
+    """Byte ranges asked for by a Range header, as sorted ``(start, end)`` pairs.
+
+    Overlapping and adjacent ranges are merged. Returns None when the header
+    is to be ignored (absent, malformed, not in bytes or asking for too many
+    ranges), in which case the whole file is sent. Raises RangeNotSatisfiable
+    when no range overlaps the file.
+    """
+    if not header:
+        return None
+    unit, _, specs = header.partition('=')
+    if unit.strip().lower() != 'bytes' or not specs:
+        return None
+    ranges = []
+    for spec in specs.split(','):
+        match = _range_spec_re.match(spec)
+        if match is None:
+            return None
+        first, last = match.groups()
+        if first:
+            start = int(first)
+            if last and int(last) < start:
+                return None
+            if start >= size:
+                continue
+            ranges.append((start, min(int(last), size - 1) if last else size - 1))
+        elif last:
+            # Suffix range: the last N bytes
+            if int(last) and size:
+                ranges.append((max(0, size - int(last)), size - 1))
+        else:
+            return None
+    if len(ranges) > MAX_RANGES:
+        return None
+    if not ranges:
+        raise RangeNotSatisfiable(f'bytes */{size}')
+
+    ranges.sort()
+    merged = [ranges[0]]
+    for start, end in ranges[1:]:
+        last_start, last_end = merged[-1]
+        if start <= last_end + 1:
+            merged[-1] = (last_start, max(last_end, end))
+        else:
+            merged.append((start, end))
+    return merged
+
+
+def download_validators(file_metadata, export_mime_type=None):
+    """Return ``(etag, last_modified)`` for a download of a Drive file.
+
+    Binary files get a strong ETag from their ``md5Checksum`` (or head
+    revision). An export of one revision is equivalent but not necessarily
+    byte-identical, so its ETag is weak. ``last_modified`` is a timestamp
+    from ``modifiedTime``; either may be None.
+    """
+    etag = None
+    if export_mime_type:
+        version = rendition_version(file_metadata)
+        if version:
+            digest = hashlib.sha1(f'{version}:{export_mime_type}'.encode()).hexdigest()
+            etag = f'W/"{digest}"'
+    else:
+        version = file_metadata.get('md5Checksum') or file_metadata.get('headRevisionId')
+        if version:
+            etag = f'"{version}"'
+
+    last_modified = None
+    modified = parse_datetime(file_metadata.get('modifiedTime') or '')
+    if modified is not None:
+        last_modified = int(modified.timestamp())
+    return etag, last_modified
+
+
+def set_validators(response, etag, last_modified):
+    if etag:
+        response['ETag'] = etag
+    if last_modified is not None:
+        response['Last-Modified'] = http_date(last_modified)
+    return response
+
+
+def requested_ranges(request, size, etag, last_modified):
+    """Ranges to send for ``request``, or None to send the whole file.
+
+    Honours If-Range: ranges are only sent if the client's copy is still
+    current, judged by a strong ETag or the exact modification time.
+    """
+    if size is None:
+        return None
+    header = request.META.get('HTTP_RANGE')
+    if not header:
+        return None
+    if_range = request.META.get('HTTP_IF_RANGE')
+    if if_range:
+        if if_range.startswith(('"', 'W/')):
+            if not etag or etag.startswith('W/') or if_range != etag:
+                return None
+        elif last_modified is None or parse_http_date_safe(if_range) != last_modified:
+            return None
+    return parse_range_header(header, int(size))
+
+
+class FileRanges:
+    """Byte ranges read from a local file, such as a cache entry."""
+
+    def __init__(self, f, chunk_size=None):
+        self.file = f
+        self.chunk_size = chunk_size or settings.GOOGLE_DRIVE_DOWNLOAD_CHUNK_SIZE
+
+    def iter_range(self, start, end):
+        self.file.seek(start)
+        remaining = end - start + 1
+        while remaining > 0:
+            chunk = self.file.read(min(self.chunk_size, remaining))
+            if not chunk:
+                break
+            remaining -= len(chunk)
+            yield chunk
+
+    def close(self):
+        self.file.close()
+
+
+class DriveRanges:
+    """Byte ranges fetched from Drive with Range requests.
+
+    Ranges of at least GOOGLE_DRIVE_PARALLEL_DOWNLOAD_THRESHOLD bytes are
+    fetched in parallel parts, like whole downloads.
+    """
+
+    def __init__(self, media_request):
+        self.credentials = media_request.http.credentials
+        self.uri = media_request.uri
+        self._session = None
+
+    def iter_range(self, start, end):
+        length = end - start + 1
+        if use_ranged_download(length):
+            return iter(RangedDownload(self.credentials, self.uri, length, offset=start))
+        if self._session is None:
+            self._session = authorized_session(self.credentials)
+        return iter_range(self._session, self.credentials, self.uri, start, end)
+
+    def close(self):
+        if self._session is not None:
+            self._session.close()
@@ -0,0 +1,185 @@
+import hashlib
+import logging
+import os
+import tempfile
+import threading
+
+from django.conf import settings
+
+from .metrics import get_metrics
+
+logger = logging.getLogger(__name__)
+
+
+class CacheEntryWriter:
+    """Writes one cache entry to a temp file and publishes it atomically."""
+
+    def __init__(self, cache, path):
+        self.cache = cache
+        self.path = path
+        fd, self.temp_path = tempfile.mkstemp(dir=cache.temp_dir)
+        self.file = os.fdopen(fd, 'wb')
+        self.size = 0
+        self.closed = False
+
+    def write(self, data):
+        if self.closed:
+            return
+        self.file.write(data)
+        self.size += len(data)
+        if self.size > self.cache.max_bytes:
+            # Larger than the whole budget: not worth keeping
+            self.discard()
+
+    def commit(self):
+        if self.closed:
+            return
+        self.closed = True
+        self.file.close()
+        os.replace(self.temp_path, self.path)
+        self.cache.added(self.size)
+
+    def discard(self):
+        if self.closed:
+            return
+        self.closed = True
+        self.file.close()
+        try:
+            os.unlink(self.temp_path)
+        except FileNotFoundError:
+            pass
+
+
+class _DiscardedWriter:
+    closed = True
+
+    def write(self, data):
+        pass
+
+    def commit(self):
+        pass
+
+    def discard(self):
+        pass
+
+
+class ContentCache:
+    """Disk cache of Drive file contents with a total size budget.
+
+    Entries are addressed by a hash of their key, which includes the file's
+    Drive version (e.g. ``md5Checksum`` or ``modifiedTime``), so a changed
+    file simply misses.
+    Writes go to a temp file and are renamed into place. When the budget is
+    exceeded, the least recently used entries (by mtime, which is bumped on
+    every hit) are evicted.
+    """
+
+    def __init__(self, name='content_cache', root=None, max_bytes=None, max_bytes_setting='GOOGLE_DRIVE_CACHE_MAX_BYTES'):
+        self.name = name
+        self._root = root
+        self._max_bytes = max_bytes
+        self.max_bytes_setting = max_bytes_setting
+        self._total = None
+        self._lock = threading.Lock()
+        self.metrics = get_metrics(name)
+
+    @property
+    def root(self):
+        return self._root or os.path.join(settings.GOOGLE_DRIVE_CACHE_DIR, self.name)
+
+    @property
+    def temp_dir(self):
+        return os.path.join(self.root, 'tmp')
+
+    @property
+    def max_bytes(self):
+        if self._max_bytes is not None:
+            return self._max_bytes
+        return getattr(settings, self.max_bytes_setting)
+
+    @property
+    def enabled(self):
+        return self.max_bytes > 0
+
+    def _path(self, *key):
+        digest = hashlib.sha256('\0'.join(key).encode()).hexdigest()
+        return os.path.join(self.root, digest[:2], digest)
+
+    def open(self, *key):
+        """Return an open file for a cached entry, or None on a miss."""
+        if not self.enabled:
+            return None
+        path = self._path(*key)
+        try:
+            f = open(path, 'rb')
+        except FileNotFoundError:
+            self.metrics.incr('misses')
+            return None
+        os.utime(path)
+        self.metrics.incr('hits')
+        self.metrics.incr('bytes_saved', os.fstat(f.fileno()).st_size)
+        return f
+
+    def writer(self, *key, size=None):
+        """Return a writer for a new entry; it silently drops uncacheable data."""
+        if not self.enabled or (size is not None and int(size) > self.max_bytes):
+            return _DiscardedWriter()
+        path = self._path(*key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        os.makedirs(self.temp_dir, exist_ok=True)
+        return CacheEntryWriter(self, path)
+
+    def added(self, size):
+        self.metrics.incr('bytes_written', size)
+        with self._lock:
+            if self._total is None:
+                self._total = self._scan_total()
+            else:
+                self._total += size
+            over_budget = self._total > self.max_bytes
+        if over_budget:
+            self.evict()
+
+    def evict(self):
+        """Delete least recently used entries until the cache fits its budget."""
+        with self._lock:
+            entries = []
+            for path, stat in self._entries():
+                entries.append((stat.st_mtime, stat.st_size, path))
+            total = sum(size for _, size, _ in entries)
+            entries.sort()
+            for _, size, path in entries:
+                if total <= self.max_bytes:
+                    break
+                try:
+                    os.unlink(path)
+                except FileNotFoundError:
+                    pass
+                total -= size
+                self.metrics.incr('evictions')
+            self._total = total
+
+    def stats(self):
+        data = self.metrics.snapshot()
+        lookups = data.get('hits', 0) + data.get('misses', 0)
+        data['hit_ratio'] = data.get('hits', 0) / lookups if lookups else 0.0
+        data['max_bytes'] = self.max_bytes
+        return data
+
+    def _scan_total(self):
+        return sum(stat.st_size for _, stat in self._entries())
+
+    def _entries(self):
+        if not os.path.isdir(self.root):
+            return
+        for shard in os.scandir(self.root):
+            if not shard.is_dir() or shard.name == 'tmp':
+                continue
+            for entry in os.scandir(shard.path):
+                try:
+                    yield entry.path, entry.stat()
+                except FileNotFoundError:
+                    continue
+
+
+content_cache = ContentCache()
@@ -0,0 +1,33 @@
+import json
+
+from channels.generic.websocket import AsyncWebsocketConsumer
+
+from .notifications import user_group
+
+
+class DriveConsumer(AsyncWebsocketConsumer):
+    """Tells a signed-in user's open clients when their Drive mirror changed."""
+
+    async def connect(self):
+        self.group_name = None
+        user = self.scope.get('user')
+        if user is None or not user.is_authenticated:
+            await self.close()
+            return
+
+        self.group_name = user_group(user.id)
+        await self.channel_layer.group_add(self.group_name, self.channel_name)
+        await self.accept()
+
+    async def disconnect(self, close_code):
+        if self.group_name:
+            await self.channel_layer.group_discard(self.group_name, self.channel_name)
+
+    # Sent by notifications.notify_clients() after a sync
+    async def drive_changed(self, event):
+        await self.send(text_data=json.dumps({
+            'type': 'drive.changed',
+            'mode': event['mode'],
+            'upserted': event['upserted'],
+            'removed': event['removed'],
+        }))
@@ -0,0 +1,228 @@
+import io
+import itertools
+import logging
+import time
+import uuid
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.http import StreamingHttpResponse
+from django.utils.http import content_disposition_header
+from googleapiclient.http import MediaIoBaseDownload
+
+from .metrics import get_metrics
+from .ranged import RangedDownload, use_ranged_download
+
+logger = logging.getLogger(__name__)
+
+metrics = get_metrics('downloads')
+
+
+def iter_media(media_request, chunk_size=None):
+    """Yield the body of a Drive media request as it arrives.
+
+    The buffer handed to MediaIoBaseDownload is drained after every chunk, so
+    memory stays bounded by ``chunk_size`` regardless of the file size.
+    """
+    chunk_size = chunk_size or settings.GOOGLE_DRIVE_DOWNLOAD_CHUNK_SIZE
+    buffer = io.BytesIO()
+    downloader = MediaIoBaseDownload(buffer, media_request, chunksize=chunk_size)
+    done = False
+    while not done:
+        _, done = downloader.next_chunk()
+        data = buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+        if data:
+            yield data
+
+
+def _relay(first_chunk, chunks, started, sink=None):
+    transferred = 0
+    try:
+        for chunk in itertools.chain([first_chunk], chunks):
+            transferred += len(chunk)
+            if sink is not None:
+                sink.write(chunk)
+            yield chunk
+        if sink is not None:
+            sink.commit()
+    finally:
+        # Stop fetching if the client went away
+        chunks.close()
+        # Only a fully relayed body may be kept
+        if sink is not None:
+            sink.discard()
+        metrics.incr('bytes', transferred)
+        metrics.observe('duration', time.monotonic() - started)
+
+
+async def _arelay(drive_response, started, sink=None):
+    transferred = 0
+    try:
+        async for chunk in drive_response.aiter_bytes(settings.GOOGLE_DRIVE_DOWNLOAD_CHUNK_SIZE):
+            transferred += len(chunk)
+            if sink is not None:
+                sink.write(chunk)
+            yield chunk
+        if sink is not None:
+            sink.commit()
+    finally:
+        await drive_response.aclose()
+        if sink is not None:
+            sink.discard()
+        metrics.incr('bytes', transferred)
+        metrics.observe('duration', time.monotonic() - started)
+
+
+def iter_file(f, chunk_size=None):
+    """Yield a local file in chunks and close it at the end."""
+    chunk_size = chunk_size or settings.GOOGLE_DRIVE_DOWNLOAD_CHUNK_SIZE
+    try:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            yield chunk
+    finally:
+        f.close()
+
+
+class IncrementalStreamingHttpResponse(StreamingHttpResponse):
+    """StreamingHttpResponse that stays incremental under ASGI.
+
+    Django serves a synchronous iterator over ASGI by collecting it into a
+    list first, which would buffer the whole file again. This pulls one chunk
+    at a time from a worker thread instead; WSGI iteration is unchanged.
+    """
+
+    async def __aiter__(self):
+        if self.is_async:
+            async for part in super().__aiter__():
+                yield part
+            return
+
+        iterator = iter(self.streaming_content)
+        next_part = sync_to_async(next, thread_sensitive=False)
+        while True:
+            part = await next_part(iterator, None)
+            if part is None:
+                break
+            yield part
+
+
+def streaming_response(media_request, filename, content_type=None, size=None, started=None, sink=None):
+    """Relay a Drive media request to the client without buffering the file.
+
+    The first chunk is fetched before the response is built, so Drive errors
+    still surface to the caller and time-to-first-byte can be reported in the
+    Server-Timing header. Chunks are also written to ``sink`` (a cache entry
+    writer), which is committed only if the whole body was relayed. The
+    response must stay an IncrementalStreamingHttpResponse: a plain
+    StreamingHttpResponse would be drained into memory under daphne.
+
+    Files of at least GOOGLE_DRIVE_PARALLEL_DOWNLOAD_THRESHOLD bytes are
+    fetched as parallel ranges (see RangedDownload) rather than in sequence.
+    """
+    started = started or time.monotonic()
+    if use_ranged_download(size):
+        chunks = iter(RangedDownload(media_request.http.credentials, media_request.uri, size))
+    else:
+        chunks = iter_media(media_request)
+    first_chunk = next(chunks, b'')
+    ttfb = time.monotonic() - started
+    metrics.incr('streams')
+    metrics.observe('ttfb', ttfb)
+    logger.debug(f"First byte of {filename} after {ttfb * 1000:.1f}ms")
+
+    response = IncrementalStreamingHttpResponse(
+        _relay(first_chunk, chunks, started, sink),
+        content_type=content_type or 'application/octet-stream'
+    )
+    response['Content-Disposition'] = content_disposition_header(True, filename)
+    response['Server-Timing'] = f'drive-ttfb;dur={ttfb * 1000:.1f}'
+    # Ask nginx to pass chunks straight through instead of spooling them
+    response['X-Accel-Buffering'] = 'no'
+    if size is not None:
+        response['Content-Length'] = str(size)
+    return response
+
+
+def _iter_ranges(source, parts, trailer=b''):
+    try:
+        for head, start, end in parts:
+            if head:
+                yield head
+            yield from source.iter_range(start, end)
+            if head:
+                yield b'\r\n'
+        if trailer:
+            yield trailer
+    finally:
+        source.close()
+
+
+def range_response(source, ranges, size, filename, content_type=None, started=None):
+    """206 response with byte ``ranges`` of a file of ``size`` bytes.
+
+    ``source`` (a byteranges.FileRanges or DriveRanges) supplies the bytes
+    and is closed when the response is. A single range is sent as is, several
+    as multipart/byteranges.
+    """
+    started = started or time.monotonic()
+    content_type = content_type or 'application/octet-stream'
+    if len(ranges) == 1:
+        start, end = ranges[0]
+        chunks = _iter_ranges(source, [(b'', start, end)])
+        length = end - start + 1
+        response_type = content_type
+    else:
+        boundary = uuid.uuid4().hex
+        parts = [
+            (
+                f'--{boundary}\r\nContent-Type: {content_type}\r\n'
+                f'Content-Range: bytes {start}-{end}/{size}\r\n\r\n'.encode(),
+                start,
+                end,
+            )
+            for start, end in ranges
+        ]
+        trailer = f'--{boundary}--\r\n'.encode()
+        chunks = _iter_ranges(source, parts, trailer)
+        length = sum(len(head) + end - start + 1 + 2 for head, start, end in parts) + len(trailer)
+        response_type = f'multipart/byteranges; boundary={boundary}'
+
+    first_chunk = next(chunks, b'')
+    metrics.incr('partial')
+    response = IncrementalStreamingHttpResponse(
+        _relay(first_chunk, chunks, started),
+        status=206,
+        content_type=response_type
+    )
+    if len(ranges) == 1:
+        response['Content-Range'] = f'bytes {start}-{end}/{size}'
+    response['Content-Length'] = str(length)
+    response['Content-Disposition'] = content_disposition_header(True, filename)
+    response['X-Accel-Buffering'] = 'no'
+    return response
+
+
+def async_streaming_response(drive_response, filename, content_type=None, size=None, started=None, sink=None):
+    """Relay an open httpx response from Drive without blocking a thread.
+
+    Used by the async endpoints; ``drive_response`` has already received its
+    headers, so errors surfaced before this is called. Otherwise mirrors
+    streaming_response().
+    """
+    started = started or time.monotonic()
+    ttfb = time.monotonic() - started
+    metrics.incr('streams')
+    metrics.observe('ttfb', ttfb)
+
+    response = StreamingHttpResponse(
+        _arelay(drive_response, started, sink),
+        content_type=content_type or 'application/octet-stream'
+    )
+    response['Content-Disposition'] = content_disposition_header(True, filename)
+    response['Server-Timing'] = f'drive-ttfb;dur={ttfb * 1000:.1f}'
+    response['X-Accel-Buffering'] = 'no'
+    if size is not None:
+        response['Content-Length'] = str(size)
+    return response
@@ -0,0 +1,90 @@
+import mimetypes
+
+from django.conf import settings
+
+from .cache import ContentCache, content_cache
+
+# File extensions for exported files
+EXPORT_EXTENSIONS = {
+    'application/pdf': '.pdf',
+    'application/vnd.openxmlformats-officedocument.wordprocessingml.document': '.docx',
+    'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet': '.xlsx',
+    'application/vnd.openxmlformats-officedocument.presentationml.presentation': '.pptx',
+    'application/vnd.oasis.opendocument.text': '.odt',
+    'application/vnd.oasis.opendocument.spreadsheet': '.ods',
+    'application/vnd.oasis.opendocument.presentation': '.odp',
+    'application/rtf': '.rtf',
+    'application/epub+zip': '.epub',
+    'text/plain': '.txt',
+    'text/csv': '.csv',
+    'text/tab-separated-values': '.tsv',
+    'text/markdown': '.md',
+    'image/png': '.png',
+    'image/jpeg': '.jpg',
+    'image/svg+xml': '.svg',
+}
+
+
+class UnsupportedExportFormat(ValueError):
+    pass
+
+
+def export_formats(mime_type):
+    """Export MIME types allowed for a Workspace type, default first; empty if not exported."""
+    return settings.GOOGLE_DRIVE_EXPORT_FORMATS.get(mime_type, [])
+
+
+def is_exported(mime_type):
+    return bool(export_formats(mime_type))
+
+
+def export_extension(export_mime_type):
+    return EXPORT_EXTENSIONS.get(export_mime_type) or mimetypes.guess_extension(export_mime_type) or ''
+
+
+def resolve_export_format(mime_type, requested=None):
+    """Pick the export MIME type for a file, or None if it is downloaded as-is.
+
+    ``requested`` is an alternative format asked for by the client, either a
+    MIME type or a file extension such as ``docx``. It must be one of the
+    formats configured for the file's type.
+    """
+    formats = export_formats(mime_type)
+    if not formats:
+        return None
+    if not requested:
+        return formats[0]
+    for export_mime_type in formats:
+        if requested in (export_mime_type, export_extension(export_mime_type).lstrip('.')):
+            return export_mime_type
+    allowed = ', '.join(export_extension(f).lstrip('.') or f for f in formats)
+    raise UnsupportedExportFormat(f'Unsupported export format: {requested}. Available formats: {allowed}')
+
+
+def export_filename(name, export_mime_type):
+    return f"{name}{export_extension(export_mime_type)}"
+
+
+def rendition_version(file_metadata):
+    """Version of a Workspace file's content; an export is reused until it changes."""
+    return file_metadata.get('headRevisionId') or file_metadata.get('modifiedTime')
+
+
+# Converted PDF/XLSX/PPTX output of Workspace files, keyed by
+# (file id, export MIME type, revision), with its own size budget
+rendition_cache = ContentCache('rendition_cache', max_bytes_setting='GOOGLE_DRIVE_RENDITION_CACHE_MAX_BYTES')
+
+
+def download_cache(file_id, file_metadata, export_mime_type=None):
+    """Return ``(cache, key, size)`` for serving a download.
+
+    Binary files are cached by their current ``md5Checksum``; exports go to
+    the rendition cache, keyed by export format and revision. ``key`` is None
+    when the metadata carries no version to validate a cached copy against.
+    """
+    if export_mime_type:
+        version = rendition_version(file_metadata)
+        # Exports have no size up front
+        return rendition_cache, (file_id, export_mime_type, version) if version else None, None
+    version = file_metadata.get('md5Checksum') or file_metadata.get('modifiedTime')
+    return content_cache, (file_id, version) if version else None, file_metadata.get('size')
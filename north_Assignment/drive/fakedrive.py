@@ -0,0 +1,346 @@
+import datetime
+import hashlib
+import itertools
+import json
+import logging
+import random
+import re
+import threading
+import time
+import urllib.request
+import uuid
+from email.parser import BytesParser
+from email.policy import HTTP
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+logger = logging.getLogger(__name__)
+
+FOLDER_MIME_TYPE = 'application/vnd.google-apps.folder'
+DOCUMENT_MIME_TYPE = 'application/vnd.google-apps.document'
+
+_parents_re = re.compile(r"'([^']+)' in parents")
+_range_re = re.compile(r'bytes=(\d+)-(\d*)')
+_content_range_re = re.compile(r'bytes (?:(\d+)-(\d+)|\*)/(\d+|\*)')
+
+
+def _now():
+    return datetime.datetime.now(datetime.timezone.utc).strftime('%Y-%m-%dT%H:%M:%S.%f')[:-3] + 'Z'
+
+
+def _json(status, data, headers=None):
+    return status, dict(headers or {}, **{'Content-Type': 'application/json; charset=UTF-8'}), json.dumps(data).encode()
+
+
+def _error(status, message):
+    return _json(status, {'error': {'code': status, 'message': message, 'errors': [{'message': message}]}})
+
+
+class FakeDrive:
+    """In-memory stand-in for the parts of Drive v3 this project calls.
+
+    Implements files.list/get/create/update/delete, get_media (with Range),
+    export_media, resumable uploads, changes.getStartPageToken/list/watch,
+    channels.stop, HTTP batch requests and the OAuth token endpoint. Watch
+    channels get real push notifications, posted to their address on every
+    change. Every file listed is in the
+    root folder and ``fields`` is ignored: full resources are returned.
+
+    ``latency`` (plus up to ``jitter``) seconds are added to each request, and
+    a share ``error_rate`` of them fails with a 500/503/429 instead.
+    """
+
+    def __init__(self, files=100, file_size=64 * 1024, latency=0.0, jitter=0.0, error_rate=0.0, seed=0):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.random = random.Random(seed)
+        self.files = {}
+        self.contents = {}
+        self.changes = []
+        self.uploads = {}
+        self.channels = {}
+        self.lock = threading.Lock()
+        self._ids = itertools.count(1)
+        for i in range(files):
+            # Every tenth file is a Google Doc, so exports get exercised too
+            mime_type = DOCUMENT_MIME_TYPE if i % 10 == 9 else 'application/octet-stream'
+            content = random.Random(seed * 1000003 + i).getrandbits(file_size * 8).to_bytes(file_size, 'little')
+            self._store({'name': f'file-{i}.bin', 'mimeType': mime_type, 'parents': ['root']}, content)
+
+    def _store(self, metadata, content=b'', file_id=None):
+        file_id = file_id or f'fake{next(self._ids):08d}'
+        file = {
+            'kind': 'drive#file',
+            'id': file_id,
+            'name': metadata.get('name', 'Untitled'),
+            'mimeType': metadata.get('mimeType') or 'application/octet-stream',
+            'parents': metadata.get('parents') or ['root'],
+            'modifiedTime': _now(),
+            'trashed': False,
+        }
+        if not file['mimeType'].startswith('application/vnd.google-apps.'):
+            file['size'] = str(len(content))
+            file['md5Checksum'] = hashlib.md5(content).hexdigest()
+            file['headRevisionId'] = uuid.uuid4().hex
+        self.files[file_id] = file
+        self.contents[file_id] = content
+        self._changed(file_id)
+        return file
+
+    def _perturb(self, delay=True):
+        """Injected latency and errors; returns an error response or None."""
+        delay = delay and self.latency + (self.random.uniform(0, self.jitter) if self.jitter else 0)
+        if delay:
+            time.sleep(delay)
+        if self.error_rate and self.random.random() < self.error_rate:
+            status = self.random.choice((500, 503, 429))
+            return _error(status, 'Injected error')
+        return None
+
+    def handle(self, method, target, headers, body, perturb=True):
+        """Answer one request; returns ``(status, headers, body)``."""
+        url = urlsplit(target)
+        path = url.path
+        query = {key: values[-1] for key, values in parse_qs(url.query).items()}
+        if path == '/token':
+            return _json(200, {'access_token': f'fake-{uuid.uuid4().hex}', 'expires_in': 3600, 'token_type': 'Bearer'})
+        if perturb:
+            failure = self._perturb()
+            if failure is not None:
+                return failure
+        if path == '/batch/drive/v3' and method == 'POST':
+            return self._batch(headers, body)
+        if path == '/upload/drive/v3/files':
+            return self._upload(method, query, headers, body)
+        if path.startswith('/drive/v3/'):
+            parts = path[len('/drive/v3/'):].strip('/').split('/')
+            with self.lock:
+                return self._api(method, parts, query, headers, body)
+        return _error(404, f'Not found: {path}')
+
+    def _api(self, method, parts, query, headers, body):
+        if parts == ['files']:
+            if method == 'GET':
+                return self._list(query)
+            if method == 'POST':
+                return _json(200, self._store(json.loads(body or b'{}')))
+        elif parts == ['files', 'root'] and method == 'GET':
+            return _json(200, {'kind': 'drive#file', 'id': 'root', 'name': 'My Drive', 'mimeType': FOLDER_MIME_TYPE})
+        elif parts[0] == 'files' and len(parts) >= 2:
+            file = self.files.get(parts[1])
+            if file is None or file['trashed']:
+                return _error(404, f'File not found: {parts[1]}.')
+            if len(parts) == 3 and parts[2] == 'export' and method == 'GET':
+                if not file['mimeType'].startswith('application/vnd.google-apps.'):
+                    return _error(403, 'Export only supports Docs Editors files.')
+                content = self.contents[file['id']] or file['name'].encode()
+                return 200, {'Content-Type': query.get('mimeType', 'application/pdf')}, content
+            if len(parts) == 2 and method == 'GET':
+                if query.get('alt') == 'media':
+                    return self._media(file, headers)
+                return _json(200, file)
+            if len(parts) == 2 and method == 'PATCH':
+                return self._update(file, query, body)
+            if len(parts) == 2 and method == 'DELETE':
+                del self.files[file['id']]
+                self.contents.pop(file['id'], None)
+                self._changed(file['id'])
+                return 204, {}, b''
+        elif parts == ['changes', 'startPageToken']:
+            return _json(200, {'startPageToken': str(len(self.changes))})
+        elif parts == ['changes'] and method == 'GET':
+            return self._changes(query)
+        elif parts == ['changes', 'watch'] and method == 'POST':
+            return self._watch(body)
+        elif parts == ['channels', 'stop'] and method == 'POST':
+            stop = json.loads(body or b'{}')
+            channel = self.channels.get(stop.get('id'))
+            if channel is None or channel['resourceId'] != stop.get('resourceId'):
+                return _error(404, f"Channel '{stop.get('id')}' not found for project")
+            del self.channels[channel['id']]
+            return 204, {}, b''
+        return _error(404, 'Not found')
+
+    def _list(self, query):
+        files = [f for f in self.files.values() if not f['trashed']]
+        match = _parents_re.search(query.get('q', ''))
+        if match:
+            files = [f for f in files if match.group(1) in f['parents']]
+        start = int(query.get('pageToken') or 0)
+        size = int(query.get('pageSize') or 100)
+        data = {'files': files[start:start + size]}
+        if start + size < len(files):
+            data['nextPageToken'] = str(start + size)
+        return _json(200, data)
+
+    def _media(self, file, headers):
+        if file['mimeType'].startswith('application/vnd.google-apps.'):
+            return _error(403, 'Only files with binary content can be downloaded. Use Export with Docs Editors files.')
+        content = self.contents[file['id']]
+        match = _range_re.match(headers.get('Range', ''))
+        if not match:
+            return 200, {'Content-Type': file['mimeType']}, content
+        start = int(match.group(1))
+        end = min(int(match.group(2)) if match.group(2) else len(content) - 1, len(content) - 1)
+        return 206, {
+            'Content-Type': file['mimeType'],
+            'Content-Range': f'bytes {start}-{end}/{len(content)}',
+        }, content[start:end + 1]
+
+    def _update(self, file, query, body):
+        if body:
+            file.update({k: v for k, v in json.loads(body).items() if k in ('name', 'mimeType')})
+        parents = [p for p in file['parents'] if p not in query.get('removeParents', '').split(',')]
+        if query.get('addParents'):
+            parents += query['addParents'].split(',')
+        file['parents'] = parents
+        file['modifiedTime'] = _now()
+        self._changed(file['id'])
+        return _json(200, file)
+
+    def _changes(self, query):
+        start = int(query.get('pageToken') or 0)
+        size = int(query.get('pageSize') or 100)
+        changes = []
+        for file_id in self.changes[start:start + size]:
+            file = self.files.get(file_id)
+            change = {'kind': 'drive#change', 'changeType': 'file', 'fileId': file_id, 'removed': file is None}
+            if file is not None:
+                change['file'] = file
+            changes.append(change)
+        data = {'changes': changes}
+        if start + size < len(self.changes):
+            data['nextPageToken'] = str(start + size)
+        else:
+            data['newStartPageToken'] = str(len(self.changes))
+        return _json(200, data)
+
+    def _watch(self, body):
+        request = json.loads(body or b'{}')
+        if request.get('type') != 'web_hook' or not request.get('address'):
+            return _error(400, 'A web_hook channel with an address is required')
+        channel = {
+            'kind': 'api#channel',
+            'id': request['id'],
+            'resourceId': uuid.uuid4().hex,
+            'resourceUri': 'https://www.googleapis.com/drive/v3/changes',
+            'expiration': str(request.get('expiration') or int((time.time() + 3600) * 1000)),
+        }
+        self.channels[channel['id']] = dict(channel, address=request['address'], token=request.get('token', ''), number=0)
+        self._push(self.channels[channel['id']], 'sync')
+        return _json(200, channel)
+
+    def _changed(self, file_id):
+        self.changes.append(file_id)
+        for channel in self.channels.values():
+            self._push(channel, 'change')
+
+    def _push(self, channel, state):
+        channel['number'] += 1
+        headers = {
+            'X-Goog-Channel-ID': channel['id'],
+            'X-Goog-Channel-Token': channel['token'],
+            'X-Goog-Resource-ID': channel['resourceId'],
+            'X-Goog-Resource-URI': channel['resourceUri'],
+            'X-Goog-Resource-State': state,
+            'X-Goog-Message-Number': str(channel['number']),
+        }
+        # Delivered from another thread, like Drive's own, so the change is not held up
+        threading.Thread(target=self._deliver, args=(channel['address'], headers), daemon=True).start()
+
+    @staticmethod
+    def _deliver(address, headers):
+        request = urllib.request.Request(address, data=b'', headers=headers, method='POST')
+        try:
+            urllib.request.urlopen(request, timeout=10).close()
+        except Exception as e:
+            logger.debug(f"Notification to {address} failed: {str(e)}")
+
+    def _upload(self, method, query, headers, body):
+        if query.get('uploadType') != 'resumable':
+            return _error(400, 'Only resumable uploads are supported')
+        upload_id = query.get('upload_id')
+        if upload_id is None and method == 'POST':
+            upload_id = uuid.uuid4().hex
+            with self.lock:
+                self.uploads[upload_id] = (json.loads(body or b'{}'), bytearray())
+            location = f"{headers.get('X-Fake-Base', '')}/upload/drive/v3/files?uploadType=resumable&upload_id={upload_id}"
+            return 200, {'Location': location, 'Content-Length': '0'}, b''
+        with self.lock:
+            session = self.uploads.get(upload_id)
+            if session is None:
+                return _error(404, 'Upload session not found')
+            if method == 'DELETE':
+                del self.uploads[upload_id]
+                return 499, {}, b''
+            metadata, buffer = session
+            match = _content_range_re.match(headers.get('Content-Range', ''))
+            if match is None:
+                return _error(400, 'Missing Content-Range')
+            if match.group(1) is not None and int(match.group(1)) == len(buffer):
+                buffer += body
+            total = match.group(3)
+            if total != '*' and len(buffer) == int(total):
+                del self.uploads[upload_id]
+                return _json(200, self._store(metadata, bytes(buffer)))
+        range_header = {'Range': f'bytes=0-{len(buffer) - 1}'} if buffer else {}
+        return 308, range_header, b''
+
+    def _batch(self, headers, body):
+        content_type = headers.get('Content-Type', '')
+        message = BytesParser(policy=HTTP).parsebytes(
+            f'Content-Type: {content_type}\r\n\r\n'.encode() + body
+        )
+        boundary = uuid.uuid4().hex
+        parts = []
+        for part in message.iter_parts():
+            request = part.get_payload(decode=True) or part.get_payload().encode()
+            head, _, sub_body = request.replace(b'\r\n', b'\n').partition(b'\n\n')
+            lines = head.decode().split('\n')
+            sub_method, sub_target = lines[0].split(' ')[:2]
+            sub_headers = dict(line.split(': ', 1) for line in lines[1:] if ': ' in line)
+            sub_headers = {name.title(): value for name, value in sub_headers.items()}
+            # Parts can fail individually, but the latency is paid once per batch
+            failure = self._perturb(delay=False)
+            status, response_headers, response_body = failure or self.handle(
+                sub_method, sub_target, sub_headers, sub_body, perturb=False
+            )
+            content_id = part['Content-ID'].strip('<>')
+            response_head = ''.join(f'{k}: {v}\r\n' for k, v in response_headers.items())
+            parts.append(
+                f'--{boundary}\r\nContent-Type: application/http\r\nContent-ID: <response-{content_id}>\r\n\r\n'
+                f'HTTP/1.1 {status} X\r\n{response_head}\r\n'.encode() + response_body + b'\r\n'
+            )
+        return 200, {'Content-Type': f'multipart/mixed; boundary={boundary}'}, b''.join(parts) + f'--{boundary}--\r\n'.encode()
+
+
+class FakeDriveRequestHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def _dispatch(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        body = self.rfile.read(length) if length else b''
+        headers = {name.title(): value for name, value in self.headers.items()}
+        headers['X-Fake-Base'] = f'http://{self.headers.get("Host")}'
+        status, response_headers, response_body = self.server.drive.handle(self.command, self.path, headers, body)
+        self.send_response(status)
+        for name, value in response_headers.items():
+            if name != 'Content-Length':
+                self.send_header(name, value)
+        self.send_header('Content-Length', str(len(response_body)))
+        self.end_headers()
+        self.wfile.write(response_body)
+
+    do_GET = do_POST = do_PUT = do_PATCH = do_DELETE = _dispatch
+
+    def log_message(self, format, *args):
+        logger.debug(f"{self.address_string()} {format % args}")
+
+
+def make_server(drive, host='127.0.0.1', port=0):
+    """Return a threading HTTP server for ``drive``; port 0 picks a free one."""
+    server = ThreadingHTTPServer((host, port), FakeDriveRequestHandler)
+    server.daemon_threads = True
+    server.drive = drive
+    return server
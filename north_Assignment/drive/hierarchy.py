@@ -0,0 +1,117 @@
+from django.db import transaction
+from django.db.models import Count, Q, Sum, Value
+from django.db.models.functions import Concat, Substr
+
+from .models import DriveFile, DriveSyncState
+from .pagination import KeysetPaginator
+
+FOLDER_MIME_TYPE = 'application/vnd.google-apps.folder'
+
+# Folder listings go by name; subtrees by path, which lists them depth first
+CHILDREN_PAGINATOR = KeysetPaginator(field='name', descending=False)
+SUBTREE_PAGINATOR = KeysetPaginator(field='path', descending=False, default_size=100, max_size=1000)
+
+
+def placeholder_path(file_id):
+    """Path prefix used for a folder that is not in the mirror, such as My Drive itself."""
+    return f'/{file_id}/'
+
+
+def update_paths(user, file_ids):
+    """Recompute the materialized paths of just-upserted files.
+
+    A file's path lists the Drive ids from the top of the mirror down to
+    itself. A parent that is not mirrored (yet) still gets a segment, so when
+    a folder arrives after its children it adopts them by rewriting that
+    prefix; a folder that moved takes its subtree along the same way. Either
+    costs one UPDATE per folder whose path changed.
+    """
+    with transaction.atomic():
+        rows = {
+            row.file_id: row
+            for row in DriveFile.objects.filter(user=user, file_id__in=file_ids).only(
+                'id', 'file_id', 'parent_id', 'path', 'mime_type'
+            )
+        }
+        outside = {row.parent_id for row in rows.values() if row.parent_id and row.parent_id not in rows}
+        known = dict(
+            DriveFile.objects.filter(user=user, file_id__in=outside).exclude(path='').values_list('file_id', 'path')
+        )
+
+        paths = {}
+
+        def resolve(file_id, visiting=()):
+            if file_id not in paths:
+                parent_id = rows[file_id].parent_id
+                if not parent_id:
+                    prefix = '/'
+                elif parent_id in rows and parent_id not in visiting:
+                    prefix = resolve(parent_id, visiting + (file_id,))
+                else:
+                    prefix = known.get(parent_id) or placeholder_path(parent_id)
+                paths[file_id] = f'{prefix}{file_id}/'
+            return paths[file_id]
+
+        changed = []
+        moves = []
+        for file_id, row in rows.items():
+            path = resolve(file_id)
+            if row.path == path:
+                continue
+            if row.mime_type == FOLDER_MIME_TYPE:
+                moves.append((row.path or placeholder_path(file_id), path))
+            row.path = path
+            changed.append(row)
+        DriveFile.objects.bulk_update(changed, ['path'], batch_size=500)
+
+        # Deepest first, so a folder moved along with its parent is still
+        # found under its own old path
+        for old, new in sorted(moves, key=lambda move: len(move[0]), reverse=True):
+            DriveFile.objects.filter(user=user, path__startswith=old).update(
+                path=Concat(Value(new), Substr('path', len(old) + 1))
+            )
+
+
+def resolve_folder_id(user, folder_id):
+    """Map ``root`` to the user's My Drive id, as recorded by the last full sync."""
+    if folder_id != 'root':
+        return folder_id
+    state = DriveSyncState.objects.filter(user=user).only('root_folder_id').first()
+    return (state and state.root_folder_id) or folder_id
+
+
+def folder_path(user, folder_id):
+    """Path prefix of everything under ``folder_id``, mirrored or not."""
+    path = DriveFile.objects.filter(user=user, file_id=folder_id).values_list('path', flat=True).first()
+    return path or placeholder_path(folder_id)
+
+
+def children(user, folder_id):
+    return DriveFile.objects.filter(user=user, parent_id=folder_id)
+
+
+def subtree(user, folder_id):
+    """Every mirrored file below ``folder_id``, at any depth."""
+    path = folder_path(user, folder_id)
+    return DriveFile.objects.filter(user=user, path__startswith=path).exclude(path=path)
+
+
+def subtree_totals(queryset):
+    is_folder = Q(mime_type=FOLDER_MIME_TYPE)
+    totals = queryset.aggregate(
+        files=Count('id', filter=~is_folder),
+        folders=Count('id', filter=is_folder),
+        size=Sum('size'),
+    )
+    totals['size'] = totals['size'] or 0
+    return totals
+
+
+def ancestors(drive_file):
+    """Mirrored folders above ``drive_file``, from the top down."""
+    ids = drive_file.path.strip('/').split('/')[:-1]
+    folders = {
+        folder.file_id: folder
+        for folder in DriveFile.objects.filter(user_id=drive_file.user_id, file_id__in=ids)
+    }
+    return [folders[file_id] for file_id in ids if file_id in folders]
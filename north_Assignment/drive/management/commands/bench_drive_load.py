@@ -0,0 +1,236 @@
+import asyncio
+import itertools
+import math
+import resource
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from urllib.parse import urlencode
+
+from asgiref.testing import ApplicationCommunicator
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management.base import BaseCommand, CommandError
+from django.test.client import BOUNDARY, MULTIPART_CONTENT, encode_multipart
+from django.test.utils import override_settings
+from rest_framework.authtoken.models import Token
+
+from drive.fakedrive import FakeDrive, make_server
+from drive.models import DriveFile
+from drive.services import service_pool
+from drive.sync import upsert_drive_files
+
+ENDPOINTS = ('list', 'upload', 'download', 'import_file')
+
+# Request bodies are sent in pieces of this size, as a client would
+BODY_CHUNK_SIZE = 64 * 1024
+# Seconds to wait for each ASGI message of a response
+RESPONSE_TIMEOUT = 120
+
+
+def percentile(values, p):
+    """Nearest-rank percentile of already sorted ``values``."""
+    if not values:
+        return 0.0
+    rank = math.ceil(p / 100 * len(values))
+    return values[max(0, min(len(values), rank) - 1)]
+
+
+def peak_rss_mb():
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Reported in bytes on macOS, kilobytes elsewhere
+    return peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024
+
+
+class Command(BaseCommand):
+    help = (
+        'Load-test the Drive endpoints against an in-process fake Drive server. '
+        'Requests go through the project ASGI application, as daphne serves it, at a fixed '
+        'concurrency; reports p50/p95/p99 latency, time to first byte, throughput and peak RSS '
+        'per endpoint. Creates a throwaway user and its mirrored files in the default database '
+        'and deletes them afterwards.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('endpoints', nargs='*', help=f"Endpoints to drive: {', '.join(ENDPOINTS)} (default: all)")
+        parser.add_argument('--concurrency', type=int, default=8, help='Requests in flight at once')
+        parser.add_argument('--requests', type=int, default=200, help='Requests per endpoint')
+        parser.add_argument('--files', type=int, default=200, help='Files in the fake Drive')
+        parser.add_argument('--file-size', type=int, default=256 * 1024, help='Size of each fake Drive file in bytes')
+        parser.add_argument('--upload-size', type=int, default=1024 * 1024, help='Size of each uploaded file in bytes')
+        parser.add_argument('--latency', type=float, default=20.0, help='Milliseconds the fake Drive adds per request')
+        parser.add_argument('--jitter', type=float, default=10.0, help='Extra random milliseconds per request')
+        parser.add_argument('--error-rate', type=float, default=0.0, help='Share of fake Drive requests that fail')
+        parser.add_argument('--seed', type=int, default=0, help='Seed for the fake Drive')
+        parser.add_argument('--cache', action='store_true', help='Keep the download caches enabled (in a temp dir)')
+
+    def handle(self, *args, **options):
+        endpoints = options['endpoints'] or ENDPOINTS
+        unknown = set(endpoints) - set(ENDPOINTS)
+        if unknown:
+            raise CommandError(f"Unknown endpoints: {', '.join(sorted(unknown))}")
+        if options['concurrency'] < 1 or options['requests'] < 1:
+            raise CommandError('--concurrency and --requests must be positive')
+
+        drive = FakeDrive(
+            files=options['files'],
+            file_size=options['file_size'],
+            latency=options['latency'] / 1000,
+            jitter=options['jitter'] / 1000,
+            error_rate=options['error_rate'],
+            seed=options['seed'],
+        )
+        server = make_server(drive)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        host, port = server.server_address[:2]
+
+        cache_dir = tempfile.TemporaryDirectory(prefix='bench-drive-cache-')
+        overrides = {
+            'GOOGLE_DRIVE_API_ROOT': f'http://{host}:{port}/',
+            'ALLOWED_HOSTS': list(settings.ALLOWED_HOSTS) + ['testserver'],
+            'GOOGLE_DRIVE_CACHE_DIR': cache_dir.name,
+        }
+        if not options['cache']:
+            overrides['GOOGLE_DRIVE_CACHE_MAX_BYTES'] = 0
+            overrides['GOOGLE_DRIVE_RENDITION_CACHE_MAX_BYTES'] = 0
+
+        user = None
+        try:
+            with override_settings(**overrides):
+                # Pooled services still point at the real Drive
+                service_pool.clear()
+                user = self._create_user()
+                upsert_drive_files(user, drive.files.values())
+                database = settings.DATABASES['default']
+                self.stdout.write(
+                    f"Writing to database {database['NAME']} on {database.get('HOST') or 'localhost'} "
+                    f"({database['ENGINE']})"
+                )
+                self.stdout.write(
+                    f"Fake Drive at http://{host}:{port}/ with {options['files']} files of {options['file_size']} bytes, "
+                    f"{options['latency']:.0f}+{options['jitter']:.0f}ms latency, {options['error_rate']:.1%} errors; "
+                    f"{options['requests']} requests per endpoint at concurrency {options['concurrency']}"
+                )
+                self.stdout.write(
+                    f"{'endpoint':>12} {'ok':>6} {'errors':>6} {'req/s':>8} "
+                    f"{'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'ttfb p50':>9} {'peak RSS MB':>12}"
+                )
+                # Imported late: the module sets up Django and its routing
+                from north_Assignment.asgi import application
+                for endpoint in endpoints:
+                    request = getattr(self, f'_request_{endpoint}')(user, drive, options)
+                    self._report(endpoint, *asyncio.run(self._run(application, request, user, options)))
+        finally:
+            if user is not None:
+                user.delete()
+            service_pool.clear()
+            server.shutdown()
+            server.server_close()
+            cache_dir.cleanup()
+
+    def _create_user(self):
+        user = User.objects.create(username=f'bench-load-{uuid.uuid4().hex[:12]}', email='bench-load@example.com')
+        profile = user.profile
+        profile.google_token = 'fake-token'
+        profile.refresh_token = 'fake-refresh-token'
+        profile.token_expiry = None
+        profile.save()
+        Token.objects.create(user=user)
+        return user
+
+    async def _run(self, application, request, user, options):
+        """Closed loop: ``concurrency`` clients each send their next request as soon as one returns."""
+        counter = itertools.count()
+        latencies = []
+        ttfbs = []
+        errors = 0
+        total = options['requests']
+        headers = [(b'authorization', f'Token {user.auth_token.key}'.encode()), (b'host', b'testserver')]
+
+        async def client():
+            nonlocal errors
+            for i in counter:
+                if i >= total:
+                    return
+                started = time.perf_counter()
+                status_code, ttfb = await self._request(application, headers, *request(i))
+                latencies.append(time.perf_counter() - started)
+                ttfbs.append(ttfb)
+                if status_code >= 400:
+                    errors += 1
+
+        started = time.perf_counter()
+        await asyncio.gather(*(client() for _ in range(options['concurrency'])))
+        return sorted(latencies), sorted(ttfbs), errors, time.perf_counter() - started
+
+    async def _request(self, application, headers, method, path, query=None, data=None):
+        """Send one HTTP request through the ASGI app; returns its status and time to first body byte."""
+        started = time.perf_counter()
+        body = encode_multipart(BOUNDARY, data) if data is not None else b''
+        headers = list(headers)
+        if data is not None:
+            headers += [(b'content-type', MULTIPART_CONTENT.encode()), (b'content-length', str(len(body)).encode())]
+        communicator = ApplicationCommunicator(application, {
+            'type': 'http',
+            'asgi': {'version': '3.0'},
+            'http_version': '1.1',
+            'method': method,
+            'scheme': 'http',
+            'path': path,
+            'raw_path': path.encode(),
+            'query_string': urlencode(query or {}).encode(),
+            'headers': headers,
+            'client': ('127.0.0.1', 0),
+            'server': ('testserver', 80),
+        })
+        chunks = [body[i:i + BODY_CHUNK_SIZE] for i in range(0, len(body), BODY_CHUNK_SIZE)] or [b'']
+        for n, chunk in enumerate(chunks):
+            await communicator.send_input({'type': 'http.request', 'body': chunk, 'more_body': n < len(chunks) - 1})
+
+        start = await communicator.receive_output(RESPONSE_TIMEOUT)
+        ttfb = None
+        while True:
+            message = await communicator.receive_output(RESPONSE_TIMEOUT)
+            if ttfb is None and message.get('body'):
+                ttfb = time.perf_counter() - started
+            if not message.get('more_body'):
+                break
+        await communicator.wait(RESPONSE_TIMEOUT)
+        return start['status'], ttfb if ttfb is not None else time.perf_counter() - started
+
+    def _report(self, endpoint, latencies, ttfbs, errors, elapsed):
+        self.stdout.write(
+            f"{endpoint:>12} {len(latencies) - errors:>6} {errors:>6} {len(latencies) / elapsed:>8.1f} "
+            f"{percentile(latencies, 50) * 1000:>8.1f} {percentile(latencies, 95) * 1000:>8.1f} "
+            f"{percentile(latencies, 99) * 1000:>8.1f} {percentile(ttfbs, 50) * 1000:>9.1f} {peak_rss_mb():>12.1f}"
+        )
+
+    def _request_list(self, user, drive, options):
+        def request(i):
+            return 'GET', '/drive/files/', {'page_size': 20}
+        return request
+
+    def _request_upload(self, user, drive, options):
+        content = b'\0' * options['upload_size']
+
+        def request(i):
+            upload = SimpleUploadedFile(f'bench-{i}.bin', content, content_type='application/octet-stream')
+            return 'POST', '/drive/files/upload/', None, {'file': upload}
+        return request
+
+    def _request_download(self, user, drive, options):
+        pks = list(DriveFile.objects.filter(user=user).values_list('pk', flat=True))
+
+        def request(i):
+            return 'GET', f'/drive/files/{pks[i % len(pks)]}/download/'
+        return request
+
+    def _request_import_file(self, user, drive, options):
+        file_ids = list(drive.files)
+
+        def request(i):
+            return 'POST', '/drive/files/import_file/', None, {'file_id': file_ids[i % len(file_ids)]}
+        return request
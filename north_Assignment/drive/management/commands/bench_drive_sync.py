@@ -0,0 +1,73 @@
+import time
+import uuid
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext
+
+from drive.models import DriveFile
+from drive.sync import upsert_drive_files
+
+
+class _Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = 'Compare per-row update_or_create against the bulk upsert used by the Drive list sync.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--items', type=int, default=1000, help='Files per synced page')
+        parser.add_argument('--rounds', type=int, default=3, help='Repetitions per path')
+
+    def handle(self, *args, **options):
+        items = [
+            {
+                'id': f'bench-{i}',
+                'name': f'file-{i}.txt',
+                'mimeType': 'text/plain',
+                'size': str(i * 1024),
+            }
+            for i in range(options['items'])
+        ]
+
+        self.stdout.write(f"Syncing a page of {len(items)} files, {options['rounds']} rounds per path")
+        for label, sync in (('update_or_create', self._sync_per_row), ('bulk upsert', upsert_drive_files)):
+            # First round inserts, later rounds update the now-existing rows
+            timings, queries = self._run(sync, items, options['rounds'])
+            self.stdout.write(
+                f"{label:>16}: insert {timings[0] * 1000:8.1f}ms, "
+                f"update {min(timings[1:] or timings) * 1000:8.1f}ms, "
+                f"{queries} queries per round"
+            )
+
+    def _run(self, sync, items, rounds):
+        timings = []
+        queries = 0
+        try:
+            with transaction.atomic():
+                user = User.objects.create(username=f'bench-{uuid.uuid4().hex}')
+                for _ in range(rounds):
+                    with CaptureQueriesContext(connection) as captured:
+                        started = time.perf_counter()
+                        sync(user, items)
+                        timings.append(time.perf_counter() - started)
+                    queries = len(captured)
+                raise _Rollback()
+        except _Rollback:
+            pass
+        return timings, queries
+
+    @staticmethod
+    def _sync_per_row(user, items):
+        for item in items:
+            DriveFile.objects.update_or_create(
+                user=user,
+                file_id=item['id'],
+                defaults={
+                    'name': item.get('name', 'Unnamed'),
+                    'mime_type': item.get('mimeType', 'unknown'),
+                    'size': item.get('size')
+                }
+            )
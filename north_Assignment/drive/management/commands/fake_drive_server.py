@@ -0,0 +1,42 @@
+from django.core.management.base import BaseCommand
+
+from drive.fakedrive import FakeDrive, make_server
+
+
+class Command(BaseCommand):
+    help = (
+        'Serve an in-memory fake of the Drive v3 API for local testing and benchmarks. '
+        'Point the app at it with GOOGLE_DRIVE_API_ROOT=http://<addr>:<port>/.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--addr', default='127.0.0.1', help='Address to listen on')
+        parser.add_argument('--port', type=int, default=8765, help='Port to listen on')
+        parser.add_argument('--files', type=int, default=100, help='Files to seed the fake Drive with')
+        parser.add_argument('--file-size', type=int, default=64 * 1024, help='Size of each seeded file in bytes')
+        parser.add_argument('--latency', type=float, default=0.0, help='Milliseconds added to every request')
+        parser.add_argument('--jitter', type=float, default=0.0, help='Up to this many extra random milliseconds per request')
+        parser.add_argument('--error-rate', type=float, default=0.0, help='Share of requests (0-1) answered with 500/503/429')
+        parser.add_argument('--seed', type=int, default=0, help='Seed for file contents, jitter and errors')
+
+    def handle(self, *args, **options):
+        drive = FakeDrive(
+            files=options['files'],
+            file_size=options['file_size'],
+            latency=options['latency'] / 1000,
+            jitter=options['jitter'] / 1000,
+            error_rate=options['error_rate'],
+            seed=options['seed'],
+        )
+        server = make_server(drive, options['addr'], options['port'])
+        host, port = server.server_address[:2]
+        self.stdout.write(self.style.SUCCESS(
+            f"Fake Drive serving {options['files']} files at http://{host}:{port}/ "
+            f"(set GOOGLE_DRIVE_API_ROOT=http://{host}:{port}/)"
+        ))
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
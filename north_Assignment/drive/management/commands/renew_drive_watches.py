@@ -0,0 +1,23 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from drive.notifications import renew_channels
+
+
+class Command(BaseCommand):
+    help = (
+        'Replace Drive push-notification channels that are about to expire. '
+        'Run it from cron at least every GOOGLE_DRIVE_WATCH_RENEW_BEFORE seconds, or keep it running with --interval.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--interval', type=float, default=0, help='Seconds between passes; 0 runs once')
+
+    def handle(self, *args, **options):
+        while True:
+            renewed, failed = renew_channels()
+            self.stdout.write(f"Renewed Drive watches of {renewed} users ({failed} failed)")
+            if not options['interval']:
+                break
+            time.sleep(options['interval'])
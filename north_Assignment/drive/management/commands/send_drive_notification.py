@@ -0,0 +1,44 @@
+import requests
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from drive.models import DriveWatchChannel
+
+
+class Command(BaseCommand):
+    help = (
+        "Post fake Drive push notifications for users' watch channels to the webhook, "
+        'as Drive would after a change, to exercise validation and debouncing locally.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('users', nargs='+', help='Emails of the users whose channels to notify')
+        parser.add_argument('--url', default=None, help='Webhook URL (default: GOOGLE_DRIVE_WEBHOOK_URL)')
+        parser.add_argument('--count', type=int, default=1, help='Notifications per channel, sent back to back')
+        parser.add_argument('--state', default='change', help='X-Goog-Resource-State to send (sync, change, ...)')
+        parser.add_argument('--bad-token', action='store_true', help='Send a wrong channel token, which must be refused')
+
+    def handle(self, *args, **options):
+        url = options['url'] or settings.GOOGLE_DRIVE_WEBHOOK_URL
+        if not url:
+            raise CommandError('No webhook URL: pass --url or set GOOGLE_DRIVE_WEBHOOK_URL')
+
+        channels = DriveWatchChannel.objects.select_related('user').filter(user__email__in=options['users'])
+        if not channels:
+            raise CommandError('No watch channels for these users; POST /drive/files/watch/ first')
+
+        with requests.Session() as session:
+            for channel in channels:
+                statuses = []
+                for number in range(channel.last_message_number + 1, channel.last_message_number + 1 + options['count']):
+                    response = session.post(url, headers={
+                        'X-Goog-Channel-ID': channel.channel_id,
+                        'X-Goog-Channel-Token': 'not-the-token' if options['bad_token'] else channel.token,
+                        'X-Goog-Channel-Expiration': channel.expiration.strftime('%a, %d %b %Y %H:%M:%S GMT'),
+                        'X-Goog-Resource-ID': channel.resource_id,
+                        'X-Goog-Resource-URI': 'https://www.googleapis.com/drive/v3/changes',
+                        'X-Goog-Resource-State': options['state'],
+                        'X-Goog-Message-Number': str(number),
+                    })
+                    statuses.append(response.status_code)
+                self.stdout.write(f"{channel.user.email} ({channel.channel_id}): {statuses}")
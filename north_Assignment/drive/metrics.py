@@ -0,0 +1,61 @@
+import threading
+
+_registry = {}
+_registry_lock = threading.Lock()
+
+
+class MetricSet:
+    """Thread-safe counters and timings for one drive subsystem."""
+
+    def __init__(self, name):
+        self.name = name
+        self._lock = threading.Lock()
+        self._counters = {}
+        self._timings = {}
+
+    def incr(self, key, amount=1):
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + amount
+
+    def observe(self, key, value):
+        """Record a duration (seconds) or any other sampled value."""
+        with self._lock:
+            timing = self._timings.get(key)
+            if timing is None:
+                timing = self._timings[key] = {'count': 0, 'total': 0.0, 'max': 0.0, 'last': 0.0}
+            timing['count'] += 1
+            timing['total'] += value
+            timing['last'] = value
+            if value > timing['max']:
+                timing['max'] = value
+
+    def get(self, key):
+        with self._lock:
+            return self._counters.get(key, 0)
+
+    def snapshot(self):
+        with self._lock:
+            data = dict(self._counters)
+            for key, timing in self._timings.items():
+                data[key] = dict(timing, avg=timing['total'] / timing['count'])
+            return data
+
+    def reset(self):
+        with self._lock:
+            self._counters.clear()
+            self._timings.clear()
+
+
+def get_metrics(name):
+    """Return the process-wide MetricSet registered under ``name``."""
+    with _registry_lock:
+        metrics = _registry.get(name)
+        if metrics is None:
+            metrics = _registry[name] = MetricSet(name)
+        return metrics
+
+
+def snapshot_all():
+    with _registry_lock:
+        metric_sets = list(_registry.values())
+    return {metrics.name: metrics.snapshot() for metrics in metric_sets}
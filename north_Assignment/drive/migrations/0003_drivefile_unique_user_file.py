@@ -0,0 +1,36 @@
+# Generated by Django 5.2.18 on 2026-10-17 02:55
+
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count, Max
+
+
+def dedupe_drive_files(apps, schema_editor):
+    """Keep only the most recent row for each (user, file_id) pair."""
+    DriveFile = apps.get_model('drive', 'DriveFile')
+    duplicates = (
+        DriveFile.objects.values('user_id', 'file_id')
+        .annotate(rows=Count('id'), keep_id=Max('id'))
+        .filter(rows__gt=1)
+    )
+    for duplicate in duplicates.iterator():
+        DriveFile.objects.filter(
+            user_id=duplicate['user_id'],
+            file_id=duplicate['file_id'],
+        ).exclude(id=duplicate['keep_id']).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('drive', '0002_drivefile_size_drivefile_updated_at_and_more'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.RunPython(dedupe_drive_files, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='drivefile',
+            constraint=models.UniqueConstraint(fields=('user', 'file_id'), name='drive_file_unique_user_file'),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.2.18 on 2026-10-17 02:56
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('drive', '0003_drivefile_unique_user_file'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='drivefile',
+            index=models.Index(fields=['user', '-updated_at', '-id'], name='drive_file_user_updated'),
+        ),
+        migrations.AddIndex(
+            model_name='drivefile',
+            index=models.Index(fields=['user', 'mime_type', '-updated_at', '-id'], name='drive_file_user_mime_updated'),
+        ),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 5.2.18 on 2026-10-17 02:58
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('drive', '0005_drivesyncstate'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='drivesyncstate',
+            name='full_sync_started_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='drivesyncstate',
+            name='pending_page_token',
+            field=models.CharField(blank=True, max_length=255),
+        ),
+        migrations.AddField(
+            model_name='drivesyncstate',
+            name='pending_start_page_token',
+            field=models.CharField(blank=True, max_length=255),
+        ),
+    ]
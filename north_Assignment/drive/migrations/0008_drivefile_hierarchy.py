@@ -0,0 +1,38 @@
+# Generated by Django 5.2.18 on 2026-10-17 03:27
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('drive', '0007_drivefile_name_search'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='drivefile',
+            name='parent_id',
+            field=models.CharField(blank=True, default='', max_length=255),
+        ),
+        migrations.AddField(
+            model_name='drivefile',
+            name='path',
+            field=models.TextField(blank=True, db_collation='C', default=''),
+        ),
+        migrations.AddField(
+            model_name='drivesyncstate',
+            name='root_folder_id',
+            field=models.CharField(blank=True, max_length=255),
+        ),
+        migrations.AddIndex(
+            model_name='drivefile',
+            index=models.Index(fields=['user', 'parent_id', 'name', 'id'], name='drive_file_user_parent'),
+        ),
+        migrations.AddIndex(
+            model_name='drivefile',
+            index=models.Index(fields=['user', 'path'], name='drive_file_user_path'),
+        ),
+    ]
@@ -0,0 +1,31 @@
+# Generated by Django 5.2.18 on 2026-10-17 04:12
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('drive', '0010_drivewatchchannel'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='drivefile',
+            name='drive_file_user_updated',
+        ),
+        migrations.RemoveIndex(
+            model_name='drivefile',
+            name='drive_file_user_mime_updated',
+        ),
+        migrations.AddIndex(
+            model_name='drivefile',
+            index=models.Index(fields=['user', '-created_at', '-id'], name='drive_file_user_created'),
+        ),
+        migrations.AddIndex(
+            model_name='drivefile',
+            index=models.Index(fields=['user', 'mime_type', '-created_at', '-id'], name='drive_file_user_mime_created'),
+        ),
+    ]
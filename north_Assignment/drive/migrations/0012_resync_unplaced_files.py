@@ -0,0 +1,32 @@
+# Generated by Django 5.2.18 on 2026-10-17 04:20
+
+from django.db import migrations
+
+
+def force_full_sync(apps, schema_editor):
+    """Make the next sync of users mirrored before 0008 a full one.
+
+    Their files got no parent or path, so children and subtree would list
+    nothing for them until a full listing places every file. An interrupted
+    full sync is started over too: its earlier pages were not placed either.
+    """
+    DriveFile = apps.get_model('drive', 'DriveFile')
+    DriveSyncState = apps.get_model('drive', 'DriveSyncState')
+    users = DriveFile.objects.filter(path='').values('user_id')
+    DriveSyncState.objects.filter(user_id__in=users).update(
+        start_page_token='',
+        full_sync_started_at=None,
+        pending_start_page_token='',
+        pending_page_token='',
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('drive', '0011_drivefile_created_keyset_indexes'),
+    ]
+
+    operations = [
+        migrations.RunPython(force_full_sync, migrations.RunPython.noop),
+    ]
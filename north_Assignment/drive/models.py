@@ -1,16 +1,96 @@
 from django.db import models
+from django.db.models import F, Func, Value
 from django.contrib.auth.models import User
+from django.contrib.postgres.indexes import GinIndex
+from django.contrib.postgres.search import SearchVector
 
 # Create your models here.
 
+def name_search_vector():
+    """Full-text vector of a file name, split into words at any punctuation.
+
+    The default parser keeps names like ``report_2023.pdf`` as one token, so
+    non-alphanumerics become spaces first. Queries must use this exact
+    expression to be served by the GIN index over it.
+    """
+    words = Func(F('name'), Value('[^[:alnum:]]+'), Value(' '), Value('g'), function='regexp_replace')
+    return SearchVector(words, config='simple')
+
 class DriveFile(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='drive_files')
     file_id = models.CharField(max_length=255)
     name = models.CharField(max_length=255)
     mime_type = models.CharField(max_length=100)
     size = models.BigIntegerField(null=True, blank=True)
+    # Drive id of the (first) parent folder, and the materialized path of Drive
+    # ids from the top of the mirror down to this file: /root/folder/file/
+    # (see drive/hierarchy.py). C collation lets one index serve both prefix
+    # matches and ordering.
+    parent_id = models.CharField(max_length=255, blank=True, default='')
+    path = models.TextField(blank=True, default='', db_collation='C')
+    # Drive's MD5 of the content; empty for Google Workspace files and folders
+    md5_checksum = models.CharField(max_length=32, blank=True, default='')
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
     
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'file_id'], name='drive_file_unique_user_file'),
+        ]
+        indexes = [
+            # Keyset pagination of a user's mirror, optionally narrowed by type.
+            # On created_at, which syncs never change: updated_at is bumped by
+            # every upsert and would move rows past a client's cursor.
+            models.Index(fields=['user', '-created_at', '-id'], name='drive_file_user_created'),
+            models.Index(fields=['user', 'mime_type', '-created_at', '-id'], name='drive_file_user_mime_created'),
+            # Word-prefix search on names (see drive/search.py)
+            GinIndex(name_search_vector(), name='drive_file_name_search'),
+            # Children of a folder by name, and subtrees / ancestors by path
+            models.Index(fields=['user', 'parent_id', 'name', 'id'], name='drive_file_user_parent'),
+            models.Index(fields=['user', 'path'], name='drive_file_user_path'),
+            # Duplicate detection on upload (see drive/uploads.py)
+            models.Index(fields=['user', 'md5_checksum'], name='drive_file_user_md5'),
+        ]
+    
     def __str__(self):
         return f"{self.name} ({self.file_id})"
+
+class DriveSyncState(models.Model):
+    """Per-user Changes API cursor for incremental mirroring of DriveFile."""
+    user = models.OneToOneField(User, on_delete=models.CASCADE, related_name='drive_sync_state')
+    start_page_token = models.CharField(max_length=255, blank=True)
+    # Checkpoint of a full sync in progress, so an interrupted one can resume
+    full_sync_started_at = models.DateTimeField(null=True, blank=True)
+    pending_start_page_token = models.CharField(max_length=255, blank=True)
+    pending_page_token = models.CharField(max_length=255, blank=True)
+    last_full_sync_at = models.DateTimeField(null=True, blank=True)
+    # Drive id of My Drive, so folder_id=root can be browsed locally
+    root_folder_id = models.CharField(max_length=255, blank=True)
+    last_synced_at = models.DateTimeField(null=True, blank=True)
+    
+    def __str__(self):
+        return f"Drive sync state for {self.user}"
+
+class DriveWatchChannel(models.Model):
+    """A Drive changes.watch channel that pushes a user's changes to the webhook.
+
+    ``token`` is echoed back by Drive on every notification and, with the
+    channel and resource ids, is what authenticates one.
+    """
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='drive_watch_channels')
+    channel_id = models.CharField(max_length=64, unique=True)
+    resource_id = models.CharField(max_length=255)
+    token = models.CharField(max_length=64)
+    expiration = models.DateTimeField()
+    # Highest X-Goog-Message-Number seen; older or repeated messages are ignored
+    last_message_number = models.BigIntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+    
+    class Meta:
+        indexes = [
+            # Channels due for renewal
+            models.Index(fields=['expiration'], name='drive_watch_expiration'),
+        ]
+    
+    def __str__(self):
+        return f"Drive watch channel {self.channel_id} for {self.user}"
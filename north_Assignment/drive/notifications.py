@@ -0,0 +1,246 @@
+import datetime
+import logging
+import secrets
+import threading
+import uuid
+
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.db import connection
+from django.utils import timezone
+from django.utils.crypto import constant_time_compare
+from googleapiclient.errors import HttpError
+
+from .metrics import get_metrics
+from .models import DriveSyncState, DriveWatchChannel
+from .services import service_pool
+from .sync import incremental_sync
+
+logger = logging.getLogger(__name__)
+
+metrics = get_metrics('notifications')
+
+
+def user_group(user_id):
+    """Channels group of the WebSocket clients of one user (see consumers.DriveConsumer)."""
+    return f'drive_{user_id}'
+
+
+def _from_millis(value):
+    if not value:
+        return None
+    return datetime.datetime.fromtimestamp(int(value) / 1000, tz=datetime.timezone.utc)
+
+
+def watch_changes(user, drive_service):
+    """Open a changes.watch channel posting the user's changes to GOOGLE_DRIVE_WEBHOOK_URL.
+
+    Changes are watched from the mirror's cursor, so nothing made since the
+    last sync goes unannounced.
+    """
+    state = DriveSyncState.objects.filter(user=user).only('start_page_token').first()
+    page_token = state and state.start_page_token
+    if not page_token:
+        page_token = drive_service.changes().getStartPageToken().execute()['startPageToken']
+
+    channel_id = uuid.uuid4().hex
+    token = secrets.token_urlsafe(32)
+    expiration = timezone.now() + datetime.timedelta(seconds=settings.GOOGLE_DRIVE_WATCH_TTL)
+    response = drive_service.changes().watch(
+        pageToken=page_token,
+        includeRemoved=True,
+        spaces='drive',
+        body={
+            'id': channel_id,
+            'type': 'web_hook',
+            'address': settings.GOOGLE_DRIVE_WEBHOOK_URL,
+            'token': token,
+            'expiration': int(expiration.timestamp() * 1000),
+        },
+    ).execute()
+    metrics.incr('watches')
+    # Drive may shorten the lifetime asked for
+    return DriveWatchChannel.objects.create(
+        user=user,
+        channel_id=channel_id,
+        resource_id=response['resourceId'],
+        token=token,
+        expiration=_from_millis(response.get('expiration')) or expiration,
+    )
+
+
+def stop_channel(drive_service, channel):
+    """Stop a channel in Drive and forget it; one Drive no longer knows is just forgotten."""
+    try:
+        drive_service.channels().stop(body={'id': channel.channel_id, 'resourceId': channel.resource_id}).execute()
+    except HttpError as e:
+        if e.resp.status != 404:
+            raise
+    channel.delete()
+
+
+def ensure_watch(user, drive_service):
+    """Return a channel for ``user`` that is not due for renewal, opening one if needed.
+
+    A new channel is opened before the old ones are stopped, so no
+    notification falls in between.
+    """
+    renew_at = timezone.now() + datetime.timedelta(seconds=settings.GOOGLE_DRIVE_WATCH_RENEW_BEFORE)
+    channels = list(DriveWatchChannel.objects.filter(user=user).order_by('-expiration'))
+    if channels and channels[0].expiration > renew_at:
+        return channels[0]
+    channel = watch_changes(user, drive_service)
+    for old in channels:
+        try:
+            stop_channel(drive_service, old)
+        except Exception as e:
+            logger.warning(f"Could not stop Drive watch channel {old.channel_id}: {str(e)}")
+    return channel
+
+
+def stop_watching(user, drive_service):
+    stopped = 0
+    for channel in DriveWatchChannel.objects.filter(user=user):
+        stop_channel(drive_service, channel)
+        stopped += 1
+    return stopped
+
+
+def renew_channels():
+    """Replace every channel that expires within GOOGLE_DRIVE_WATCH_RENEW_BEFORE.
+
+    Returns ``(renewed, failed)`` counts of users.
+    """
+    renew_at = timezone.now() + datetime.timedelta(seconds=settings.GOOGLE_DRIVE_WATCH_RENEW_BEFORE)
+    user_ids = set(DriveWatchChannel.objects.filter(expiration__lte=renew_at).values_list('user_id', flat=True))
+    renewed = failed = 0
+    for user in User.objects.select_related('profile').filter(pk__in=user_ids):
+        try:
+            drive_service = service_pool.get(user)
+            if drive_service is None:
+                raise ValueError('Google Drive not connected')
+            ensure_watch(user, drive_service)
+            renewed += 1
+        except Exception as e:
+            failed += 1
+            metrics.incr('renew_errors')
+            logger.error(f"Could not renew Drive watch for {user}: {str(e)}")
+    # Expired channels of users that could not be renewed only take up room
+    DriveWatchChannel.objects.filter(expiration__lte=timezone.now()).delete()
+    metrics.incr('renewed', renewed)
+    return renewed, failed
+
+
+def authenticate_notification(headers):
+    """Return the channel a push notification is for, or None if it is not genuine.
+
+    The channel id must be known, and the token and resource id must be the
+    ones Drive was given and returned for it.
+    """
+    channel_id = headers.get('X-Goog-Channel-Id')
+    if not channel_id:
+        return None
+    channel = DriveWatchChannel.objects.filter(channel_id=channel_id).first()
+    if channel is None or channel.expiration <= timezone.now():
+        return None
+    if not constant_time_compare(headers.get('X-Goog-Channel-Token', ''), channel.token):
+        return None
+    if headers.get('X-Goog-Resource-Id') != channel.resource_id:
+        return None
+    return channel
+
+
+def accept_message(channel, message_number):
+    """Record ``message_number`` for ``channel``; False if it is a replay.
+
+    Drive numbers a channel's messages in increasing (not consecutive) order.
+    One delivered late is dropped too, which is harmless: any notification
+    syncs every change since the cursor.
+    """
+    return bool(
+        DriveWatchChannel.objects.filter(pk=channel.pk, last_message_number__lt=message_number)
+        .update(last_message_number=message_number)
+    )
+
+
+def notify_clients(user_id, result):
+    """Tell the user's connected WebSocket clients what a sync changed."""
+    channel_layer = get_channel_layer()
+    if channel_layer is None:
+        return
+    try:
+        async_to_sync(channel_layer.group_send)(user_group(user_id), dict(result, type='drive.changed'))
+    except Exception as e:
+        logger.warning(f"Could not notify Drive clients of user {user_id}: {str(e)}")
+
+
+def refresh_user(user_id):
+    """Sync one user's mirror and, if anything changed, tell their clients."""
+    user = User.objects.select_related('profile').get(pk=user_id)
+    drive_service = service_pool.get(user)
+    if drive_service is None:
+        return None
+    result = incremental_sync(user, drive_service)
+    metrics.incr('refreshes')
+    if result['mode'] == 'full' or result['upserted'] or result['removed']:
+        notify_clients(user_id, result)
+    return result
+
+
+class RefreshDebouncer:
+    """Coalesce bursts of notifications into one incremental sync per user.
+
+    The first notification schedules a sync ``delay`` seconds later, and
+    those arriving before it starts are absorbed. One arriving while a sync
+    runs schedules a single follow-up, so no change is left unsynced.
+    Debouncing is per process.
+    """
+
+    def __init__(self, refresh=refresh_user, delay=None):
+        self.refresh = refresh
+        self.delay = delay
+        self._lock = threading.Lock()
+        # user id -> 'scheduled', 'running' or 'rerun'
+        self._pending = {}
+
+    def notify(self, user_id):
+        """Schedule a sync for ``user_id``; False if one was already due."""
+        with self._lock:
+            state = self._pending.get(user_id)
+            if state == 'running':
+                self._pending[user_id] = 'rerun'
+            if state is not None:
+                metrics.incr('coalesced')
+                return False
+            self._pending[user_id] = 'scheduled'
+        self._schedule(user_id)
+        return True
+
+    def _schedule(self, user_id):
+        delay = settings.GOOGLE_DRIVE_NOTIFICATION_DEBOUNCE if self.delay is None else self.delay
+        timer = threading.Timer(delay, self._run, args=(user_id,))
+        timer.daemon = True
+        timer.start()
+
+    def _run(self, user_id):
+        with self._lock:
+            self._pending[user_id] = 'running'
+        try:
+            self.refresh(user_id)
+        except Exception as e:
+            metrics.incr('refresh_errors')
+            logger.error(f"Drive refresh for user {user_id} failed: {str(e)}")
+        finally:
+            # Timer threads hold their own connection
+            connection.close()
+            with self._lock:
+                rerun = self._pending.pop(user_id) == 'rerun'
+                if rerun:
+                    self._pending[user_id] = 'scheduled'
+            if rerun:
+                self._schedule(user_id)
+
+
+debouncer = RefreshDebouncer()
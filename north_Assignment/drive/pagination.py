@@ -0,0 +1,84 @@
+import base64
+import json
+
+from django.core.exceptions import ValidationError
+from django.db.models import Q
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+class KeysetPaginator:
+    """Keyset pagination over ``(field, id)``, newest first unless ``descending`` is False.
+
+    Each page is a single index range scan that starts where the previous one
+    stopped, so its cost does not depend on how many rows precede it.
+    """
+
+    def __init__(self, field='updated_at', default_size=20, max_size=100, output_field=None, descending=True):
+        self.field = field
+        self.descending = descending
+        # Needed when ``field`` is an annotation rather than a model field
+        self.output_field = output_field
+        self.default_size = default_size
+        self.max_size = max_size
+
+    def get_page_size(self, request, param='page_size'):
+        # DRF requests expose query_params, plain Django ones (async views) GET
+        params = getattr(request, 'query_params', request.GET)
+        try:
+            size = int(params.get(param, self.default_size))
+        except ValueError:
+            size = self.default_size
+        return max(1, min(size, self.max_size))
+
+    def paginate(self, queryset, cursor=None, page_size=None):
+        """Return ``(rows, next_cursor)``; ``next_cursor`` is None on the last page."""
+        page_size = page_size or self.default_size
+        rows = list(self._page_queryset(queryset, cursor, page_size))
+        return self._finish_page(rows, page_size)
+
+    async def apaginate(self, queryset, cursor=None, page_size=None):
+        """Async version of paginate()."""
+        page_size = page_size or self.default_size
+        rows = [row async for row in self._page_queryset(queryset, cursor, page_size)]
+        return self._finish_page(rows, page_size)
+
+    def _page_queryset(self, queryset, cursor, page_size):
+        order, after = ('-', 'lt') if self.descending else ('', 'gt')
+        queryset = queryset.order_by(f'{order}{self.field}', f'{order}id')
+        if cursor:
+            value, pk = self.decode(queryset.model, cursor)
+            queryset = queryset.filter(
+                Q(**{f'{self.field}__{after}': value}) | Q(**{self.field: value, f'id__{after}': pk})
+            )
+        # One extra row tells whether there is a next page
+        return queryset[:page_size + 1]
+
+    def _finish_page(self, rows, page_size):
+        next_cursor = None
+        if len(rows) > page_size:
+            rows = rows[:page_size]
+            last = rows[-1]
+            next_cursor = self.encode(getattr(last, self.field), last.pk)
+        return rows, next_cursor
+
+    def encode(self, value, pk):
+        if hasattr(value, 'isoformat'):
+            value = value.isoformat()
+        raw = json.dumps([value, pk]).encode()
+        return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+    def decode(self, model, cursor):
+        try:
+            padded = cursor + '=' * (-len(cursor) % 4)
+            value, pk = json.loads(base64.urlsafe_b64decode(padded))
+            field = self.output_field or model._meta.get_field(self.field)
+            value = field.to_python(value)
+            # Keyset fields are never null, and None would break the page filter
+            if value is None or pk is None:
+                raise ValueError
+            return value, int(pk)
+        except (ValueError, TypeError, ValidationError):
+            raise InvalidCursor(f'Invalid cursor: {cursor}')
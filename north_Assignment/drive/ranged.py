@@ -0,0 +1,192 @@
+import logging
+import mmap
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import closing
+
+import requests
+from django.conf import settings
+from google.auth.transport.requests import AuthorizedSession
+
+from . import throttle
+from .metrics import get_metrics
+
+logger = logging.getLogger(__name__)
+
+metrics = get_metrics('ranged_downloads')
+
+# (connect, read) timeouts of each range request, in seconds
+TIMEOUT = (10, 60)
+
+
+class RangedDownloadError(Exception):
+    def __init__(self, status_code, reason):
+        super().__init__(f'{status_code} {reason}')
+        self.status_code = status_code
+        self.reason = reason
+
+
+def use_ranged_download(size):
+    """Whether a file of ``size`` bytes should be fetched as parallel ranges."""
+    threshold = settings.GOOGLE_DRIVE_PARALLEL_DOWNLOAD_THRESHOLD
+    return bool(threshold) and size is not None and int(size) >= threshold
+
+
+def iter_range(session, credentials, uri, start, end, chunk_size=None):
+    """Yield bytes ``start``-``end`` of a Drive media URI as they arrive.
+
+    ``session`` is an AuthorizedSession for ``credentials``. A request that
+    fails part-way is resumed from the first missing byte, with the retry and
+    throttling rules of other Drive calls (see throttle).
+    """
+    chunk_size = chunk_size or settings.GOOGLE_DRIVE_DOWNLOAD_CHUNK_SIZE
+    offset = start
+    attempt = 0
+    while offset <= end:
+        throttle.acquire(credentials)
+        try:
+            with session.get(
+                uri,
+                headers={'Range': f'bytes={offset}-{end}'},
+                stream=True,
+                timeout=TIMEOUT,
+            ) as response:
+                # A 200 is only usable if it starts where this range does
+                if response.status_code != 206 and not (response.status_code == 200 and offset == 0):
+                    raise RangedDownloadError(response.status_code, response.text)
+                for chunk in response.iter_content(chunk_size):
+                    chunk = chunk[:end + 1 - offset]
+                    offset += len(chunk)
+                    metrics.incr('bytes', len(chunk))
+                    yield chunk
+                    if offset > end:
+                        break
+            if offset <= end:
+                raise requests.exceptions.ChunkedEncodingError(f'Range ended early at byte {offset}')
+        except (requests.RequestException, RangedDownloadError) as e:
+            status_code = getattr(e, 'status_code', None)
+            reasons = throttle.error_reasons(getattr(e, 'reason', ''))
+            if attempt >= settings.GOOGLE_DRIVE_MAX_RETRIES or (
+                status_code is not None and not throttle.should_retry('GET', status_code, reasons)
+            ):
+                raise
+            delay = throttle.retry_delay(attempt)
+            if status_code is not None:
+                throttle.slow_down(credentials, status_code, reasons, delay)
+            metrics.incr('resumed')
+            # Only the bytes still missing are asked for again
+            logger.warning(f"Range {offset}-{end} failed ({str(e)}), resuming in {delay:.2f}s")
+            time.sleep(delay)
+            attempt += 1
+
+
+def authorized_session(credentials, pool_size=10):
+    session = AuthorizedSession(credentials)
+    adapter = requests.adapters.HTTPAdapter(pool_maxsize=pool_size)
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    return session
+
+
+class RangedDownload:
+    """Fetch one Drive file as concurrent HTTP Range requests.
+
+    The file is split into ``part_size`` ranges that ``workers`` threads fetch
+    into a preallocated, memory-mapped temp file, so neither the parts nor
+    the file are held in memory. A range that fails part-way is resumed from
+    the first byte it is missing, up to GOOGLE_DRIVE_MAX_RETRIES times.
+
+    Iterating yields the file in order: the bytes of each range as soon as
+    they are written, once every range before it is complete, while later
+    ones are still being fetched. The first bytes therefore arrive as soon
+    as in a sequential download. With ``offset`` only the ``size`` bytes
+    from there on are fetched.
+    """
+
+    def __init__(self, credentials, uri, size, part_size=None, workers=None, chunk_size=None, offset=0):
+        self.credentials = credentials
+        self.uri = uri
+        self.size = int(size)
+        self.offset = offset
+        self.part_size = part_size or settings.GOOGLE_DRIVE_PARALLEL_DOWNLOAD_PART_SIZE
+        self.workers = workers or settings.GOOGLE_DRIVE_PARALLEL_DOWNLOAD_WORKERS
+        self.chunk_size = chunk_size or settings.GOOGLE_DRIVE_DOWNLOAD_CHUNK_SIZE
+        self._closed = threading.Event()
+        self._file = None
+        self._map = None
+        self._session = None
+        self._executor = None
+        self._parts = []
+        # How far each part (by start) has been written, guarded by _written_changed
+        self._written = {}
+        self._written_changed = threading.Condition()
+
+    def start(self):
+        self._file = tempfile.TemporaryFile(prefix='drive-ranged-')
+        self._file.truncate(self.size)
+        self._map = mmap.mmap(self._file.fileno(), self.size)
+        self._session = authorized_session(self.credentials, pool_size=self.workers)
+        self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='drive-range')
+        # Parts are positions in the map; Drive is asked for them shifted by offset
+        for start in range(0, self.size, self.part_size):
+            end = min(start + self.part_size, self.size) - 1
+            future = self._executor.submit(self._fetch, start, end)
+            future.add_done_callback(self._part_done)
+            self._parts.append((start, end, future))
+        metrics.incr('downloads')
+        metrics.incr('parts', len(self._parts))
+        return self
+
+    def __iter__(self):
+        if self._executor is None:
+            self.start()
+        try:
+            for start, end, future in self._parts:
+                offset = start
+                while offset <= end:
+                    with self._written_changed:
+                        self._written_changed.wait_for(lambda: self._written.get(start, start) > offset or future.done())
+                        written = self._written.get(start, start)
+                    if written <= offset:
+                        # The part failed, or the download was closed
+                        future.result()
+                        return
+                    while offset < written:
+                        stop = min(offset + self.chunk_size, written)
+                        yield self._map[offset:stop]
+                        offset = stop
+        finally:
+            self.close()
+
+    def close(self):
+        self._closed.set()
+        if self._executor is not None:
+            self._executor.shutdown(wait=True, cancel_futures=True)
+        if self._session is not None:
+            self._session.close()
+        if self._map is not None:
+            self._map.close()
+        if self._file is not None:
+            self._file.close()
+
+    def _fetch(self, start, end):
+        if self._closed.is_set():
+            return
+        position = start
+        chunks = iter_range(self._session, self.credentials, self.uri, self.offset + start, self.offset + end, self.chunk_size)
+        with closing(chunks):
+            for chunk in chunks:
+                if self._closed.is_set():
+                    return
+                self._map[position:position + len(chunk)] = chunk
+                position += len(chunk)
+                with self._written_changed:
+                    self._written[start] = position
+                    self._written_changed.notify_all()
+
+    def _part_done(self, future):
+        # Wakes the reader when a part failed too
+        with self._written_changed:
+            self._written_changed.notify_all()
@@ -0,0 +1,116 @@
+import re
+
+from django.contrib.postgres.search import SearchQuery, SearchRank
+from django.db.models import Count, FloatField, Q
+from django.db.models.functions import Cast
+
+from .models import DriveFile, name_search_vector
+from .pagination import KeysetPaginator
+
+MB = 1024 * 1024
+
+# (key, min bytes inclusive, max bytes exclusive) of the size facet
+SIZE_BUCKETS = [
+    ('under_1mb', None, MB),
+    ('1mb_10mb', MB, 10 * MB),
+    ('10mb_100mb', 10 * MB, 100 * MB),
+    ('100mb_1gb', 100 * MB, 1024 * MB),
+    ('over_1gb', 1024 * MB, None),
+]
+
+MIME_TYPE_FACET_SIZE = 20
+
+# Name searches list the best matches first; an order no index can produce
+# also keeps Postgres on the GIN index rather than walking a user's files by
+# date. Filter-only searches list newest first, like the mirror listing.
+RANK_PAGINATOR = KeysetPaginator(field='rank', output_field=FloatField())
+RECENT_PAGINATOR = KeysetPaginator(field='created_at')
+
+_word_re = re.compile(r'[^\W_]+')
+
+
+def name_query(text):
+    """Prefix tsquery matching names that contain every word of ``text``.
+
+    Returns None when ``text`` has no words to search for.
+    """
+    words = _word_re.findall(text.lower())
+    if not words:
+        return None
+    return SearchQuery(' & '.join(f'{word}:*' for word in words), config='simple', search_type='raw')
+
+
+def _size_filter(size_min=None, size_max=None):
+    condition = Q()
+    if size_min is not None:
+        condition &= Q(size__gte=size_min)
+    if size_max is not None:
+        condition &= Q(size__lt=size_max)
+    return condition
+
+
+class FileSearch:
+    """Search over a user's mirrored DriveFiles.
+
+    Names are matched word by word on prefixes (``rep 23`` finds
+    ``Report_2023.pdf``) through the ``drive_file_name_search`` GIN index and
+    ranked by relevance; results can be narrowed by MIME types and a size
+    range. Facet counts for each dimension ignore that dimension's own
+    filter, so they show what selecting another value would return.
+    """
+
+    def __init__(self, user, q='', mime_types=None, size_min=None, size_max=None):
+        self.base = DriveFile.objects.filter(user=user)
+        self.matches = True
+        self.rank = None
+        if q:
+            query = name_query(q)
+            if query is None:
+                self.matches = False
+            else:
+                vector = name_search_vector()
+                self.base = self.base.alias(name_vector=vector).filter(name_vector=query)
+                # ts_rank() returns a real; as a double it round-trips through
+                # the cursor exactly, so pages neither repeat nor skip rows
+                self.rank = Cast(SearchRank(vector, query), FloatField())
+        self.mime_filter = Q(mime_type__in=mime_types) if mime_types else Q()
+        self.size_filter = _size_filter(size_min, size_max)
+
+    @property
+    def paginator(self):
+        return RANK_PAGINATOR if self.rank is not None else RECENT_PAGINATOR
+
+    def results(self):
+        """Matching files, to be paginated with ``self.paginator``."""
+        if not self.matches:
+            return DriveFile.objects.none()
+        results = self.base.filter(self.mime_filter, self.size_filter)
+        if self.rank is not None:
+            results = results.annotate(rank=self.rank)
+        return results
+
+    def facets(self):
+        if not self.matches:
+            return {'mime_type': [], 'size': [dict(self._bucket(key, low, high), count=0) for key, low, high in SIZE_BUCKETS]}
+
+        mime_counts = (
+            self.base.filter(self.size_filter)
+            .values('mime_type')
+            .annotate(count=Count('id'))
+            .order_by('-count', 'mime_type')[:MIME_TYPE_FACET_SIZE]
+        )
+        size_counts = self.base.filter(self.mime_filter).aggregate(**{
+            key: Count('id', filter=_size_filter(low, high))
+            for key, low, high in SIZE_BUCKETS
+        })
+        return {
+            'mime_type': list(mime_counts),
+            'size': [
+                dict(self._bucket(key, low, high), count=size_counts[key])
+                for key, low, high in SIZE_BUCKETS
+            ],
+        }
+
+    @staticmethod
+    def _bucket(key, low, high):
+        return {'key': key, 'size_min': low, 'size_max': high}
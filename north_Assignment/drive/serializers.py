@@ -4,9 +4,39 @@ from .models import DriveFile
 class DriveFileSerializer(serializers.ModelSerializer):
     class Meta:
         model = DriveFile
-        fields = ('id', 'file_id', 'name', 'mime_type', 'size', 'created_at', 'updated_at')
+        fields = ('id', 'file_id', 'name', 'mime_type', 'size', 'md5_checksum', 'parent_id', 'created_at', 'updated_at')
         read_only_fields = ('id', 'created_at', 'updated_at')
 
 class FileUploadSerializer(serializers.Serializer):
     file = serializers.FileField()
-    folder_id = serializers.CharField(required=False, allow_blank=True) 
\ No newline at end of file
+    folder_id = serializers.CharField(required=False, allow_blank=True)
+
+class FileImportSerializer(serializers.Serializer):
+    file_ids = serializers.ListField(
+        child=serializers.CharField(max_length=255),
+        allow_empty=False,
+        max_length=1000
+    )
+
+class ArchiveSerializer(serializers.Serializer):
+    ids = serializers.ListField(
+        child=serializers.IntegerField(),
+        required=False,
+        allow_empty=False,
+        max_length=1000
+    )
+    folder_id = serializers.RegexField(r'^[\w-]+$', max_length=255, required=False)
+    
+    def validate(self, data):
+        if bool(data.get('ids')) == bool(data.get('folder_id')):
+            raise serializers.ValidationError('Provide either ids or folder_id.')
+        return data
+
+class FileSearchSerializer(serializers.Serializer):
+    q = serializers.CharField(required=False, allow_blank=True, max_length=255)
+    mime_type = serializers.ListField(
+        child=serializers.CharField(max_length=100),
+        required=False
+    )
+    size_min = serializers.IntegerField(required=False, min_value=0)
+    size_max = serializers.IntegerField(required=False, min_value=0)
@@ -0,0 +1,256 @@
+import json
+import logging
+import threading
+import time
+from collections import OrderedDict, namedtuple
+from datetime import timezone as dt_timezone
+
+import google_auth_httplib2
+from django.conf import settings
+from google.oauth2.credentials import Credentials
+from googleapiclient.discovery import build_from_document
+from googleapiclient.discovery_cache import get_static_doc
+from googleapiclient.errors import HttpError
+from googleapiclient.http import HttpRequest, build_http
+
+from . import throttle
+from .metrics import get_metrics
+
+logger = logging.getLogger(__name__)
+
+TOKEN_URI = 'https://oauth2.googleapis.com/token'
+DRIVE_API_ROOT = 'https://www.googleapis.com/'
+
+_discovery_document = None
+_discovery_lock = threading.Lock()
+_thread_local = threading.local()
+_in_flight = throttle.SingleFlight()
+
+request_metrics = get_metrics('drive_requests')
+
+
+def get_discovery_document():
+    """Load and parse the Drive v3 discovery document once per process.
+
+    Uses GOOGLE_DRIVE_DISCOVERY_DOCUMENT when set, otherwise the copy bundled
+    with google-api-python-client, so building a service never hits the network.
+    """
+    global _discovery_document
+    if _discovery_document is None:
+        with _discovery_lock:
+            if _discovery_document is None:
+                path = settings.GOOGLE_DRIVE_DISCOVERY_DOCUMENT
+                if path:
+                    with open(path, encoding='utf-8') as f:
+                        content = f.read()
+                else:
+                    content = get_static_doc('drive', 'v3')
+                _discovery_document = json.loads(content)
+                logger.debug(f"Loaded Drive discovery document ({'file' if path else 'bundled'})")
+    return _discovery_document
+
+
+def drive_api_root():
+    """Root URL the Drive API is called at, with a trailing slash.
+
+    GOOGLE_DRIVE_API_ROOT points every Drive call (including uploads, batch
+    requests and token refreshes) at another server, e.g. fake_drive_server.
+    """
+    root = settings.GOOGLE_DRIVE_API_ROOT or DRIVE_API_ROOT
+    return root if root.endswith('/') else root + '/'
+
+
+def token_uri():
+    if settings.GOOGLE_DRIVE_API_ROOT:
+        return drive_api_root() + 'token'
+    return TOKEN_URI
+
+
+def service_document():
+    """The discovery document with its URLs pointed at drive_api_root()."""
+    document = get_discovery_document()
+    root = drive_api_root()
+    if root == document['rootUrl']:
+        return document
+    return dict(
+        document,
+        rootUrl=root,
+        mtlsRootUrl=root,
+        baseUrl=root + document['servicePath'],
+    )
+
+
+def _thread_http():
+    """Return an httplib2.Http for the current thread; they are not thread-safe."""
+    http = getattr(_thread_local, 'http', None)
+    if http is None:
+        http = _thread_local.http = build_http()
+    return http
+
+
+class ThreadLocalHttp:
+    """Authorized http that uses the calling thread's connection on every call.
+
+    A request built on one thread can then be executed (or, for media
+    downloads, continued chunk by chunk) on any other thread.
+    """
+
+    def __init__(self, credentials):
+        self.credentials = credentials
+
+    def request(self, *args, **kwargs):
+        authorized_http = google_auth_httplib2.AuthorizedHttp(self.credentials, http=_thread_http())
+        return authorized_http.request(*args, **kwargs)
+
+
+class DriveHttpRequest(HttpRequest):
+    """HttpRequest whose ``execute()`` is throttled, retried and coalesced.
+
+    Every attempt waits for the process-wide and the user's token bucket.
+    429s, Drive's 403 quota errors and 5xx responses are retried up to
+    GOOGLE_DRIVE_MAX_RETRIES times with jittered exponential backoff. A
+    metadata GET identical to one the same user already has in flight waits
+    for that call's result instead of going out again. Media downloads and
+    uploads do not go through ``execute()`` and are not affected.
+    """
+
+    def execute(self, http=None, num_retries=0):
+        credentials = self.http.credentials
+        if self.method == 'GET' and not self.resumable and 'alt=media' not in self.uri:
+            key = (id(credentials), self.uri)
+            result, shared = _in_flight.do(key, lambda: self._execute_with_retries(credentials, http))
+            if shared:
+                request_metrics.incr('coalesced')
+            return result
+        return self._execute_with_retries(credentials, http)
+
+    def _execute_with_retries(self, credentials, http):
+        method = self.method
+        attempt = 0
+        while True:
+            throttle.acquire(credentials)
+            request_metrics.incr('requests')
+            try:
+                return super().execute(http=http)
+            except HttpError as e:
+                status = e.resp.status
+                reasons = throttle.error_reasons(e.content)
+                if attempt >= settings.GOOGLE_DRIVE_MAX_RETRIES or not throttle.should_retry(method, status, reasons):
+                    raise
+                delay = throttle.retry_delay(attempt, e.resp.get('retry-after'))
+                throttle.slow_down(credentials, status, reasons, delay)
+                request_metrics.incr('retries')
+                logger.warning(f"Drive {method} returned {status}, retrying in {delay:.2f}s")
+                time.sleep(delay)
+                attempt += 1
+
+
+def build_request(http, *args, **kwargs):
+    """requestBuilder that lets one pooled service be used from many threads."""
+    return DriveHttpRequest(ThreadLocalHttp(http.credentials), *args, **kwargs)
+
+
+def build_credentials(profile):
+    expiry = profile.token_expiry
+    if expiry is not None and expiry.tzinfo is not None:
+        # google-auth compares expiry against naive UTC datetimes
+        expiry = expiry.astimezone(dt_timezone.utc).replace(tzinfo=None)
+    return Credentials(
+        token=profile.google_token,
+        refresh_token=profile.refresh_token,
+        token_uri=token_uri(),
+        client_id=settings.SOCIAL_AUTH_GOOGLE_OAUTH2_KEY,
+        client_secret=settings.SOCIAL_AUTH_GOOGLE_OAUTH2_SECRET,
+        scopes=settings.SOCIAL_AUTH_GOOGLE_OAUTH2_SCOPE,
+        expiry=expiry,
+    )
+
+
+PooledService = namedtuple('PooledService', ['token', 'credentials', 'service'])
+
+
+class DriveServicePool:
+    """Process-wide LRU of Drive services keyed by user.
+
+    An entry is dropped when the user's stored token changes or when its
+    credentials have expired and cannot be refreshed.
+    """
+
+    def __init__(self, max_size=None):
+        self._max_size = max_size
+        self._services = OrderedDict()
+        self._lock = threading.Lock()
+        self.metrics = get_metrics('service_pool')
+
+    @property
+    def max_size(self):
+        if self._max_size is not None:
+            return self._max_size
+        return settings.GOOGLE_DRIVE_SERVICE_POOL_SIZE
+
+    def get(self, user):
+        """Return a Drive service for ``user``, or None if Drive is not connected."""
+        entry = self._entry(user)
+        return entry.service if entry else None
+
+    def get_credentials(self, user):
+        """Return the pooled credentials for ``user``, or None if Drive is not connected."""
+        entry = self._entry(user)
+        return entry.credentials if entry else None
+
+    def _entry(self, user):
+        profile = user.profile
+        token = profile.google_token
+        if not token:
+            return None
+
+        with self._lock:
+            entry = self._services.get(user.pk)
+            if entry is not None:
+                if entry.token == token and not self._is_stale(entry):
+                    self._services.move_to_end(user.pk)
+                    self.metrics.incr('hits')
+                    return entry
+                del self._services[user.pk]
+                self.metrics.incr('evictions')
+
+        self.metrics.incr('misses')
+        credentials = build_credentials(profile)
+        service = build_from_document(
+            service_document(),
+            credentials=credentials,
+            requestBuilder=build_request,
+        )
+
+        entry = PooledService(token, credentials, service)
+        with self._lock:
+            self._services[user.pk] = entry
+            self._services.move_to_end(user.pk)
+            while len(self._services) > self.max_size:
+                self._services.popitem(last=False)
+                self.metrics.incr('evictions')
+        return entry
+
+    def discard(self, user):
+        with self._lock:
+            if self._services.pop(user.pk, None) is not None:
+                self.metrics.incr('evictions')
+
+    def clear(self):
+        with self._lock:
+            self._services.clear()
+
+    def stats(self):
+        with self._lock:
+            size = len(self._services)
+        data = self.metrics.snapshot()
+        data.update({'size': size, 'max_size': self.max_size})
+        return data
+
+    @staticmethod
+    def _is_stale(entry):
+        credentials = entry.credentials
+        return credentials.expired and not credentials.refresh_token
+
+
+service_pool = DriveServicePool()
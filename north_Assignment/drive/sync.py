@@ -0,0 +1,296 @@
+import logging
+import time
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.utils import timezone
+from googleapiclient.errors import HttpError
+
+from . import throttle
+from .hierarchy import update_paths
+from .models import DriveFile, DriveSyncState
+from .services import request_metrics
+
+logger = logging.getLogger(__name__)
+
+# Columns refreshed when a mirrored file already exists
+UPSERT_FIELDS = ['name', 'mime_type', 'size', 'md5_checksum', 'updated_at']
+UPSERT_OPTIONS = {
+    'update_conflicts': True,
+    'unique_fields': ['user', 'file_id'],
+    'update_fields': UPSERT_FIELDS,
+}
+# For resources fetched with their parents, which also place them in the hierarchy
+PLACED_UPSERT_OPTIONS = dict(UPSERT_OPTIONS, update_fields=UPSERT_FIELDS + ['parent_id'])
+
+FILE_FIELDS = 'id, name, mimeType, size, md5Checksum, parents'
+LIST_FIELDS = f'nextPageToken, files({FILE_FIELDS})'
+CHANGE_FIELDS = f'nextPageToken, newStartPageToken, changes(changeType, removed, fileId, file({FILE_FIELDS}, trashed))'
+
+SYNC_PAGE_SIZE = 1000
+
+# Drive accepts at most 100 calls per HTTP batch request
+BATCH_SIZE = 100
+
+# Statuses Drive answers with when a saved page token can no longer be used
+INVALID_CURSOR_STATUSES = (400, 404, 410)
+
+
+def drive_file_from_item(user, item):
+    """Build an unsaved DriveFile from a Drive API file resource."""
+    parents = item.get('parents') or []
+    return DriveFile(
+        user=user,
+        file_id=item['id'],
+        name=item.get('name', 'Unnamed'),
+        mime_type=item.get('mimeType', 'unknown'),
+        size=item.get('size'),
+        md5_checksum=item.get('md5Checksum', ''),
+        parent_id=parents[0] if parents else '',
+    )
+
+
+def _upsert_batches(user, items):
+    """Split a page into ``(drive_files, options)`` upserts.
+
+    Only resources fetched with ``parents`` may overwrite a file's parent; a
+    listing without them must leave the hierarchy alone.
+    """
+    # A single INSERT ... ON CONFLICT may not touch the same row twice
+    by_id = {item['id']: item for item in items}
+    placed = [drive_file_from_item(user, item) for item in by_id.values() if 'parents' in item]
+    unplaced = [drive_file_from_item(user, item) for item in by_id.values() if 'parents' not in item]
+    return [
+        (drive_files, options)
+        for drive_files, options in ((placed, PLACED_UPSERT_OPTIONS), (unplaced, UPSERT_OPTIONS))
+        if drive_files
+    ]
+
+
+def upsert_drive_files(user, items):
+    """Insert or update a page of Drive files for ``user`` in one statement.
+
+    Relies on the unique (user, file_id) constraint, so concurrent syncs of the
+    same page cannot create duplicates. Files fetched with their parents are
+    then placed in the folder hierarchy (see hierarchy.update_paths()).
+    """
+    saved = []
+    for drive_files, options in _upsert_batches(user, items):
+        saved += DriveFile.objects.bulk_create(drive_files, **options)
+        if options is PLACED_UPSERT_OPTIONS:
+            update_paths(user, [drive_file.file_id for drive_file in drive_files])
+    return saved
+
+
+async def aupsert_drive_files(user, items):
+    """Async version of upsert_drive_files()."""
+    saved = []
+    for drive_files, options in _upsert_batches(user, items):
+        saved += await DriveFile.objects.abulk_create(drive_files, **options)
+        if options is PLACED_UPSERT_OPTIONS:
+            await sync_to_async(update_paths)(user, [drive_file.file_id for drive_file in drive_files])
+    return saved
+
+
+def fetch_files_metadata(drive_service, file_ids, fields=FILE_FIELDS):
+    """Fetch metadata for many files with Drive HTTP batch requests.
+
+    Returns ``(files, errors)``: file resources and error messages, both
+    keyed by the requested id. A batch does not go through DriveHttpRequest,
+    so it takes one token per call from the rate limits itself, and calls
+    refused for quota (or failing with a 5xx) are sent again in a later
+    batch after the usual backoff.
+    """
+    files = {}
+    errors = {}
+    retryable = {}
+
+    def callback(request_id, response, exception):
+        if exception is None:
+            files[request_id] = response
+            return
+        message = getattr(exception, 'reason', None) or str(exception)
+        if isinstance(exception, HttpError):
+            status = exception.resp.status
+            reasons = throttle.error_reasons(exception.content)
+            if throttle.should_retry('GET', status, reasons):
+                retryable[request_id] = (status, reasons, message)
+                return
+        errors[request_id] = message
+
+    pending = list(dict.fromkeys(file_ids))
+    attempt = 0
+    while pending:
+        for start in range(0, len(pending), BATCH_SIZE):
+            batch_ids = pending[start:start + BATCH_SIZE]
+            batch = drive_service.new_batch_http_request(callback=callback)
+            for file_id in batch_ids:
+                request = drive_service.files().get(fileId=file_id, fields=fields)
+                batch.add(request, request_id=file_id)
+            credentials = request.http.credentials
+            throttle.acquire(credentials, len(batch_ids))
+            request_metrics.incr('requests', len(batch_ids))
+            batch.execute()
+
+        if not retryable:
+            break
+        if attempt >= settings.GOOGLE_DRIVE_MAX_RETRIES:
+            errors.update((file_id, message) for file_id, (_, _, message) in retryable.items())
+            break
+        status, reasons, _ = next(iter(retryable.values()))
+        delay = throttle.retry_delay(attempt)
+        throttle.slow_down(credentials, status, reasons, delay)
+        request_metrics.incr('retries', len(retryable))
+        logger.warning(f"{len(retryable)} batched Drive calls returned {status}, retrying in {delay:.2f}s")
+        time.sleep(delay)
+        attempt += 1
+        pending = list(retryable)
+        retryable.clear()
+    return files, errors
+
+
+def remove_drive_files(user, file_ids):
+    if not file_ids:
+        return 0
+    deleted, _ = DriveFile.objects.filter(user=user, file_id__in=file_ids).delete()
+    return deleted
+
+
+def apply_changes(user, changes):
+    """Apply one page of Changes API entries to the mirror in bulk.
+
+    Returns ``(upserted, removed)`` counts.
+    """
+    upserts = []
+    removals = []
+    for change in changes:
+        if change.get('changeType', 'file') != 'file':
+            continue
+        file = change.get('file')
+        if change.get('removed') or not file or file.get('trashed'):
+            removals.append(change['fileId'])
+        else:
+            upserts.append(file)
+
+    upsert_drive_files(user, upserts)
+    remove_drive_files(user, removals)
+    return len(upserts), len(removals)
+
+
+def _execute(request, limiter=None):
+    if limiter is not None:
+        limiter.acquire()
+    return request.execute()
+
+
+def _start_full_sync(state, drive_service, limiter=None):
+    """Checkpoint the start of a new full sync, replacing any interrupted one."""
+    # Take the cursor first so changes made while listing are replayed later
+    start_page_token = _execute(drive_service.changes().getStartPageToken(), limiter)['startPageToken']
+    if not state.root_folder_id:
+        state.root_folder_id = _execute(drive_service.files().get(fileId='root', fields='id'), limiter)['id']
+    state.full_sync_started_at = timezone.now()
+    state.pending_start_page_token = start_page_token
+    state.pending_page_token = ''
+    state.save(update_fields=['full_sync_started_at', 'pending_start_page_token', 'pending_page_token', 'root_folder_id'])
+
+
+def full_sync(user, drive_service, limiter=None):
+    """Mirror every non-trashed file and reset the user's change cursor.
+
+    Rows that were not refreshed by this pass belong to files that are gone
+    and are deleted at the end. Progress is checkpointed after every page;
+    an interrupted full sync picks up from its last page on the next call,
+    or starts over if Drive no longer accepts that page's token.
+    """
+    state, _ = DriveSyncState.objects.get_or_create(user=user)
+    if state.full_sync_started_at and state.pending_start_page_token:
+        logger.debug(f"Resuming full Drive sync for {user}")
+        page_token = state.pending_page_token or None
+    else:
+        _start_full_sync(state, drive_service, limiter)
+        page_token = None
+    # A token saved by an earlier call may have expired since
+    resumed_token = page_token
+
+    upserted = 0
+    while True:
+        try:
+            results = _execute(drive_service.files().list(
+                pageSize=SYNC_PAGE_SIZE,
+                fields=LIST_FIELDS,
+                q='trashed=false',
+                pageToken=page_token
+            ), limiter)
+        except HttpError as e:
+            if resumed_token is None or e.resp.status not in INVALID_CURSOR_STATUSES:
+                raise
+            logger.warning(f"Saved full sync page token for {user} rejected ({e.resp.status}), starting over")
+            _start_full_sync(state, drive_service, limiter)
+            page_token = resumed_token = None
+            continue
+        resumed_token = None
+        items = results.get('files', [])
+        upsert_drive_files(user, items)
+        upserted += len(items)
+        page_token = results.get('nextPageToken')
+        if not page_token:
+            break
+        state.pending_page_token = page_token
+        state.save(update_fields=['pending_page_token'])
+
+    removed, _ = DriveFile.objects.filter(user=user, updated_at__lt=state.full_sync_started_at).delete()
+
+    now = timezone.now()
+    state.start_page_token = state.pending_start_page_token
+    state.full_sync_started_at = None
+    state.pending_start_page_token = ''
+    state.pending_page_token = ''
+    state.last_full_sync_at = now
+    state.last_synced_at = now
+    state.save()
+    logger.debug(f"Full Drive sync for {user}: {upserted} upserted, {removed} removed")
+    return {'mode': 'full', 'upserted': upserted, 'removed': removed}
+
+
+def incremental_sync(user, drive_service, limiter=None):
+    """Apply the changes since the user's saved cursor.
+
+    Falls back to :func:`full_sync` when there is no cursor yet, a full sync
+    was interrupted, or Drive rejects the cursor. The cursor is saved after
+    every page, so an interrupted sync resumes where it stopped.
+    """
+    state = DriveSyncState.objects.filter(user=user).first()
+    if state is None or not state.start_page_token or state.full_sync_started_at:
+        return full_sync(user, drive_service, limiter)
+
+    upserted = removed = 0
+    page_token = state.start_page_token
+    while True:
+        try:
+            response = _execute(drive_service.changes().list(
+                pageToken=page_token,
+                pageSize=SYNC_PAGE_SIZE,
+                fields=CHANGE_FIELDS,
+                includeRemoved=True,
+                spaces='drive'
+            ), limiter)
+        except HttpError as e:
+            if e.resp.status in INVALID_CURSOR_STATUSES:
+                logger.warning(f"Drive change cursor for {user} rejected ({e.resp.status}), running full sync")
+                return full_sync(user, drive_service, limiter)
+            raise
+
+        page_upserted, page_removed = apply_changes(user, response.get('changes', []))
+        upserted += page_upserted
+        removed += page_removed
+
+        page_token = response.get('nextPageToken')
+        state.start_page_token = page_token or response['newStartPageToken']
+        state.last_synced_at = timezone.now()
+        state.save(update_fields=['start_page_token', 'last_synced_at'])
+        if not page_token:
+            break
+
+    logger.debug(f"Incremental Drive sync for {user}: {upserted} upserted, {removed} removed")
+    return {'mode': 'incremental', 'upserted': upserted, 'removed': removed}
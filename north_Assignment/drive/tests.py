@@ -1,3 +1,492 @@
-from django.test import TestCase
+import datetime
+import json
+import threading
+from unittest import mock
 
-# Create your tests here.
+import httplib2
+from django.contrib.auth.models import User
+from django.test import RequestFactory, SimpleTestCase, TestCase, override_settings
+from django.utils import timezone
+from django.utils.http import http_date
+from googleapiclient.errors import HttpError
+
+from .archives import list_folder_tree, safe_name
+from .byteranges import RangeNotSatisfiable, parse_range_header, requested_ranges
+from .downloads import IncrementalStreamingHttpResponse
+from .hierarchy import FOLDER_MIME_TYPE, subtree
+from .models import DriveFile, DriveSyncState
+from .pagination import InvalidCursor, KeysetPaginator
+from .ranged import RangedDownload, RangedDownloadError
+from .sync import fetch_files_metadata, full_sync, incremental_sync, upsert_drive_files
+from .uploads import CHUNK_GRANULARITY, ResumableUpload, ResumableUploadError, find_duplicate
+
+
+class IncrementalStreamingHttpResponseTests(SimpleTestCase):
+    async def test_pulls_one_chunk_at_a_time_under_asgi(self):
+        pulled = []
+
+        def chunks():
+            for i in range(3):
+                pulled.append(i)
+                yield f'chunk-{i}'.encode()
+
+        response = IncrementalStreamingHttpResponse(chunks())
+        parts = aiter(response)
+        self.assertEqual(await anext(parts), b'chunk-0')
+        # A plain StreamingHttpResponse would have drained the iterator here
+        self.assertEqual(pulled, [0])
+        self.assertEqual([part async for part in parts], [b'chunk-1', b'chunk-2'])
+
+
+class FakeResponse:
+    def __init__(self, status_code, headers=None, json_data=None):
+        self.status_code = status_code
+        self.headers = headers or {}
+        self.text = ''
+        self._json = json_data
+
+    def json(self):
+        return self._json
+
+
+class FakeUploadSession:
+    """Answers resumable-upload PUTs from a list of responses, recording each Content-Range."""
+
+    credentials = None
+
+    def __init__(self, responses):
+        self.responses = list(responses)
+        self.ranges = []
+
+    def put(self, url, data, headers):
+        self.ranges.append(headers['Content-Range'])
+        return self.responses.pop(0)
+
+
+@override_settings(GOOGLE_DRIVE_RETRY_BASE_DELAY=0, GOOGLE_DRIVE_MAX_RETRIES=2)
+class ResumableUploadTests(SimpleTestCase):
+    def upload(self, responses):
+        upload = ResumableUpload(FakeUploadSession(responses), {'name': 'f'}, chunk_size=CHUNK_GRANULARITY)
+        upload.location = 'https://upload.example/session'
+        return upload
+
+    def test_failed_chunk_resumes_from_what_drive_kept(self):
+        kept = CHUNK_GRANULARITY // 2
+        upload = self.upload([
+            FakeResponse(503),
+            FakeResponse(308, {'Range': f'bytes=0-{kept - 1}'}),
+            FakeResponse(200, json_data={'id': 'new'}),
+        ])
+        upload.write(b'x' * (CHUNK_GRANULARITY + 10))
+        self.assertEqual(upload.finish(), {'id': 'new'})
+        self.assertEqual(upload.session.ranges, [
+            f'bytes 0-{CHUNK_GRANULARITY - 1}/*',
+            'bytes */*',
+            f'bytes {kept}-{CHUNK_GRANULARITY + 9}/{CHUNK_GRANULARITY + 10}',
+        ])
+
+    def test_drive_losing_acknowledged_bytes_is_an_error(self):
+        upload = self.upload([
+            FakeResponse(308, {'Range': f'bytes=0-{CHUNK_GRANULARITY - 1}'}),
+            FakeResponse(308),
+        ])
+        upload.write(b'x' * CHUNK_GRANULARITY)
+        with self.assertRaises(ResumableUploadError):
+            upload.finish()
+        self.assertEqual(upload.offset, CHUNK_GRANULARITY)
+
+    def test_gives_up_after_max_retries(self):
+        upload = self.upload([FakeResponse(500)] * 3)
+        with self.assertRaises(ResumableUploadError):
+            upload.write(b'x' * CHUNK_GRANULARITY)
+
+    def test_client_errors_are_not_retried(self):
+        upload = self.upload([FakeResponse(400)])
+        with self.assertRaises(ResumableUploadError):
+            upload.write(b'x' * CHUNK_GRANULARITY)
+        self.assertEqual(len(upload.session.ranges), 1)
+
+
+class KeysetPaginatorTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create(username='pager')
+        self.paginator = KeysetPaginator(field='created_at')
+        DriveFile.objects.bulk_create(
+            DriveFile(user=self.user, file_id=f'f{i}', name=f'file {i}', mime_type='text/plain')
+            for i in range(7)
+        )
+        # Pairs of files mirrored at the same instant, so ties are broken by id
+        base = timezone.now()
+        for i, drive_file in enumerate(DriveFile.objects.order_by('id')):
+            DriveFile.objects.filter(pk=drive_file.pk).update(created_at=base + datetime.timedelta(seconds=i // 2))
+
+    def pages(self, queryset, page_size=3):
+        pages, cursor = [], None
+        while True:
+            rows, cursor = self.paginator.paginate(queryset, cursor=cursor, page_size=page_size)
+            pages.append([row.file_id for row in rows])
+            if cursor is None:
+                return pages
+
+    def test_pages_cover_every_row_once_newest_first(self):
+        files = DriveFile.objects.filter(user=self.user)
+        expected = [f.file_id for f in files.order_by('-created_at', '-id')]
+        pages = self.pages(files)
+        self.assertEqual([len(page) for page in pages], [3, 3, 1])
+        self.assertEqual(sum(pages, []), expected)
+
+    def test_resyncing_listed_files_does_not_move_the_cursor(self):
+        files = DriveFile.objects.filter(user=self.user)
+        expected = [f.file_id for f in files.order_by('-created_at', '-id')]
+        first, cursor = self.paginator.paginate(files, page_size=3)
+        # What list() does before serving each page
+        upsert_drive_files(self.user, [{'id': f'f{i}', 'name': f'renamed {i}'} for i in range(7)])
+        rest, _ = self.paginator.paginate(files, cursor=cursor, page_size=10)
+        self.assertEqual([f.file_id for f in first + rest], expected)
+
+    def test_ascending_pages(self):
+        paginator = KeysetPaginator(field='name', descending=False)
+        rows, cursor = paginator.paginate(DriveFile.objects.filter(user=self.user), page_size=4)
+        rest, last = paginator.paginate(DriveFile.objects.filter(user=self.user), cursor=cursor, page_size=4)
+        self.assertEqual([f.name for f in rows + rest], [f'file {i}' for i in range(7)])
+        self.assertIsNone(last)
+
+    def test_invalid_cursors_are_rejected(self):
+        files = DriveFile.objects.filter(user=self.user)
+        for cursor in ['not a cursor', self.paginator.encode(None, 1), self.paginator.encode('2026-01-01T00:00:00', None), 'WzFd']:
+            with self.subTest(cursor=cursor), self.assertRaises(InvalidCursor):
+                self.paginator.paginate(files, cursor=cursor)
+
+
+class FakeRequest:
+    def __init__(self, result):
+        self.result = result
+
+    def execute(self):
+        if isinstance(self.result, Exception):
+            raise self.result
+        return self.result
+
+
+class FakeDriveService:
+    """Answers the calls of a full sync; ``pages`` maps a page token to ``(files, next token)``."""
+
+    def __init__(self, pages, start_page_token='fresh-start'):
+        self.pages = pages
+        self.start_page_token = start_page_token
+        self.listed = []
+
+    def changes(self):
+        return self
+
+    def files(self):
+        return self
+
+    def getStartPageToken(self):
+        return FakeRequest({'startPageToken': self.start_page_token})
+
+    def get(self, fileId, fields):
+        return FakeRequest({'id': 'my-drive'})
+
+    def list(self, pageToken=None, **kwargs):
+        self.listed.append(pageToken)
+        if pageToken not in self.pages:
+            return FakeRequest(HttpError(httplib2.Response({'status': 400}), b'{"error": {"message": "Invalid Value"}}'))
+        files, next_page_token = self.pages[pageToken]
+        return FakeRequest({'files': files, 'nextPageToken': next_page_token})
+
+
+def drive_item(file_id, parent='my-drive'):
+    return {'id': file_id, 'name': file_id, 'mimeType': 'text/plain', 'parents': [parent]}
+
+
+class FullSyncTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create(username='syncer')
+        self.started = timezone.now() - datetime.timedelta(minutes=5)
+        # A full sync that stopped after its first page
+        upsert_drive_files(self.user, [drive_item('listed')])
+        upsert_drive_files(self.user, [drive_item('gone')])
+        DriveFile.objects.filter(file_id='gone').update(updated_at=self.started - datetime.timedelta(hours=1))
+        self.state = DriveSyncState.objects.create(
+            user=self.user,
+            full_sync_started_at=self.started,
+            pending_start_page_token='interrupted-start',
+            pending_page_token='page-2',
+            root_folder_id='my-drive',
+        )
+
+    def test_resumes_from_the_checkpointed_page(self):
+        drive = FakeDriveService({'page-2': ([drive_item('second')], None)})
+        result = full_sync(self.user, drive)
+        self.assertEqual(drive.listed, ['page-2'])
+        self.assertEqual(result, {'mode': 'full', 'upserted': 1, 'removed': 1})
+        self.assertEqual(set(DriveFile.objects.values_list('file_id', flat=True)), {'listed', 'second'})
+        self.state.refresh_from_db()
+        self.assertEqual(self.state.start_page_token, 'interrupted-start')
+        self.assertIsNone(self.state.full_sync_started_at)
+        self.assertEqual(self.state.pending_page_token, '')
+
+    def test_starts_over_when_the_checkpointed_token_is_rejected(self):
+        drive = FakeDriveService({None: ([drive_item('listed'), drive_item('second')], None)})
+        # incremental_sync routes to the interrupted full sync
+        result = incremental_sync(self.user, drive)
+        self.assertEqual(drive.listed, ['page-2', None])
+        self.assertEqual(result['upserted'], 2)
+        self.assertEqual(set(DriveFile.objects.values_list('file_id', flat=True)), {'listed', 'second'})
+        self.state.refresh_from_db()
+        self.assertEqual(self.state.start_page_token, 'fresh-start')
+        self.assertIsNone(self.state.full_sync_started_at)
+        self.assertEqual(self.state.pending_start_page_token, '')
+
+    def test_errors_of_a_fresh_sync_are_raised(self):
+        DriveSyncState.objects.filter(pk=self.state.pk).update(full_sync_started_at=None)
+        drive = FakeDriveService({})
+        with self.assertRaises(HttpError):
+            full_sync(self.user, drive)
+        self.assertEqual(drive.listed, [None])
+
+
+class FakeBatch:
+    def __init__(self, drive, callback):
+        self.drive = drive
+        self.callback = callback
+        self.request_ids = []
+
+    def add(self, request, request_id):
+        self.request_ids.append(request_id)
+
+    def execute(self):
+        self.drive.batches.append(self.request_ids)
+        for request_id in self.request_ids:
+            outcome = self.drive.outcomes[request_id].pop(0)
+            if isinstance(outcome, Exception):
+                self.callback(request_id, None, outcome)
+            else:
+                self.callback(request_id, outcome, None)
+
+
+class FakeBatchDriveService:
+    """Answers batched files().get() calls with the next of each id's ``outcomes``."""
+
+    class http:
+        credentials = None
+
+    def __init__(self, outcomes):
+        self.outcomes = outcomes
+        self.batches = []
+
+    def new_batch_http_request(self, callback):
+        return FakeBatch(self, callback)
+
+    def files(self):
+        return self
+
+    def get(self, fileId, fields):
+        request = FakeRequest(None)
+        request.http = self.http
+        return request
+
+
+def drive_error(status, reason):
+    content = json.dumps({'error': {'errors': [{'reason': reason}], 'message': reason}}).encode()
+    return HttpError(httplib2.Response({'status': status}), content)
+
+
+@override_settings(GOOGLE_DRIVE_RETRY_BASE_DELAY=0, GOOGLE_DRIVE_RATE_LIMIT=0, GOOGLE_DRIVE_USER_RATE_LIMIT=0)
+class FetchFilesMetadataTests(SimpleTestCase):
+    def test_quota_errors_are_retried_and_others_reported(self):
+        drive = FakeBatchDriveService({
+            'a': [{'id': 'a'}],
+            'b': [drive_error(403, 'userRateLimitExceeded'), {'id': 'b'}],
+            'c': [drive_error(404, 'notFound')],
+        })
+        files, errors = fetch_files_metadata(drive, ['a', 'b', 'c', 'a'])
+        self.assertEqual(drive.batches, [['a', 'b', 'c'], ['b']])
+        self.assertEqual(set(files), {'a', 'b'})
+        self.assertEqual(set(errors), {'c'})
+
+    @override_settings(GOOGLE_DRIVE_MAX_RETRIES=1)
+    def test_gives_up_after_max_retries(self):
+        drive = FakeBatchDriveService({'a': [drive_error(429, 'rateLimitExceeded')] * 2})
+        files, errors = fetch_files_metadata(drive, ['a'])
+        self.assertEqual(len(drive.batches), 2)
+        self.assertEqual((files, set(errors)), ({}, {'a'}))
+
+
+class RangedDownloadTests(SimpleTestCase):
+    def setUp(self):
+        self.content = bytes(range(16))
+        self.release = threading.Event()
+        patcher = mock.patch('drive.ranged.authorized_session')
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        # Unblock workers even if a test fails
+        self.addCleanup(self.release.set)
+
+    def iter_range(self, session, credentials, uri, start, end, chunk_size=None):
+        """The first part sends half, then stalls until released."""
+        if start == 0:
+            yield self.content[0:4]
+            self.release.wait(5)
+            yield self.content[4:8]
+        else:
+            yield self.content[start:end + 1]
+
+    def test_first_bytes_are_yielded_before_the_first_part_completes(self):
+        with mock.patch('drive.ranged.iter_range', self.iter_range):
+            download = RangedDownload(None, 'uri', 16, part_size=8, workers=2, chunk_size=4)
+            chunks = iter(download)
+            self.assertEqual(next(chunks), self.content[0:4])
+            _, _, first_part = download._parts[0]
+            self.assertFalse(first_part.done())
+            self.release.set()
+            self.assertEqual(next(chunks) + b''.join(chunks), self.content[4:])
+
+    def test_failed_part_is_raised(self):
+        def failing(session, credentials, uri, start, end, chunk_size=None):
+            if start == 8:
+                raise RangedDownloadError(403, 'forbidden')
+            yield self.content[start:end + 1]
+
+        with mock.patch('drive.ranged.iter_range', failing):
+            chunks = iter(RangedDownload(None, 'uri', 16, part_size=8, workers=2, chunk_size=4))
+            self.assertEqual(next(chunks) + next(chunks), self.content[0:8])
+            with self.assertRaises(RangedDownloadError):
+                next(chunks)
+
+
+class ParseRangeHeaderTests(SimpleTestCase):
+    def test_ranges(self):
+        cases = [
+            ('bytes=0-99', [(0, 99)]),
+            ('bytes=100-', [(100, 999)]),
+            ('bytes=-100', [(900, 999)]),
+            ('bytes=-5000', [(0, 999)]),
+            ('bytes=900-5000', [(900, 999)]),
+            # Sorted, overlapping and adjacent ones merged
+            ('bytes=500-599, 0-9, 10-19, 550-650', [(0, 19), (500, 650)]),
+            # Ranges past the end are dropped if others remain
+            ('bytes=0-9, 2000-3000', [(0, 9)]),
+        ]
+        for header, expected in cases:
+            with self.subTest(header=header):
+                self.assertEqual(parse_range_header(header, 1000), expected)
+
+    def test_ignored_headers(self):
+        for header in ['', 'items=0-9', 'bytes=', 'bytes=a-b', 'bytes=9-0', 'bytes=-', 'bytes=' + ','.join(['0-0'] * 17)]:
+            with self.subTest(header=header):
+                self.assertIsNone(parse_range_header(header, 1000))
+
+    def test_unsatisfiable(self):
+        for header, size in [('bytes=1000-', 1000), ('bytes=-0', 1000), ('bytes=-10', 0)]:
+            with self.subTest(header=header), self.assertRaises(RangeNotSatisfiable):
+                parse_range_header(header, size)
+
+
+class RequestedRangesTests(SimpleTestCase):
+    etag = '"abc"'
+    last_modified = 1700000000
+
+    def ranges(self, size=1000, etag=etag, **headers):
+        request = RequestFactory().get('/', HTTP_RANGE='bytes=0-9', **headers)
+        return requested_ranges(request, size, etag, self.last_modified)
+
+    def test_without_if_range(self):
+        self.assertEqual(self.ranges(), [(0, 9)])
+        self.assertIsNone(self.ranges(size=None))
+        self.assertIsNone(requested_ranges(RequestFactory().get('/'), 1000, self.etag, self.last_modified))
+
+    def test_if_range_etag(self):
+        self.assertEqual(self.ranges(HTTP_IF_RANGE='"abc"'), [(0, 9)])
+        self.assertIsNone(self.ranges(HTTP_IF_RANGE='"old"'))
+        # Weak validators never allow a range
+        self.assertIsNone(self.ranges(HTTP_IF_RANGE='W/"abc"'))
+        self.assertIsNone(self.ranges(etag='W/"abc"', HTTP_IF_RANGE='W/"abc"'))
+
+    def test_if_range_date(self):
+        self.assertEqual(self.ranges(HTTP_IF_RANGE=http_date(self.last_modified)), [(0, 9)])
+        self.assertIsNone(self.ranges(HTTP_IF_RANGE=http_date(self.last_modified - 60)))
+
+
+class UpdatePathsTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create(username='tree')
+
+    def mirror(self, *items):
+        upsert_drive_files(self.user, [dict(item) for item in items])
+
+    def paths(self):
+        return dict(DriveFile.objects.filter(user=self.user).values_list('file_id', 'path'))
+
+    def folder(self, file_id, parent='root'):
+        return {'id': file_id, 'name': file_id, 'mimeType': FOLDER_MIME_TYPE, 'parents': [parent]}
+
+    def file(self, file_id, parent):
+        return {'id': file_id, 'name': file_id, 'mimeType': 'text/plain', 'parents': [parent]}
+
+    def test_paths_within_one_page(self):
+        self.mirror(self.file('doc', 'b'), self.folder('b', 'a'), self.folder('a'))
+        self.assertEqual(self.paths(), {'a': '/root/a/', 'b': '/root/a/b/', 'doc': '/root/a/b/doc/'})
+
+    def test_folder_arriving_later_adopts_its_subtree(self):
+        self.mirror(self.folder('b', 'a'), self.file('doc', 'b'))
+        self.assertEqual(self.paths()['doc'], '/a/b/doc/')
+        self.mirror(self.folder('a'))
+        self.assertEqual(self.paths(), {'a': '/root/a/', 'b': '/root/a/b/', 'doc': '/root/a/b/doc/'})
+        self.assertEqual({f.file_id for f in subtree(self.user, 'a')}, {'b', 'doc'})
+
+    def test_moved_folder_takes_its_subtree_along(self):
+        self.mirror(self.folder('a'), self.folder('x'), self.folder('b', 'a'), self.folder('c', 'b'), self.file('doc', 'c'))
+        # b moves under x, in the same page as c moving up into it
+        self.mirror(self.folder('b', 'x'), self.folder('c', 'x'))
+        self.assertEqual(self.paths(), {
+            'a': '/root/a/', 'x': '/root/x/', 'b': '/root/x/b/', 'c': '/root/x/c/', 'doc': '/root/x/c/doc/',
+        })
+        self.assertEqual(list(subtree(self.user, 'a')), [])
+
+    def test_listing_without_parents_keeps_the_hierarchy(self):
+        self.mirror(self.folder('a'), self.file('doc', 'a'))
+        upsert_drive_files(self.user, [{'id': 'doc', 'name': 'renamed'}])
+        self.assertEqual(self.paths()['doc'], '/root/a/doc/')
+
+
+class FindDuplicateTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create(username='dedup')
+        for file_id, name, parent_id in [('a', 'a.txt', 'nested'), ('b', 'b.txt', 'my-drive'), ('c', 'c.txt', 'other')]:
+            DriveFile.objects.create(
+                user=self.user, file_id=file_id, name=name, parent_id=parent_id, md5_checksum='0' * 32, size=3
+            )
+
+    def test_prefers_the_same_name_in_the_same_folder(self):
+        self.assertEqual(find_duplicate(self.user, '0' * 32, 3, 'my-drive', 'b.txt').file_id, 'b')
+        self.assertEqual(find_duplicate(self.user, '0' * 32, 3, 'nested', 'a.txt').file_id, 'a')
+
+    def test_otherwise_any_file_with_the_content(self):
+        # The view copies it into place under the uploaded name
+        self.assertEqual(find_duplicate(self.user, '0' * 32, 3, 'my-drive', 'new.txt').file_id, 'c')
+        self.assertIsNone(find_duplicate(self.user, '0' * 32, 4, 'my-drive', 'b.txt'))
+
+
+class SafeNameTests(SimpleTestCase):
+    def test_names_stay_one_segment(self):
+        cases = [
+            ('report.pdf', 'report.pdf'),
+            ('../../evil.txt', '.._.._evil.txt'),
+            ('/etc/evil', '_etc_evil'),
+            ('a\\b', 'a_b'),
+            ('..', '_'),
+            ('.', '_'),
+            ('', '_'),
+        ]
+        for name, expected in cases:
+            with self.subTest(name=name):
+                self.assertEqual(safe_name(name), expected)
+
+    def test_folder_names_in_tree(self):
+        folder = {'id': 'f', 'name': '../..', 'mimeType': FOLDER_MIME_TYPE}
+        doc = {'id': 'd', 'name': 'doc', 'mimeType': 'text/plain'}
+        service = mock.Mock()
+        service.files().list().execute.side_effect = [{'files': [folder]}, {'files': [doc]}]
+        self.assertEqual(list_folder_tree(service, 'root'), [('.._..', doc)])
@@ -0,0 +1,166 @@
+import asyncio
+import copy
+import json
+import logging
+import random
+import threading
+import weakref
+
+from django.conf import settings
+
+from .metrics import get_metrics
+from .ratelimit import TokenBucket
+
+logger = logging.getLogger(__name__)
+
+metrics = get_metrics('throttle')
+
+# Longest single backoff between retries, in seconds
+MAX_BACKOFF = 32.0
+
+# 403 reasons Drive uses for quota errors; they are retried like a 429
+RATE_LIMIT_REASONS = {'rateLimitExceeded', 'userRateLimitExceeded'}
+
+_global_bucket = None
+_buckets_lock = threading.Lock()
+# Per-user buckets live as long as the user's pooled credentials
+_user_buckets = weakref.WeakKeyDictionary()
+
+
+def global_bucket():
+    """Bucket shared by every Drive call in the process, or None if unlimited."""
+    global _global_bucket
+    rate = settings.GOOGLE_DRIVE_RATE_LIMIT
+    if not rate:
+        return None
+    with _buckets_lock:
+        if _global_bucket is None or _global_bucket.rate != rate:
+            _global_bucket = TokenBucket(rate)
+        return _global_bucket
+
+
+def user_bucket(credentials):
+    """Bucket for the user owning ``credentials``, or None if unlimited."""
+    rate = settings.GOOGLE_DRIVE_USER_RATE_LIMIT
+    if not rate:
+        return None
+    with _buckets_lock:
+        bucket = _user_buckets.get(credentials)
+        if bucket is None or bucket.rate != rate:
+            bucket = _user_buckets[credentials] = TokenBucket(rate)
+        return bucket
+
+
+def _buckets(credentials):
+    return [bucket for bucket in (global_bucket(), user_bucket(credentials)) if bucket is not None]
+
+
+def acquire(credentials, calls=1):
+    """Block until both the global and the user's bucket allow ``calls`` more calls."""
+    waited = 0.0
+    for bucket in _buckets(credentials):
+        # A bucket never holds more than its capacity at once
+        remaining = calls
+        while remaining > 0:
+            tokens = min(remaining, bucket.capacity)
+            waited += bucket.acquire(tokens)
+            remaining -= tokens
+    if waited:
+        metrics.incr('throttled')
+        metrics.observe('throttle_wait', waited)
+
+
+async def aacquire(credentials):
+    """acquire() for the event loop: waits with asyncio.sleep()."""
+    waited = 0.0
+    for bucket in _buckets(credentials):
+        while True:
+            delay = bucket.try_acquire()
+            if not delay:
+                break
+            await asyncio.sleep(delay)
+            waited += delay
+    if waited:
+        metrics.incr('throttled')
+        metrics.observe('throttle_wait', waited)
+
+
+def error_reasons(content):
+    """``reason`` of each error in a Drive JSON error body."""
+    try:
+        errors = json.loads(content)['error'].get('errors') or []
+        return {error.get('reason') for error in errors}
+    except (ValueError, KeyError, TypeError, AttributeError):
+        return set()
+
+
+def should_retry(method, status, reasons):
+    """Rate limits are always retried; 5xx too unless a POST might have gone through."""
+    if status == 429 or (status == 403 and reasons & RATE_LIMIT_REASONS):
+        return True
+    return status >= 500 and method != 'POST'
+
+
+def retry_delay(attempt, retry_after=None):
+    """Full-jitter exponential backoff, but never sooner than Retry-After."""
+    delay = random.uniform(0, min(MAX_BACKOFF, settings.GOOGLE_DRIVE_RETRY_BASE_DELAY * 2 ** attempt))
+    try:
+        return max(delay, min(MAX_BACKOFF, float(retry_after)))
+    except (TypeError, ValueError):
+        return delay
+
+
+def slow_down(credentials, status, reasons, delay):
+    """Hold back further calls after Drive pushed back on one.
+
+    Per-user quota errors pause only that user's bucket; anything else
+    (project quota, overloaded backend) pauses everyone.
+    """
+    if status != 429 and not reasons & RATE_LIMIT_REASONS:
+        return
+    bucket = user_bucket(credentials) if 'userRateLimitExceeded' in reasons else global_bucket()
+    if bucket is not None:
+        bucket.pause(delay)
+        metrics.incr('paused')
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """Collapse concurrent calls with the same key into one.
+
+    The first caller runs the function; callers arriving while it is still
+    running wait for it and get a copy of its result (or its exception).
+    """
+
+    def __init__(self):
+        self._calls = {}
+        self._lock = threading.Lock()
+
+    def do(self, key, fn):
+        """Return ``(result, shared)``; ``shared`` is True for callers that waited."""
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return copy.deepcopy(call.result), True
+        try:
+            call.result = fn()
+            return call.result, False
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
@@ -0,0 +1,370 @@
+import hashlib
+import logging
+import re
+import tempfile
+import time
+
+import requests
+from django.conf import settings
+from django.core.files.uploadedfile import UploadedFile
+from django.core.files.uploadhandler import FileUploadHandler, StopFutureHandlers
+from django.db.models import Case, Value, When
+from google.auth.transport.requests import AuthorizedSession
+from oauth2_provider.contrib.rest_framework import OAuth2Authentication
+from oauth2_provider.oauth2_backends import OAuthLibCore, get_oauthlib_core
+
+from . import throttle
+from .hierarchy import resolve_folder_id
+from .metrics import get_metrics
+from .models import DriveFile
+from .services import drive_api_root
+
+logger = logging.getLogger(__name__)
+
+metrics = get_metrics('uploads')
+
+UPLOAD_PATH = 'upload/drive/v3/files'
+UPLOAD_FIELDS = 'id,name,mimeType,size,md5Checksum,parents'
+
+# Drive requires every chunk except the last to be a multiple of 256 KiB
+CHUNK_GRANULARITY = 256 * 1024
+
+_range_re = re.compile(r'bytes=0-(\d+)')
+_md5_re = re.compile(r'^[0-9a-f]{32}$')
+
+
+class ResumableUploadError(Exception):
+    pass
+
+
+class UploadChecksumMismatch(Exception):
+    pass
+
+
+def parse_md5(value):
+    """Normalise a hex MD5 digest sent by a client; None if it is not one."""
+    value = (value or '').strip().lower()
+    return value if _md5_re.match(value) else None
+
+
+def find_duplicate(user, md5_checksum, size=None, folder_id=None, name=None):
+    """Mirrored file of ``user`` with this content, if any.
+
+    One already called ``name`` in ``folder_id`` comes first, then the most
+    recently mirrored one anywhere.
+    """
+    files = DriveFile.objects.filter(user=user, md5_checksum=md5_checksum)
+    if size is not None:
+        files = files.filter(size=size)
+    files = files.annotate(
+        in_place=Case(When(parent_id=folder_id, name=name, then=Value(0)), default=Value(1))
+    )
+    return files.order_by('in_place', '-updated_at', '-id').first()
+
+
+def still_in_drive(session, drive_file):
+    """Whether a mirrored file still exists in Drive, untrashed and unchanged."""
+    response = session.get(
+        drive_api_root() + f'drive/v3/files/{drive_file.file_id}',
+        params={'fields': 'md5Checksum,trashed'},
+    )
+    if response.status_code != 200:
+        return False
+    item = response.json()
+    return not item.get('trashed') and item.get('md5Checksum') == drive_file.md5_checksum
+
+
+class ResumableUpload:
+    """A Drive resumable-upload session fed incrementally with ``write()``.
+
+    At most one chunk is held in memory; full chunks are sent as soon as they
+    are buffered and the remainder is sent by ``finish()``. Failed chunks are
+    retried from the last byte Drive confirmed.
+    """
+
+    def __init__(self, session, metadata, content_type=None, chunk_size=None):
+        chunk_size = chunk_size or settings.GOOGLE_DRIVE_UPLOAD_CHUNK_SIZE
+        self.session = session
+        self.metadata = metadata
+        self.content_type = content_type or 'application/octet-stream'
+        self.chunk_size = max(CHUNK_GRANULARITY, chunk_size - chunk_size % CHUNK_GRANULARITY)
+        self.location = None
+        self.offset = 0
+        self.result = None
+        self._buffer = bytearray()
+
+    def start(self):
+        response = self.session.post(
+            drive_api_root() + UPLOAD_PATH,
+            params={'uploadType': 'resumable', 'fields': UPLOAD_FIELDS},
+            json=self.metadata,
+            headers={'X-Upload-Content-Type': self.content_type},
+        )
+        if response.status_code != 200:
+            raise ResumableUploadError(f'Could not start upload session: {response.status_code} {response.text}')
+        self.location = response.headers['Location']
+
+    def write(self, data):
+        self._buffer += data
+        while len(self._buffer) >= self.chunk_size:
+            self._send(final=False)
+
+    def finish(self):
+        while self.result is None:
+            self._send(final=True)
+        return self.result
+
+    def abort(self):
+        if self.location and self.result is None:
+            try:
+                self.session.delete(self.location)
+            except Exception as e:
+                logger.warning(f"Could not cancel upload session: {str(e)}")
+
+    def _send(self, final):
+        """Send the next chunk and advance ``offset`` to what Drive has persisted.
+
+        A chunk that fails with a retryable status (see throttle.should_retry)
+        or a connection error is not resent blindly: after a backoff Drive is
+        asked how much of it arrived, and the caller sends the rest.
+        """
+        total = str(self.offset + len(self._buffer)) if final else '*'
+        size = len(self._buffer) if final else self.chunk_size
+        attempt = 0
+        while True:
+            with memoryview(self._buffer) as view:
+                payload = bytes(view[:size])
+            if payload:
+                content_range = f'bytes {self.offset}-{self.offset + len(payload) - 1}/{total}'
+            else:
+                content_range = f'bytes */{total}'
+
+            response = None
+            status_code = None
+            reasons = set()
+            try:
+                response = self.session.put(
+                    self.location,
+                    data=payload,
+                    headers={'Content-Range': content_range},
+                )
+            except requests.RequestException as e:
+                error = str(e)
+            else:
+                if response.status_code in (200, 201, 308):
+                    break
+                status_code = response.status_code
+                reasons = throttle.error_reasons(response.text)
+                error = f'{status_code} {response.text}'
+                if not throttle.should_retry('PUT', status_code, reasons):
+                    raise ResumableUploadError(f'Upload chunk failed: {error}')
+            if attempt >= settings.GOOGLE_DRIVE_MAX_RETRIES:
+                raise ResumableUploadError(f'Upload chunk failed after {attempt} retries: {error}')
+            delay = throttle.retry_delay(attempt, response.headers.get('Retry-After') if response is not None else None)
+            if status_code is not None:
+                throttle.slow_down(self.session.credentials, status_code, reasons, delay)
+            metrics.incr('retries')
+            logger.warning(f"Upload chunk at {self.offset} failed ({error}), asking Drive for its status in {delay:.2f}s")
+            time.sleep(delay)
+            attempt += 1
+            # An empty PUT only asks how many bytes Drive has kept
+            size = 0
+
+        if response.status_code in (200, 201):
+            self.result = response.json()
+            committed = self.offset + len(self._buffer)
+        else:
+            # Drive reports how much it has persisted; resend anything it dropped
+            match = _range_re.match(response.headers.get('Range', ''))
+            committed = int(match.group(1)) + 1 if match else 0
+        # Bytes before offset were acknowledged earlier and are no longer buffered
+        if not self.offset <= committed <= self.offset + len(self._buffer):
+            raise ResumableUploadError(
+                f'Drive reports {committed} bytes received, expected {self.offset} to {self.offset + len(self._buffer)}'
+            )
+
+        del self._buffer[:committed - self.offset]
+        self.offset = committed
+
+
+class DriveUploadedFile(UploadedFile):
+    """Placeholder for a file whose bytes went straight to Drive.
+
+    ``drive_file`` is the new Drive resource, or None when the upload was
+    skipped because ``duplicate``, a mirrored DriveFile, has the same content.
+    """
+
+    def __init__(self, name, content_type, size, charset, drive_file, duplicate=None):
+        super().__init__(None, name, content_type, size, charset)
+        self.drive_file = drive_file
+        self.duplicate = duplicate
+
+    def chunks(self, chunk_size=None):
+        raise ValueError('The contents of this file were streamed to Google Drive')
+
+
+class DriveUploadHandler(FileUploadHandler):
+    """Upload handler that streams one form field into Drive as it is parsed.
+
+    Each chunk Django parses from the request body goes into the resumable
+    session instead of a temporary upload file; deduplication may also spool
+    it (see below). Other file fields are left to the handlers that follow.
+    Under ASGI (daphne) Django has already spooled the whole request body
+    to a temporary file before the view runs, so this saves the second copy
+    but not the first, and the upload to Drive only starts once the client
+    has sent everything.
+
+    The content is hashed on the way through, and GOOGLE_DRIVE_UPLOAD_DEDUP
+    decides whether an identical mirrored file is reused instead:
+
+    - ``hint``: when the client sends the expected ``md5_checksum`` and a
+      matching file is still in Drive, no session is opened; the body is
+      only hashed to check the claim.
+    - ``spool``: as ``hint``, and uploads without a checksum are spooled
+      locally until hashed, then sent only if they are not duplicates.
+    - ``off``: everything is uploaded.
+    """
+
+    def __init__(self, request, credentials, field_name='file', folder_id=None, md5_checksum=None, dedup=None):
+        super().__init__(request)
+        self.credentials = credentials
+        self.target_field = field_name
+        self.folder_id = folder_id
+        self.expected_md5 = md5_checksum
+        self.dedup = dedup or settings.GOOGLE_DRIVE_UPLOAD_DEDUP
+        self.session = None
+        self.upload = None
+        self.spool = None
+        self.duplicate = None
+        self.md5 = None
+        self.streaming = False
+        self.started = None
+
+    def new_file(self, field_name, file_name, content_type, content_length, charset=None, content_type_extra=None):
+        super().new_file(field_name, file_name, content_type, content_length, charset, content_type_extra)
+        # Only the first file in the target field goes to Drive
+        self.streaming = field_name == self.target_field and self.md5 is None
+        if not self.streaming:
+            return
+
+        self.started = time.monotonic()
+        self.md5 = hashlib.md5()
+        self.session = AuthorizedSession(self.credentials)
+        if self.dedup != 'off' and self.expected_md5:
+            self.duplicate = self._find_duplicate(self.expected_md5)
+        elif self.dedup == 'spool':
+            self.spool = tempfile.SpooledTemporaryFile(max_size=settings.FILE_UPLOAD_MAX_MEMORY_SIZE)
+        if self.duplicate is None and self.spool is None:
+            self._start_upload()
+        raise StopFutureHandlers()
+
+    def receive_data_chunk(self, raw_data, start):
+        if not self.streaming:
+            return raw_data
+        self.md5.update(raw_data)
+        if self.upload is not None:
+            self.upload.write(raw_data)
+        elif self.spool is not None:
+            self.spool.write(raw_data)
+        return None
+
+    def file_complete(self, file_size):
+        if not self.streaming:
+            return None
+        self.streaming = False
+        md5_checksum = self.md5.hexdigest()
+
+        if self.duplicate is not None:
+            if md5_checksum != self.duplicate.md5_checksum:
+                metrics.incr('checksum_mismatches')
+                raise UploadChecksumMismatch(
+                    f'Uploaded content has MD5 {md5_checksum}, not the {self.expected_md5} sent with it'
+                )
+            return self._deduplicated(file_size)
+
+        if self.spool is not None:
+            self.duplicate = self._find_duplicate(md5_checksum, file_size)
+            if self.duplicate is not None:
+                return self._deduplicated(file_size)
+            self._start_upload()
+            self.spool.seek(0)
+            for chunk in iter(lambda: self.spool.read(self.upload.chunk_size), b''):
+                self.upload.write(chunk)
+        drive_file = self.upload.finish()
+
+        if drive_file.get('md5Checksum', md5_checksum) != md5_checksum:
+            metrics.incr('checksum_mismatches')
+            logger.error(f"Drive stored {drive_file['id']} with MD5 {drive_file['md5Checksum']}, sent {md5_checksum}")
+
+        elapsed = max(time.monotonic() - self.started, 1e-6)
+        metrics.incr('uploads')
+        metrics.incr('bytes', file_size)
+        metrics.observe('duration', elapsed)
+        metrics.observe('throughput_bps', file_size / elapsed)
+        logger.debug(f"Streamed {file_size} bytes to Drive in {elapsed:.2f}s ({file_size / elapsed / 1e6:.2f} MB/s)")
+
+        return DriveUploadedFile(self.file_name, self.content_type, file_size, self.charset, drive_file)
+
+    def upload_interrupted(self):
+        if self.upload is not None:
+            self.upload.abort()
+        self._close_spool()
+
+    def upload_complete(self):
+        if self.upload is not None and self.upload.result is None:
+            self.upload.abort()
+        self._close_spool()
+
+    def _start_upload(self):
+        metadata = {'name': self.file_name}
+        if self.folder_id:
+            metadata['parents'] = [self.folder_id]
+        self.upload = ResumableUpload(self.session, metadata, self.content_type)
+        self.upload.start()
+
+    def _find_duplicate(self, md5_checksum, size=None):
+        folder_id = resolve_folder_id(self.request.user, self.folder_id or 'root')
+        duplicate = find_duplicate(self.request.user, md5_checksum, size, folder_id, self.file_name)
+        # The mirror may lag behind a delete or edit made elsewhere
+        if duplicate is not None and not still_in_drive(self.session, duplicate):
+            metrics.incr('dedup_stale')
+            return None
+        return duplicate
+
+    def _deduplicated(self, file_size):
+        metrics.incr('dedup_hits')
+        metrics.incr('bytes_avoided', file_size)
+        logger.debug(f"Skipped upload of {file_size} bytes, identical to {self.duplicate.file_id}")
+        return DriveUploadedFile(
+            self.file_name, self.content_type, file_size, self.charset, None, duplicate=self.duplicate
+        )
+
+    def _close_spool(self):
+        if self.spool is not None:
+            self.spool.close()
+            self.spool = None
+
+
+class HeaderOAuthLibCore(OAuthLibCore):
+    """OAuthLibCore that takes credentials from headers only."""
+
+    def extract_body(self, request):
+        return []
+
+
+class HeaderOnlyOAuth2Authentication(OAuth2Authentication):
+    """OAuth2Authentication that never reads the request body.
+
+    The configured JSONOAuthLibCore parses ``request.body``, which would
+    consume a streamed upload before the upload handler sees it.
+    """
+
+    def authenticate(self, request):
+        if request is None:
+            return None
+        oauthlib_core = HeaderOAuthLibCore(get_oauthlib_core().server)
+        valid, r = oauthlib_core.verify_request(request, scopes=[])
+        if valid:
+            return r.user, r.access_token
+        request.oauth2_error = getattr(r, 'oauth2_error', {})
+        return None
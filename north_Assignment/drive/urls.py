@@ -1,6 +1,7 @@
 from django.urls import path, include
 from rest_framework.routers import DefaultRouter
-from .views import GoogleDriveViewSet, GooglePickerView
+from . import async_views
+from .views import GoogleDriveViewSet, GooglePickerView, drive_notifications
 
 router = DefaultRouter()
 router.register(r'files', GoogleDriveViewSet, basename='drive-files')
@@ -8,4 +9,10 @@ router.register(r'files', GoogleDriveViewSet, basename='drive-files')
 urlpatterns = [
     path('', include(router.urls)),
     path('picker/', GooglePickerView.as_view(), name='google-picker'),
+    path('notifications/', drive_notifications, name='drive-notifications'),
+    path('async/files/', async_views.list_files, name='drive-async-list'),
+    path('async/files/metadata/', async_views.file_metadata, name='drive-async-metadata'),
+    path('async/files/import_files/', async_views.import_files, name='drive-async-import-files'),
+    path('async/files/direct_download/', async_views.direct_download, name='drive-async-direct-download'),
+    path('async/files/<int:pk>/download/', async_views.download, name='drive-async-download'),
 ] 
\ No newline at end of file
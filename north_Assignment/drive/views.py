@@ -1,27 +1,93 @@
 from rest_framework import status, viewsets
 from rest_framework.decorators import action
 from rest_framework.response import Response
-from rest_framework.permissions import IsAuthenticated
+from rest_framework.permissions import IsAdminUser, IsAuthenticated
 from rest_framework.views import APIView
-from rest_framework.parsers import MultiPartParser, FormParser
-from django.http import FileResponse
+from rest_framework.parsers import JSONParser, MultiPartParser, FormParser
+from rest_framework.authentication import TokenAuthentication
+from rest_framework_social_oauth2.authentication import SocialAuthentication
 from django.conf import settings
-from google.oauth2.credentials import Credentials
-from googleapiclient.discovery import build
-from googleapiclient.http import MediaFileUpload, MediaIoBaseDownload
-from .serializers import DriveFileSerializer, FileUploadSerializer
+from django.http import HttpResponse
+from django.utils.cache import get_conditional_response
+from django.utils.http import content_disposition_header
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_POST
+from googleapiclient.errors import HttpError
+from .serializers import (
+    ArchiveSerializer,
+    DriveFileSerializer,
+    FileImportSerializer,
+    FileSearchSerializer,
+    FileUploadSerializer,
+)
 from .models import DriveFile
-import io
+from . import throttle
+from .metrics import snapshot_all
+from .services import service_pool
+from .downloads import IncrementalStreamingHttpResponse, iter_file, iter_media, range_response, streaming_response
+from .archives import ArchiveTooLarge, iter_zip, list_folder_tree, safe_name
+from .byteranges import (
+    DriveRanges,
+    FileRanges,
+    RangeNotSatisfiable,
+    download_validators,
+    requested_ranges,
+    set_validators,
+)
+from .cache import content_cache
+from .exports import (
+    UnsupportedExportFormat,
+    download_cache,
+    export_filename,
+    rendition_cache,
+    resolve_export_format,
+)
+from .sync import FILE_FIELDS, fetch_files_metadata, incremental_sync, upsert_drive_files
+from .pagination import InvalidCursor, KeysetPaginator
+from .search import FileSearch
+from .hierarchy import (
+    CHILDREN_PAGINATOR,
+    SUBTREE_PAGINATOR,
+    ancestors,
+    children,
+    resolve_folder_id,
+    subtree,
+    subtree_totals,
+)
+from .uploads import DriveUploadHandler, HeaderOnlyOAuth2Authentication, UploadChecksumMismatch, parse_md5
+from .notifications import (
+    accept_message,
+    authenticate_notification,
+    debouncer,
+    ensure_watch,
+    stop_watching,
+)
+from .notifications import metrics as notification_metrics
 import logging
-import tempfile
 import os
+import posixpath
+import time
 from django.views.generic import TemplateView
 
 logger = logging.getLogger(__name__)
 
+# Metadata needed to name a download and revalidate its cached copy
+DOWNLOAD_METADATA_FIELDS = 'name,mimeType,size,md5Checksum,modifiedTime,headRevisionId'
+
+
+def drive_error_status(error):
+    """Status for an unexpected error; Drive still throttling or failing after retries is passed on."""
+    if isinstance(error, HttpError):
+        if error.resp.status == 429 or throttle.error_reasons(error.content) & throttle.RATE_LIMIT_REASONS:
+            return status.HTTP_429_TOO_MANY_REQUESTS
+        if error.resp.status >= 500:
+            return status.HTTP_502_BAD_GATEWAY
+    return status.HTTP_500_INTERNAL_SERVER_ERROR
+
 class GoogleDriveViewSet(viewsets.ViewSet):
     permission_classes = [IsAuthenticated]
     parser_classes = [MultiPartParser, FormParser]
+    paginator = KeysetPaginator(field='created_at')
     
     def get_permissions(self):
         logger.debug(f"Request method: {self.request.method}")
@@ -38,19 +104,98 @@ class GoogleDriveViewSet(viewsets.ViewSet):
             return None
             
         logger.debug(f"Using token: {profile.google_token[:10]}... for user: {user.email}")
-        credentials = Credentials(
-            token=profile.google_token,
-            refresh_token=profile.refresh_token,
-            token_uri='https://oauth2.googleapis.com/token',
-            client_id=settings.SOCIAL_AUTH_GOOGLE_OAUTH2_KEY,
-            client_secret=settings.SOCIAL_AUTH_GOOGLE_OAUTH2_SECRET,
-            scopes=settings.SOCIAL_AUTH_GOOGLE_OAUTH2_SCOPE
+        return service_pool.get(user)
+    
+    def _media_request(self, drive_service, file_id, mime_type, name, export_mime_type=None):
+        """Build the Drive media request for a file.
+        
+        Google Workspace files (Docs, Sheets, Slides, etc.) are exported, as
+        ``export_mime_type`` or their configured default format; everything
+        else is fetched as-is. Returns the request, the download filename and
+        the content type of the bytes it yields.
+        """
+        export_mime_type = export_mime_type or resolve_export_format(mime_type)
+        if export_mime_type:
+            media_request = drive_service.files().export_media(
+                fileId=file_id,
+                mimeType=export_mime_type
+            )
+            return media_request, export_filename(name, export_mime_type), export_mime_type
+        
+        media_request = drive_service.files().get_media(fileId=file_id)
+        return media_request, name, mime_type or None
+    
+    def _download_response(self, request, drive_service, file_id, file_metadata, started, export_format=None):
+        """Serve a file from the local caches, or stream it from Drive.
+        
+        Workspace exports are cached per revision (see download_cache()), so a
+        document is only converted again once it changes. ``file_metadata``
+        must therefore be fresh. A miss is relayed to the client and written to
+        the cache as it goes.
+        
+        Conditional requests are answered from the metadata alone (304/412),
+        and ``Range`` requests get the ranges asked for (206), read from the
+        cached copy or fetched from Drive with Range requests. Exports are only
+        ranged once cached, as Drive cannot range them.
+        """
+        mime_type = file_metadata.get('mimeType', '')
+        export_mime_type = resolve_export_format(mime_type, export_format)
+        etag, last_modified = download_validators(file_metadata, export_mime_type)
+        not_modified = get_conditional_response(request, etag=etag, last_modified=last_modified)
+        if not_modified is not None:
+            return set_validators(not_modified, etag, last_modified)
+        
+        media_request, filename, content_type = self._media_request(
+            drive_service,
+            file_id,
+            mime_type,
+            file_metadata.get('name', 'downloaded_file'),
+            export_mime_type
         )
         
-        return build('drive', 'v3', credentials=credentials)
+        cache, key, size = download_cache(file_id, file_metadata, export_mime_type)
+        cached = cache.open(*key) if key else None
+        if cached is not None:
+            size = os.fstat(cached.fileno()).st_size
+        
+        try:
+            ranges = requested_ranges(request, size, etag, last_modified)
+        except RangeNotSatisfiable as e:
+            if cached is not None:
+                cached.close()
+            response = HttpResponse(status=status.HTTP_416_REQUESTED_RANGE_NOT_SATISFIABLE)
+            response['Content-Range'] = str(e)
+            return set_validators(response, etag, last_modified)
+        
+        if ranges:
+            source = FileRanges(cached) if cached is not None else DriveRanges(media_request)
+            response = range_response(source, ranges, int(size), filename, content_type, started=started)
+        elif cached is not None:
+            # Not a FileResponse: daphne has no sendfile, and Django would
+            # read a synchronous file body into memory before sending it
+            response = IncrementalStreamingHttpResponse(
+                iter_file(cached),
+                content_type=content_type or 'application/octet-stream'
+            )
+            response['Content-Disposition'] = content_disposition_header(True, filename)
+            response['Content-Length'] = str(size)
+        else:
+            sink = cache.writer(*key, size=size) if key else None
+            # Relay the file to the client as Drive sends it
+            response = streaming_response(media_request, filename, content_type, size=size, started=started, sink=sink)
+        
+        response['Accept-Ranges'] = 'bytes' if size is not None else 'none'
+        return set_validators(response, etag, last_modified)
     
     def list(self, request):
-        """List files from Google Drive."""
+        """List files from Google Drive.
+        
+        Syncs one page of Drive metadata (``page_token``) into the local mirror,
+        then returns one keyset page of the mirror, most recently mirrored
+        first. Follow ``next_cursor`` with ``cursor`` and narrow with
+        ``mime_type``; ``search`` finds files by name. Pages are keyed on
+        ``created_at``, which syncing the next Drive page does not change.
+        """
         try:
             logger.debug(f"List files request from user: {request.user}")
             logger.debug(f"Auth header: {request.META.get('HTTP_AUTHORIZATION', 'No auth header')}")
@@ -69,7 +214,7 @@ class GoogleDriveViewSet(viewsets.ViewSet):
             # Get files from Google Drive
             results = drive_service.files().list(
                 pageSize=page_size,
-                fields="nextPageToken, files(id, name, mimeType, size, createdTime, modifiedTime)",
+                fields="nextPageToken, files(id, name, mimeType, size, md5Checksum, parents, createdTime, modifiedTime)",
                 q="trashed=false",
                 pageToken=page_token
             ).execute()
@@ -81,29 +226,35 @@ class GoogleDriveViewSet(viewsets.ViewSet):
             for item in items:
                 logger.debug(f"File: {item.get('name')} ({item.get('id')})")
             
-            # Save files to database
-            for item in items:
-                DriveFile.objects.update_or_create(
-                    user=request.user,
-                    file_id=item['id'],
-                    defaults={
-                        'name': item.get('name', 'Unnamed'),
-                        'mime_type': item.get('mimeType', 'unknown'),
-                        'size': item.get('size')
-                    }
-                )
+            # Save files to database in a single upsert
+            upsert_drive_files(request.user, items)
             
-            # Get updated files from database
+            # Get one keyset page of the mirrored files from database
             files = DriveFile.objects.filter(user=request.user)
+            mime_type = request.query_params.get('mime_type')
+            if mime_type:
+                files = files.filter(mime_type=mime_type)
+            
+            files, next_cursor = self.paginator.paginate(
+                files,
+                cursor=request.query_params.get('cursor'),
+                page_size=self.paginator.get_page_size(request)
+            )
             serializer = DriveFileSerializer(files, many=True)
             
             response_data = {
                 'results': serializer.data,
+                'next_cursor': next_cursor,
                 'next_page_token': next_page_token
             }
             
             return Response(response_data)
             
+        except InvalidCursor as e:
+            return Response(
+                {'error': str(e)},
+                status=status.HTTP_400_BAD_REQUEST
+            )
         except Exception as e:
             logger.error(f"Error listing files: {str(e)}")
             if 'invalid_grant' in str(e):
@@ -113,20 +264,194 @@ class GoogleDriveViewSet(viewsets.ViewSet):
                 )
             return Response(
                 {'error': f'Error listing files: {str(e)}'},
-                status=status.HTTP_500_INTERNAL_SERVER_ERROR
+                status=drive_error_status(e)
             )
     
-    @action(detail=False, methods=['post'])
-    def upload(self, request):
-        """Upload a file to Google Drive."""
+    @action(detail=False, methods=['get'])
+    def search(self, request):
+        """Search the local mirror without calling Google Drive.
+        
+        ``q`` matches file names word by word on prefixes, best matches first;
+        ``mime_type`` (repeatable), ``size_min`` and ``size_max`` narrow the
+        results. Results are keyset-paginated like ``list``; the first page
+        also carries facet counts by MIME type and size range.
+        """
         try:
-            serializer = FileUploadSerializer(data=request.data)
+            serializer = FileSearchSerializer(data=request.query_params)
             if not serializer.is_valid():
                 return Response(
                     serializer.errors,
                     status=status.HTTP_400_BAD_REQUEST
                 )
             
+            params = serializer.validated_data
+            search = FileSearch(
+                request.user,
+                q=params.get('q', ''),
+                mime_types=params.get('mime_type'),
+                size_min=params.get('size_min'),
+                size_max=params.get('size_max')
+            )
+            cursor = request.query_params.get('cursor')
+            files, next_cursor = search.paginator.paginate(
+                search.results(),
+                cursor=cursor,
+                page_size=search.paginator.get_page_size(request)
+            )
+            
+            response_data = {
+                'results': DriveFileSerializer(files, many=True).data,
+                'next_cursor': next_cursor
+            }
+            if not cursor:
+                response_data['facets'] = search.facets()
+            return Response(response_data)
+            
+        except InvalidCursor as e:
+            return Response(
+                {'error': str(e)},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        except Exception as e:
+            logger.error(f"Error searching files: {str(e)}")
+            return Response(
+                {'error': f'Error searching files: {str(e)}'},
+                status=drive_error_status(e)
+            )
+    
+    @action(detail=False, methods=['get'])
+    def children(self, request):
+        """List the mirrored contents of a folder by name, without calling Google Drive.
+        
+        ``folder_id`` is a Drive folder id, or ``root`` (the default) for My
+        Drive once a full sync has run. Keyset-paginated with ``cursor``.
+        """
+        try:
+            folder_id = resolve_folder_id(request.user, request.query_params.get('folder_id') or 'root')
+            files, next_cursor = CHILDREN_PAGINATOR.paginate(
+                children(request.user, folder_id),
+                cursor=request.query_params.get('cursor'),
+                page_size=CHILDREN_PAGINATOR.get_page_size(request)
+            )
+            return Response({
+                'folder_id': folder_id,
+                'results': DriveFileSerializer(files, many=True).data,
+                'next_cursor': next_cursor
+            })
+            
+        except InvalidCursor as e:
+            return Response(
+                {'error': str(e)},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        except Exception as e:
+            logger.error(f"Error listing folder: {str(e)}")
+            return Response(
+                {'error': f'Error listing folder: {str(e)}'},
+                status=drive_error_status(e)
+            )
+    
+    @action(detail=False, methods=['get'])
+    def subtree(self, request):
+        """List and size everything below a folder, from the local mirror.
+        
+        Files come depth first, keyset-paginated with ``cursor``; the first
+        page also carries the number of files and folders and their total
+        size. ``folder_id`` is as for ``children``.
+        """
+        try:
+            folder_id = resolve_folder_id(request.user, request.query_params.get('folder_id') or 'root')
+            files = subtree(request.user, folder_id)
+            cursor = request.query_params.get('cursor')
+            page, next_cursor = SUBTREE_PAGINATOR.paginate(
+                files,
+                cursor=cursor,
+                page_size=SUBTREE_PAGINATOR.get_page_size(request)
+            )
+            
+            response_data = {
+                'folder_id': folder_id,
+                'results': DriveFileSerializer(page, many=True).data,
+                'next_cursor': next_cursor
+            }
+            if not cursor:
+                response_data['totals'] = subtree_totals(files)
+            return Response(response_data)
+            
+        except InvalidCursor as e:
+            return Response(
+                {'error': str(e)},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        except Exception as e:
+            logger.error(f"Error listing subtree: {str(e)}")
+            return Response(
+                {'error': f'Error listing subtree: {str(e)}'},
+                status=drive_error_status(e)
+            )
+    
+    @action(detail=True, methods=['get'])
+    def path(self, request, pk=None):
+        """Folders above a mirrored file, from the top of My Drive down."""
+        try:
+            drive_file = DriveFile.objects.get(id=pk, user=request.user)
+            return Response({
+                'file': DriveFileSerializer(drive_file).data,
+                'ancestors': DriveFileSerializer(ancestors(drive_file), many=True).data
+            })
+            
+        except DriveFile.DoesNotExist:
+            return Response(
+                {'error': 'File not found'},
+                status=status.HTTP_404_NOT_FOUND
+            )
+        except Exception as e:
+            logger.error(f"Error resolving file path: {str(e)}")
+            return Response(
+                {'error': f'Error resolving file path: {str(e)}'},
+                status=drive_error_status(e)
+            )
+    
+    @action(detail=False, methods=['post'])
+    def sync(self, request):
+        """Bring the local mirror up to date using the Drive Changes API.
+        
+        Only changes since the last sync are fetched, including deletions.
+        The first sync, or one whose cursor Drive rejects, mirrors everything.
+        """
+        try:
+            drive_service = self._get_drive_service(request.user)
+            
+            if not drive_service:
+                return Response(
+                    {'error': 'Google Drive not connected'},
+                    status=status.HTTP_400_BAD_REQUEST
+                )
+            
+            return Response(incremental_sync(request.user, drive_service))
+            
+        except Exception as e:
+            logger.error(f"Error syncing files: {str(e)}")
+            if 'invalid_grant' in str(e):
+                return Response(
+                    {'error': 'Google Drive token expired. Please re-authenticate.'},
+                    status=status.HTTP_401_UNAUTHORIZED
+                )
+            return Response(
+                {'error': f'Error syncing files: {str(e)}'},
+                status=drive_error_status(e)
+            )
+    
+    @action(detail=False, methods=['post', 'delete'])
+    def watch(self, request):
+        """Start (POST) or stop (DELETE) push notifications of Drive changes.
+        
+        While a watch is open, Drive notifies ``/drive/notifications/`` of
+        every change; the mirror is then synced and clients connected to
+        ``ws/drive/`` are told, so nothing needs to poll. Channels are renewed
+        by the ``renew_drive_watches`` command.
+        """
+        try:
             drive_service = self._get_drive_service(request.user)
             
             if not drive_service:
@@ -135,64 +460,142 @@ class GoogleDriveViewSet(viewsets.ViewSet):
                     status=status.HTTP_400_BAD_REQUEST
                 )
             
-            file_obj = serializer.validated_data['file']
-            folder_id = serializer.validated_data.get('folder_id', None)
+            if request.method == 'DELETE':
+                stop_watching(request.user, drive_service)
+                return Response(status=status.HTTP_204_NO_CONTENT)
+            
+            if not settings.GOOGLE_DRIVE_WEBHOOK_URL:
+                return Response(
+                    {'error': 'Drive push notifications are not configured'},
+                    status=status.HTTP_400_BAD_REQUEST
+                )
             
-            # Save file to temporary location
-            with tempfile.NamedTemporaryFile(delete=False) as temp_file:
-                for chunk in file_obj.chunks():
-                    temp_file.write(chunk)
-                temp_file_path = temp_file.name
+            channel = ensure_watch(request.user, drive_service)
+            return Response({'channel_id': channel.channel_id, 'expiration': channel.expiration})
+            
+        except Exception as e:
+            logger.error(f"Error watching Drive changes: {str(e)}")
+            return Response(
+                {'error': f'Error watching Drive changes: {str(e)}'},
+                status=drive_error_status(e)
+            )
+    
+    @action(
+        detail=False,
+        methods=['post'],
+        authentication_classes=[HeaderOnlyOAuth2Authentication, SocialAuthentication, TokenAuthentication]
+    )
+    def upload(self, request):
+        """Upload a file to Google Drive.
+        
+        The file is streamed into a Drive resumable-upload session while the
+        request body is parsed rather than saved as an upload file. Under
+        daphne the body itself is still spooled to a temporary file by Django
+        before parsing starts. Pass ``folder_id`` as a
+        query parameter so the file is created in place; a ``folder_id`` form
+        field only arrives after the upload and costs an extra move.
+
+        Pass the file's hex ``md5_checksum`` as a query parameter too, and an
+        identical file already in the mirror is reused instead of uploading a
+        copy: returned as it is if it already has this name in the target
+        folder (My Drive by default), otherwise copied there within Drive.
+        Either way the response has ``deduplicated`` set.
+        """
+        try:
+            credentials = service_pool.get_credentials(request.user)
+            
+            if not credentials:
+                return Response(
+                    {'error': 'Google Drive not connected'},
+                    status=status.HTTP_400_BAD_REQUEST
+                )
+            
+            # Must be installed before request.data is first accessed
+            query_folder_id = request.query_params.get('folder_id')
+            md5_checksum = parse_md5(request.query_params.get('md5_checksum'))
+            request.upload_handlers.insert(
+                0, DriveUploadHandler(request, credentials, folder_id=query_folder_id, md5_checksum=md5_checksum)
+            )
             
             try:
-                # Prepare file metadata
-                file_metadata = {
-                    'name': file_obj.name
-                }
-                
-                # If folder_id is provided, set parent folder
-                if folder_id:
-                    file_metadata['parents'] = [folder_id]
-                
-                # Upload file to Google Drive
-                media = MediaFileUpload(
-                    temp_file_path,
-                    mimetype=file_obj.content_type,
-                    resumable=True
+                serializer = FileUploadSerializer(data=request.data)
+            except UploadChecksumMismatch as e:
+                return Response(
+                    {'error': str(e)},
+                    status=status.HTTP_400_BAD_REQUEST
                 )
-                
-                file = drive_service.files().create(
-                    body=file_metadata,
-                    media_body=media,
-                    fields='id, name, mimeType, size'
-                ).execute()
-                
-                # Save file to database
-                drive_file = DriveFile.objects.create(
-                    user=request.user,
-                    file_id=file['id'],
-                    name=file['name'],
-                    mime_type=file['mimeType'],
-                    size=file.get('size')
+            if not serializer.is_valid():
+                self._discard_upload(request)
+                return Response(
+                    serializer.errors,
+                    status=status.HTTP_400_BAD_REQUEST
                 )
-                
-                serializer = DriveFileSerializer(drive_file)
-                return Response(serializer.data, status=status.HTTP_201_CREATED)
-                
-            finally:
-                # Clean up temporary file
-                os.unlink(temp_file_path)
+            
+            uploaded = serializer.validated_data['file']
+            folder_id = serializer.validated_data.get('folder_id', None)
+            if uploaded.duplicate is not None:
+                duplicate = uploaded.duplicate
+                target_id = resolve_folder_id(request.user, folder_id or query_folder_id or 'root')
+                if duplicate.parent_id != target_id or duplicate.name != uploaded.name:
+                    return self._copy_duplicate(request, duplicate, target_id, uploaded.name)
+                data = DriveFileSerializer(duplicate).data
+                data['deduplicated'] = True
+                return Response(data, status=status.HTTP_200_OK)
+            
+            file = uploaded.drive_file
+            
+            # If folder_id came in the form body, move the file into it
+            if folder_id and folder_id != query_folder_id:
+                drive_service = self._get_drive_service(request.user)
+                file = drive_service.files().update(
+                    fileId=file['id'],
+                    addParents=folder_id,
+                    removeParents=','.join(file.get('parents', [])),
+                    fields=FILE_FIELDS
+                ).execute()
+            
+            # Save file to database
+            upsert_drive_files(request.user, [file])
+            drive_file = DriveFile.objects.get(user=request.user, file_id=file['id'])
+            
+            serializer = DriveFileSerializer(drive_file)
+            return Response(serializer.data, status=status.HTTP_201_CREATED)
                 
         except Exception as e:
             logger.error(f"Error uploading file: {str(e)}")
             return Response(
                 {'error': f'Error uploading file: {str(e)}'},
-                status=status.HTTP_500_INTERNAL_SERVER_ERROR
+                status=drive_error_status(e)
             )
     
+    def _copy_duplicate(self, request, duplicate, folder_id, name):
+        """Copy an identical file into ``folder_id`` as ``name`` within Drive, instead of uploading it again."""
+        drive_service = self._get_drive_service(request.user)
+        file = drive_service.files().copy(
+            fileId=duplicate.file_id,
+            body={'name': name, 'parents': [folder_id]},
+            fields=FILE_FIELDS
+        ).execute()
+        upsert_drive_files(request.user, [file])
+        data = DriveFileSerializer(DriveFile.objects.get(user=request.user, file_id=file['id'])).data
+        data['deduplicated'] = True
+        return Response(data, status=status.HTTP_201_CREATED)
+    
+    def _discard_upload(self, request):
+        """Delete a file already streamed to Drive by a request that was rejected."""
+        uploaded = request.FILES.get('file')
+        drive_file = getattr(uploaded, 'drive_file', None)
+        if drive_file is None:
+            return
+        try:
+            self._get_drive_service(request.user).files().delete(fileId=drive_file['id']).execute()
+        except Exception as e:
+            logger.error(f"Could not delete rejected upload {drive_file['id']}: {str(e)}")
+    
     @action(detail=True, methods=['get'])
     def download(self, request, pk=None):
         """Download a file from Google Drive."""
+        started = time.monotonic()
         try:
             drive_file = DriveFile.objects.get(id=pk, user=request.user)
             
@@ -204,61 +607,19 @@ class GoogleDriveViewSet(viewsets.ViewSet):
                     status=status.HTTP_400_BAD_REQUEST
                 )
             
-            # Create a BytesIO object to store the downloaded file
-            file_buffer = io.BytesIO()
-            
-            # Check if this is a Google Workspace file (Docs, Sheets, Slides, etc.)
-            if drive_file.mime_type in [
-                'application/vnd.google-apps.document',
-                'application/vnd.google-apps.spreadsheet',
-                'application/vnd.google-apps.presentation',
-                'application/vnd.google-apps.drawing',
-            ]:
-                # Map Google Workspace MIME types to export formats
-                export_formats = {
-                    'application/vnd.google-apps.document': 'application/pdf',
-                    'application/vnd.google-apps.spreadsheet': 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
-                    'application/vnd.google-apps.presentation': 'application/vnd.openxmlformats-officedocument.presentationml.presentation',
-                    'application/vnd.google-apps.drawing': 'application/pdf',
-                }
-                
-                # Get the appropriate export format
-                export_mime_type = export_formats.get(drive_file.mime_type)
-                
-                # Export the file
-                request = drive_service.files().export_media(
-                    fileId=drive_file.file_id,
-                    mimeType=export_mime_type
-                )
-                
-                # Set appropriate file extension
-                extension_map = {
-                    'application/pdf': '.pdf',
-                    'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet': '.xlsx',
-                    'application/vnd.openxmlformats-officedocument.presentationml.presentation': '.pptx',
-                }
-                ext = extension_map.get(export_mime_type, '')
-                filename = f"{drive_file.name}{ext}"
-                
-            else:
-                # For regular files, use get_media
-                request = drive_service.files().get_media(fileId=drive_file.file_id)
-                filename = drive_file.name
-            
-            # Download the file
-            downloader = MediaIoBaseDownload(file_buffer, request)
-            done = False
-            while not done:
-                status_download, done = downloader.next_chunk()
-            
-            # Reset the file pointer to the beginning
-            file_buffer.seek(0)
+            # Metadata-only call to revalidate the cached copy
+            file_metadata = drive_service.files().get(
+                fileId=drive_file.file_id,
+                fields=DOWNLOAD_METADATA_FIELDS
+            ).execute()
             
-            # Return the file as a response
-            return FileResponse(
-                file_buffer,
-                as_attachment=True,
-                filename=filename
+            return self._download_response(
+                request,
+                drive_service,
+                drive_file.file_id,
+                file_metadata,
+                started,
+                request.query_params.get('export_format')
             )
             
         except DriveFile.DoesNotExist:
@@ -266,11 +627,16 @@ class GoogleDriveViewSet(viewsets.ViewSet):
                 {'error': 'File not found'},
                 status=status.HTTP_404_NOT_FOUND
             )
+        except UnsupportedExportFormat as e:
+            return Response(
+                {'error': str(e)},
+                status=status.HTTP_400_BAD_REQUEST
+            )
         except Exception as e:
             logger.error(f"Error downloading file: {str(e)}")
             return Response(
                 {'error': f'Error downloading file: {str(e)}'},
-                status=status.HTTP_500_INTERNAL_SERVER_ERROR
+                status=drive_error_status(e)
             )
 
     @action(detail=False, methods=['get'])
@@ -282,6 +648,15 @@ class GoogleDriveViewSet(viewsets.ViewSet):
             'auth_header': request.META.get('HTTP_AUTHORIZATION', 'No auth header')[:20] + '...' if request.META.get('HTTP_AUTHORIZATION') else 'None'
         })
 
+    @action(detail=False, methods=['get'], permission_classes=[IsAdminUser])
+    def stats(self, request):
+        """Process-wide counters for the Drive integration."""
+        data = snapshot_all()
+        data['service_pool'] = service_pool.stats()
+        data['content_cache'] = content_cache.stats()
+        data['rendition_cache'] = rendition_cache.stats()
+        return Response(data)
+
     @action(detail=False, methods=['get'])
     def picker_config(self, request):
         """Get configuration for Google Picker API."""
@@ -308,7 +683,7 @@ class GoogleDriveViewSet(viewsets.ViewSet):
             logger.error(f"Error getting picker config: {str(e)}")
             return Response(
                 {'error': f'Error getting picker config: {str(e)}'},
-                status=status.HTTP_500_INTERNAL_SERVER_ERROR
+                status=drive_error_status(e)
             )
 
     @action(detail=False, methods=['post'])
@@ -331,18 +706,11 @@ class GoogleDriveViewSet(viewsets.ViewSet):
                 )
             
             # Get file metadata from Google Drive
-            file = drive_service.files().get(fileId=file_id, fields='id,name,mimeType,size').execute()
+            file = drive_service.files().get(fileId=file_id, fields=FILE_FIELDS).execute()
             
             # Save file to database
-            drive_file, created = DriveFile.objects.update_or_create(
-                user=request.user,
-                file_id=file['id'],
-                defaults={
-                    'name': file.get('name', 'Unnamed'),
-                    'mime_type': file.get('mimeType', 'unknown'),
-                    'size': file.get('size')
-                }
-            )
+            upsert_drive_files(request.user, [file])
+            drive_file = DriveFile.objects.get(user=request.user, file_id=file['id'])
             
             serializer = DriveFileSerializer(drive_file)
             return Response(serializer.data)
@@ -351,7 +719,149 @@ class GoogleDriveViewSet(viewsets.ViewSet):
             logger.error(f"Error importing file: {str(e)}")
             return Response(
                 {'error': f'Error importing file: {str(e)}'},
-                status=status.HTTP_500_INTERNAL_SERVER_ERROR
+                status=drive_error_status(e)
+            )
+
+    @action(detail=False, methods=['post'], parser_classes=[JSONParser, MultiPartParser, FormParser])
+    def import_files(self, request):
+        """Import many files from Google Drive at once.
+        
+        Metadata is fetched with Drive batch requests (up to 100 files each)
+        and stored with a single upsert. Each requested id gets its own
+        success or error entry in the response.
+        """
+        try:
+            serializer = FileImportSerializer(data=request.data)
+            if not serializer.is_valid():
+                return Response(
+                    serializer.errors,
+                    status=status.HTTP_400_BAD_REQUEST
+                )
+            
+            drive_service = self._get_drive_service(request.user)
+            
+            if not drive_service:
+                return Response(
+                    {'error': 'Google Drive not connected'},
+                    status=status.HTTP_400_BAD_REQUEST
+                )
+            
+            file_ids = serializer.validated_data['file_ids']
+            files, errors = fetch_files_metadata(drive_service, file_ids)
+            
+            # Save every fetched file to database in one statement
+            upsert_drive_files(request.user, files.values())
+            drive_files = {
+                drive_file.file_id: drive_file
+                for drive_file in DriveFile.objects.filter(user=request.user, file_id__in=[f['id'] for f in files.values()])
+            }
+            
+            results = []
+            for file_id in dict.fromkeys(file_ids):
+                file = files.get(file_id)
+                if file is not None and file['id'] in drive_files:
+                    results.append({
+                        'file_id': file_id,
+                        'status': 'imported',
+                        'file': DriveFileSerializer(drive_files[file['id']]).data
+                    })
+                else:
+                    results.append({
+                        'file_id': file_id,
+                        'status': 'error',
+                        'error': errors.get(file_id, 'File not returned by Google Drive')
+                    })
+            
+            return Response({
+                'imported': len(files),
+                'failed': len(results) - len(files),
+                'results': results
+            })
+            
+        except Exception as e:
+            logger.error(f"Error importing files: {str(e)}")
+            return Response(
+                {'error': f'Error importing files: {str(e)}'},
+                status=drive_error_status(e)
+            )
+
+    @action(detail=False, methods=['post'], parser_classes=[JSONParser, MultiPartParser, FormParser])
+    def archive(self, request):
+        """Download many files as one ZIP archive.
+        
+        Takes either ``ids`` of mirrored DriveFiles or a Drive ``folder_id``
+        (included recursively). The archive is streamed while its entries are
+        fetched from Drive in parallel; Workspace files are exported as in
+        ``download``.
+        """
+        try:
+            serializer = ArchiveSerializer(data=request.data)
+            if not serializer.is_valid():
+                return Response(
+                    serializer.errors,
+                    status=status.HTTP_400_BAD_REQUEST
+                )
+            
+            drive_service = self._get_drive_service(request.user)
+            
+            if not drive_service:
+                return Response(
+                    {'error': 'Google Drive not connected'},
+                    status=status.HTTP_400_BAD_REQUEST
+                )
+            
+            folder_id = serializer.validated_data.get('folder_id')
+            if folder_id:
+                folder = drive_service.files().get(fileId=folder_id, fields='name').execute()
+                archive_name = f"{folder.get('name', 'drive-folder')}.zip"
+                tree = list_folder_tree(drive_service, folder_id)
+            else:
+                archive_name = 'drive-files.zip'
+                drive_files = DriveFile.objects.filter(
+                    user=request.user, id__in=serializer.validated_data['ids']
+                )
+                tree = [
+                    ('', {'id': f.file_id, 'name': f.name, 'mimeType': f.mime_type})
+                    for f in drive_files
+                ]
+                if not tree:
+                    return Response(
+                        {'error': 'File not found'},
+                        status=status.HTTP_404_NOT_FOUND
+                    )
+            
+            def open_entry(file):
+                media_request, _, _ = self._media_request(
+                    drive_service, file['id'], file['mimeType'], file['name']
+                )
+                return iter_media(media_request)
+            
+            entries = []
+            for directory, file in tree:
+                filename = file['name']
+                export_mime_type = resolve_export_format(file['mimeType'])
+                if export_mime_type:
+                    filename = export_filename(filename, export_mime_type)
+                entries.append((posixpath.join(directory, safe_name(filename)), file))
+            
+            response = IncrementalStreamingHttpResponse(
+                iter_zip(entries, open_entry),
+                content_type='application/zip'
+            )
+            response['Content-Disposition'] = content_disposition_header(True, archive_name)
+            response['X-Accel-Buffering'] = 'no'
+            return response
+            
+        except ArchiveTooLarge as e:
+            return Response(
+                {'error': str(e)},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        except Exception as e:
+            logger.error(f"Error building archive: {str(e)}")
+            return Response(
+                {'error': f'Error building archive: {str(e)}'},
+                status=drive_error_status(e)
             )
 
     @action(detail=False, methods=['get'])
@@ -382,12 +892,13 @@ class GoogleDriveViewSet(viewsets.ViewSet):
             logger.error(f"Error listing files directly: {str(e)}")
             return Response(
                 {'error': f'Error listing files: {str(e)}'},
-                status=status.HTTP_500_INTERNAL_SERVER_ERROR
+                status=drive_error_status(e)
             )
 
     @action(detail=False, methods=['get'])
     def direct_download(self, request):
         """Download a file from Google Drive using the file_id."""
+        started = time.monotonic()
         try:
             file_id = request.query_params.get('file_id')
             if not file_id:
@@ -404,77 +915,62 @@ class GoogleDriveViewSet(viewsets.ViewSet):
                     status=status.HTTP_400_BAD_REQUEST
                 )
             
-            # Get file metadata to get the filename and mime type
+            # Get file metadata to get the filename, mime type, size and version
             file_metadata = drive_service.files().get(
                 fileId=file_id,
-                fields='name,mimeType'
+                fields=DOWNLOAD_METADATA_FIELDS
             ).execute()
             
-            filename = file_metadata.get('name', 'downloaded_file')
-            mime_type = file_metadata.get('mimeType', '')
-            
-            # Create a BytesIO object to store the downloaded file
-            file_buffer = io.BytesIO()
-            
-            # Check if this is a Google Workspace file (Docs, Sheets, Slides, etc.)
-            if mime_type in [
-                'application/vnd.google-apps.document',
-                'application/vnd.google-apps.spreadsheet',
-                'application/vnd.google-apps.presentation',
-                'application/vnd.google-apps.drawing',
-            ]:
-                # Map Google Workspace MIME types to export formats
-                export_formats = {
-                    'application/vnd.google-apps.document': 'application/pdf',
-                    'application/vnd.google-apps.spreadsheet': 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
-                    'application/vnd.google-apps.presentation': 'application/vnd.openxmlformats-officedocument.presentationml.presentation',
-                    'application/vnd.google-apps.drawing': 'application/pdf',
-                }
-                
-                # Get the appropriate export format
-                export_mime_type = export_formats.get(mime_type)
-                
-                # Export the file
-                request = drive_service.files().export_media(
-                    fileId=file_id,
-                    mimeType=export_mime_type
-                )
-                
-                # Set appropriate file extension
-                extension_map = {
-                    'application/pdf': '.pdf',
-                    'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet': '.xlsx',
-                    'application/vnd.openxmlformats-officedocument.presentationml.presentation': '.pptx',
-                }
-                ext = extension_map.get(export_mime_type, '')
-                filename = f"{filename}{ext}"
-                
-            else:
-                # For regular files, use get_media
-                request = drive_service.files().get_media(fileId=file_id)
-            
-            # Download the file
-            downloader = MediaIoBaseDownload(file_buffer, request)
-            done = False
-            while not done:
-                status_download, done = downloader.next_chunk()
-            
-            # Reset the file pointer to the beginning
-            file_buffer.seek(0)
-            
-            # Return the file as a response
-            return FileResponse(
-                file_buffer,
-                as_attachment=True,
-                filename=filename
+            return self._download_response(
+                request,
+                drive_service,
+                file_id,
+                file_metadata,
+                started,
+                request.query_params.get('export_format')
             )
                 
+        except UnsupportedExportFormat as e:
+            return Response(
+                {'error': str(e)},
+                status=status.HTTP_400_BAD_REQUEST
+            )
         except Exception as e:
             logger.error(f"Error downloading file directly: {str(e)}")
             return Response(
                 {'error': f'Error downloading file: {str(e)}'},
-                status=status.HTTP_500_INTERNAL_SERVER_ERROR
+                status=drive_error_status(e)
             )
 
 class GooglePickerView(TemplateView):
     template_name = 'drive/picker.html'
+
+@csrf_exempt
+@require_POST
+def drive_notifications(request):
+    """Webhook for Drive push notifications (see GoogleDriveViewSet.watch).
+
+    Answers at once; the sync a change calls for is debounced and run in
+    the background. Anything not from a known channel is refused with 403.
+    """
+    # The first message of a channel only confirms it was opened, and may
+    # arrive before the channel is saved; it triggers nothing either way
+    if request.headers.get('X-Goog-Resource-State') == 'sync':
+        return HttpResponse(status=status.HTTP_200_OK)
+
+    channel = authenticate_notification(request.headers)
+    if channel is None:
+        notification_metrics.incr('rejected')
+        logger.warning(f"Rejected Drive notification for channel {request.headers.get('X-Goog-Channel-Id')}")
+        return HttpResponse(status=status.HTTP_403_FORBIDDEN)
+
+    notification_metrics.incr('received')
+    try:
+        message_number = int(request.headers.get('X-Goog-Message-Number', ''))
+    except ValueError:
+        return HttpResponse(status=status.HTTP_400_BAD_REQUEST)
+    if accept_message(channel, message_number):
+        debouncer.notify(channel.user_id)
+    else:
+        notification_metrics.incr('replayed')
+    return HttpResponse(status=status.HTTP_200_OK)
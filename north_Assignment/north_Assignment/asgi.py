@@ -10,14 +10,15 @@ os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'north_Assignment.settings')
 # Initialize Django
 django.setup()
 
-# Import chat routing after Django setup
+# Import chat and drive routing after Django setup
 from chat import routing
+from drive import routing as drive_routing
 
 application = ProtocolTypeRouter({
     "http": get_asgi_application(),
     "websocket": AuthMiddlewareStack(
         URLRouter(
-            routing.websocket_urlpatterns
+            routing.websocket_urlpatterns + drive_routing.websocket_urlpatterns
         )
     ),
 })
\ No newline at end of file
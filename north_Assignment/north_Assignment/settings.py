@@ -40,6 +40,7 @@ INSTALLED_APPS = [
     'django.contrib.sessions',
     'django.contrib.messages',
     'django.contrib.staticfiles',
+    'django.contrib.postgres',
     
     # Third-party apps
     'channels',
@@ -234,16 +235,103 @@ SOCIAL_AUTH_AUTHENTICATION_BACKENDS = (
     'social_core.backends.google.GoogleOAuth2',
 )
 
+# Google Drive settings
+# Root URL of the Drive API (default https://www.googleapis.com/); point it at `manage.py fake_drive_server` for local testing
+GOOGLE_DRIVE_API_ROOT = config('GOOGLE_DRIVE_API_ROOT', default='')
+# Number of per-user Drive service objects kept in the process-wide LRU pool
+GOOGLE_DRIVE_SERVICE_POOL_SIZE = config('GOOGLE_DRIVE_SERVICE_POOL_SIZE', default=256, cast=int)
+# Optional path to a Drive v3 discovery document; defaults to the copy bundled with google-api-python-client
+GOOGLE_DRIVE_DISCOVERY_DOCUMENT = config('GOOGLE_DRIVE_DISCOVERY_DOCUMENT', default='')
+# Drive calls per second allowed across the process and per user (0 disables a limit)
+GOOGLE_DRIVE_RATE_LIMIT = config('GOOGLE_DRIVE_RATE_LIMIT', default=100.0, cast=float)
+GOOGLE_DRIVE_USER_RATE_LIMIT = config('GOOGLE_DRIVE_USER_RATE_LIMIT', default=20.0, cast=float)
+# Retries of Drive calls that hit a rate limit or a 5xx, and the first backoff in seconds (doubled per retry, jittered)
+GOOGLE_DRIVE_MAX_RETRIES = config('GOOGLE_DRIVE_MAX_RETRIES', default=5, cast=int)
+GOOGLE_DRIVE_RETRY_BASE_DELAY = config('GOOGLE_DRIVE_RETRY_BASE_DELAY', default=0.5, cast=float)
+# Bytes fetched from Drive per chunk when streaming downloads; bounds memory per download
+GOOGLE_DRIVE_DOWNLOAD_CHUNK_SIZE = config('GOOGLE_DRIVE_DOWNLOAD_CHUNK_SIZE', default=1024 * 1024, cast=int)
+# Downloads of files this large (0 disables) are fetched as parallel byte ranges: workers per download and bytes per range
+GOOGLE_DRIVE_PARALLEL_DOWNLOAD_THRESHOLD = config('GOOGLE_DRIVE_PARALLEL_DOWNLOAD_THRESHOLD', default=64 * 1024 * 1024, cast=int)
+GOOGLE_DRIVE_PARALLEL_DOWNLOAD_WORKERS = config('GOOGLE_DRIVE_PARALLEL_DOWNLOAD_WORKERS', default=4, cast=int)
+GOOGLE_DRIVE_PARALLEL_DOWNLOAD_PART_SIZE = config('GOOGLE_DRIVE_PARALLEL_DOWNLOAD_PART_SIZE', default=16 * 1024 * 1024, cast=int)
+# Bytes sent per resumable-upload request (rounded down to a multiple of 256 KiB); bounds memory per upload
+GOOGLE_DRIVE_UPLOAD_CHUNK_SIZE = config('GOOGLE_DRIVE_UPLOAD_CHUNK_SIZE', default=8 * 1024 * 1024, cast=int)
+# Reuse of an identical mirrored file on upload: off, hint (only with a client-sent md5) or spool (hash every upload before sending it)
+GOOGLE_DRIVE_UPLOAD_DEDUP = config('GOOGLE_DRIVE_UPLOAD_DEDUP', default='hint')
+# Public HTTPS URL of /drive/notifications/ that Drive posts changes to; empty disables push notifications
+GOOGLE_DRIVE_WEBHOOK_URL = config('GOOGLE_DRIVE_WEBHOOK_URL', default='')
+# Lifetime asked for a notification channel (Drive caps it at a week) and how long before expiry it is renewed, in seconds
+GOOGLE_DRIVE_WATCH_TTL = config('GOOGLE_DRIVE_WATCH_TTL', default=24 * 60 * 60, cast=int)
+GOOGLE_DRIVE_WATCH_RENEW_BEFORE = config('GOOGLE_DRIVE_WATCH_RENEW_BEFORE', default=60 * 60, cast=int)
+# Seconds a notification waits before syncing, so a burst of changes costs one sync
+GOOGLE_DRIVE_NOTIFICATION_DEBOUNCE = config('GOOGLE_DRIVE_NOTIFICATION_DEBOUNCE', default=5.0, cast=float)
+# Local disk cache of downloaded Drive files; a budget of 0 disables it
+GOOGLE_DRIVE_CACHE_DIR = config('GOOGLE_DRIVE_CACHE_DIR', default=os.path.join(BASE_DIR, 'drive_cache'))
+GOOGLE_DRIVE_CACHE_MAX_BYTES = config('GOOGLE_DRIVE_CACHE_MAX_BYTES', default=1024 * 1024 * 1024, cast=int)
+# Separate budget for converted exports of Google Docs/Sheets/Slides/Drawings; 0 disables it
+GOOGLE_DRIVE_RENDITION_CACHE_MAX_BYTES = config('GOOGLE_DRIVE_RENDITION_CACHE_MAX_BYTES', default=512 * 1024 * 1024, cast=int)
+# Export formats offered per Google Workspace type; the first one is the default
+GOOGLE_DRIVE_EXPORT_FORMATS = {
+    'application/vnd.google-apps.document': [
+        'application/pdf',
+        'application/vnd.openxmlformats-officedocument.wordprocessingml.document',
+        'application/vnd.oasis.opendocument.text',
+        'application/rtf',
+        'application/epub+zip',
+        'text/plain',
+        'text/markdown',
+    ],
+    'application/vnd.google-apps.spreadsheet': [
+        'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
+        'application/pdf',
+        'application/vnd.oasis.opendocument.spreadsheet',
+        'text/csv',
+        'text/tab-separated-values',
+    ],
+    'application/vnd.google-apps.presentation': [
+        'application/vnd.openxmlformats-officedocument.presentationml.presentation',
+        'application/pdf',
+        'application/vnd.oasis.opendocument.presentation',
+        'text/plain',
+    ],
+    'application/vnd.google-apps.drawing': [
+        'application/pdf',
+        'image/png',
+        'image/jpeg',
+        'image/svg+xml',
+    ],
+}
+# Parallel Drive downloads per ZIP archive, and the most files one archive may hold
+GOOGLE_DRIVE_ARCHIVE_WORKERS = config('GOOGLE_DRIVE_ARCHIVE_WORKERS', default=4, cast=int)
+GOOGLE_DRIVE_ARCHIVE_MAX_FILES = config('GOOGLE_DRIVE_ARCHIVE_MAX_FILES', default=1000, cast=int)
+# Connections the async Drive endpoints keep open to Google per process, and their read timeout in seconds
+GOOGLE_DRIVE_ASYNC_MAX_CONNECTIONS = config('GOOGLE_DRIVE_ASYNC_MAX_CONNECTIONS', default=100, cast=int)
+GOOGLE_DRIVE_ASYNC_TIMEOUT = config('GOOGLE_DRIVE_ASYNC_TIMEOUT', default=60.0, cast=float)
+
+REDIS_HOST = config('REDIS_HOST', default='redis')
+REDIS_PORT = config('REDIS_PORT', default=6379, cast=int)
+
 # Channel settings for WebSocket
 CHANNEL_LAYERS = {
     'default': {
         'BACKEND': 'channels_redis.core.RedisChannelLayer',
         'CONFIG': {
-            "hosts": [(config('REDIS_HOST', default='redis'), config('REDIS_PORT', default=6379, cast=int))],
+            "hosts": [(REDIS_HOST, REDIS_PORT)],
         },
     },
 }
 
+# Chat settings
+# Buffer chat messages in a Redis stream and save them in batches (persist_chat_messages must be running).
+# Only with a persistent Redis (AOF): a restart loses whatever the stream holds.
+CHAT_WRITE_BEHIND = config('CHAT_WRITE_BEHIND', default=True, cast=bool)
+CHAT_REDIS_URL = config('CHAT_REDIS_URL', default=f'redis://{REDIS_HOST}:{REDIS_PORT}/0')
+# Most messages per INSERT, and seconds a batch may wait to fill up
+CHAT_PERSIST_BATCH_SIZE = config('CHAT_PERSIST_BATCH_SIZE', default=500, cast=int)
+CHAT_PERSIST_INTERVAL = config('CHAT_PERSIST_INTERVAL', default=0.5, cast=float)
+# Seconds a message may stay unsaved; past it without a live worker, consumers save messages directly
+CHAT_PERSIST_MAX_LAG = config('CHAT_PERSIST_MAX_LAG', default=5.0, cast=float)
+
 ASGI_APPLICATION = 'north_Assignment.asgi.application'
 
 # Authentication backends